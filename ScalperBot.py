@@ -1,17 +1,37 @@
 import os
 import json
+import atexit
+import signal
 import ccxt
 import time
 import logging
 import threading
+import heapq
+import math
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import telebot
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from datetime import datetime
 import sys
 import io
 import sqlite3
-from calendar import monthrange
+import requests
+from requests.adapters import HTTPAdapter
 import fetch_deposits
+from price_stream import PriceStream
+from subscriber_index import SubscriberIndex
+from dca_strategy import DcaStrategy
+from backtest import fetch_ohlcv_history
+from optimizer import optimize, random_candidates, format_table
+from user_stream import UserDataStreams
+from settings_store import open_settings_store, SettingsWriter
+from profit_ledger import (LedgerWriter, migrate_profit_db, rebuild_rollups, SELECT_MONTH_PROFIT, SELECT_USER_TOTALS,
+                           SELECT_USER_MONTHS, SELECT_RECENT_TRADES)
+from rate_limiter import RequestScheduler, PRIORITY_ORDER, request_priority
+from telegram_queue import OutboundQueue
+from notifications import TradeNotifier, NOTIFY_INSTANT, parse_notify_mode, describe_notify_mode
+from wallet_pool import WalletPool, load_wallets
 import psutil
 import dotenv
 from dotenv import load_dotenv
@@ -24,45 +44,63 @@ if sys.stdout.encoding != 'utf-8':
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
 
-# Создание БД
+# Создание и миграция БД
 def init_profit_db():
-    conn = sqlite3.connect('profits.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS profits
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER NOT NULL,
-                  profit REAL NOT NULL,
-                  timestamp REAL NOT NULL,
-                  symbol TEXT NOT NULL,
-                  buy_price REAL NOT NULL,
-                  sell_price REAL NOT NULL)''')
-
-    # Добавляем индексы
-    c.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON profits (user_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON profits (timestamp)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_symbol ON profits (symbol)")
-
-    conn.commit()
-    conn.close()
+    initial, version = migrate_profit_db('profits.db')
+    if initial != version:
+        logger.info(f"Схема profits.db обновлена: версия {initial} -> {version}")
 
 
 # Конфигурация
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 SETTINGS_PATH = "trading_bot_settings.json"
+SETTINGS_DB_PATH = "trading_bot_settings.db"
+SETTINGS_BACKEND = os.getenv("SETTINGS_BACKEND", "sqlite")  # sqlite - строка на пользователя, json - исходный файл
+SETTINGS_FLUSH_INTERVAL = 0.5  # секунд между пакетными записями измененных пользователей
 LOG_FILE = "bot_errors.log"
 PRICE_UPDATE_INTERVAL = 10  # секунд
+PRICE_BATCH_SIZE = 100  # максимум символов в одном запросе fetch_tickers
+PRICE_STREAM_ENABLED = os.getenv("PRICE_STREAM", "0") == "1"  # потоковые цены через WebSocket
+MEXC_WS_URL = os.getenv("MEXC_WS_URL")  # например, адрес fake_mexc_ws.py для тестов
+MEXC_API_URL = os.getenv("MEXC_API_URL")  # REST API биржи, например, адрес mock_mexc.py для тестов
+PRICE_STREAM_RECORD = os.getenv("PRICE_STREAM_RECORD")  # файл для записи тиков
+TRADING_WORKERS = int(os.getenv("TRADING_WORKERS", "32"))  # потоков в общем торговом пуле
+ORDER_CHECK_INTERVAL = 2  # минимальный интервал проверки активных ордеров, секунд
+ORDER_CHECK_MAX_INTERVAL = 20  # максимальный интервал, если ордера не меняются
+ORDER_CHECK_BACKOFF = 1.5  # множитель интервала при отсутствии изменений
+ORDER_CHECK_STREAM_INTERVAL = 60  # страховочный опрос, когда исполнения приходят из приватного потока
+BALANCE_REFRESH_INTERVAL = 300  # секунд между фоновыми сверками баланса с биржей
+BALANCE_BACKOFF_MIN = 5  # первая пауза при нехватке средств, секунд
+BALANCE_BACKOFF_MAX = 900  # максимальная пауза при нехватке средств, секунд
+USER_STREAM_ENABLED = os.getenv("USER_STREAM", "0") == "1"  # приватный поток исполнений ордеров
+EXCHANGE_IP_RATE = 20  # вес запросов в секунду на публичный эндпоинт с одного IP
+EXCHANGE_KEY_RATE = 20  # вес запросов в секунду на API-ключ
+EXCHANGE_IP_TOTAL_RATE = float(os.getenv("EXCHANGE_IP_TOTAL_RATE", "0"))  # общий лимит IP, 0 - без него
+EXCHANGE_MAX_WAIT = 30  # секунд ожидания доли лимита до ошибки RateLimitExceeded
+EXCHANGE_IDLE_TTL = 1800  # секунд без запросов до выгрузки клиента биржи из пула
+MARKETS_RELOAD_INTERVAL = 6 * 3600  # секунд между обновлениями общего справочника рынков
+TELEGRAM_GLOBAL_RATE = 30  # сообщений в секунду на бота (лимит Telegram)
+TELEGRAM_CHAT_INTERVAL = 1.0  # секунд между сообщениями в один чат
+TELEGRAM_SEND_WORKERS = 4  # потоков отправки уведомлений
+SUBSCRIPTION_CHECK_INTERVAL = 60  # проверять подписку каждые 60 секунд
+SUGGEST_DEFAULT_DAYS = 7  # история для подбора параметров по умолчанию, дней
+SUGGEST_MAX_DAYS = 30
+SUGGEST_CANDIDATES = 300  # вариантов в случайном поиске
+SUGGEST_CACHE_TTL = 3600  # секунд, сколько результаты подбора считаются свежими
+SUGGEST_WORKERS = max(1, (os.cpu_count() or 1) // 2)  # процессов подбора: остальные ядра - торговле и ценам
 ADMINS_ID = [2044576483, 6060803148]
 start_time = time.time()
 
-WALLETS = ["0x45c68833dd040FfacCC009bB811299bF50380fC8",
-           "0x15001369896D53cd69139705C14028343f2ea1af",
-           "0x28F31a6bb7A6De1F17F24e57Bb0Fcc6C8993E10b",
-           "0x1A20Fde6451bd02d9dc685bb45545ae9F422b37d",
-           "0xEE9EAD813B4d6cB655d5045d8e7106FB2D8038aE"]
-active_wallets = []  # Кошельки в обработке
+DEFAULT_WALLETS = ["0x45c68833dd040FfacCC009bB811299bF50380fC8",
+                   "0x15001369896D53cd69139705C14028343f2ea1af",
+                   "0x28F31a6bb7A6De1F17F24e57Bb0Fcc6C8993E10b",
+                   "0x1A20Fde6451bd02d9dc685bb45545ae9F422b37d",
+                   "0xEE9EAD813B4d6cB655d5045d8e7106FB2D8038aE"]
+# Кошельки для оплаты: файл WALLETS_FILE (адрес на строку) или PAYMENT_WALLETS через запятую
+WALLETS = load_wallets(os.getenv("WALLETS_FILE", "wallets.txt"), os.getenv("PAYMENT_WALLETS"), DEFAULT_WALLETS)
+WALLETS_DB_PATH = "wallets.db"
 WALLET_RESERVE_TIME = 3600  # 60 минут в секундах
-wallets_lock = threading.Lock()
-last_wallet_index = -1
+wallet_pool = None  # резервы кошельков, открывается в init_wallet_pool
 sent_notifications = set()
 
 # Настройка логирования
@@ -89,19 +127,55 @@ DEFAULT_SETTINGS = {
     'subscription_price': 30,
     'subscription_end': 0,
     'enabled': False,
-    'sub': 0
+    'sub': 0,
+    'notify_mode': NOTIFY_INSTANT,  # instant, batch или digest
+    'notify_interval': 60  # секунд между сообщениями в режиме batch
 }
 
 # Глобальные переменные
 settings = {}
+settings_lock = threading.RLock()
+settings_store = None
+settings_writer = None
+profit_ledger = LedgerWriter('profits.db')
+suggest_cache = {}  # (symbol, days) -> (время расчета, результаты)
+suggest_lock = threading.Lock()  # одновременно идет только один подбор
 user_states = {}
-user_threads = {}
 price_cache = {}
 price_cache_lock = threading.Lock()
-exchange_instances = {}
+price_update_stats = {
+    'cycles': 0,
+    'last_duration': 0.0,
+    'avg_duration': 0.0,
+    'max_duration': 0.0,
+    'symbols': 0,
+    'errors': 0
+}
+price_stream = None
+user_streams = None
+exchange_instances = {}  # хэш учетных данных -> клиент биржи из пула
+exchange_lock = threading.Lock()
+markets_lock = threading.Lock()
+markets_source = None  # клиент, хранящий общий справочник рынков
+markets_loaded_at = 0
+markets_failed_at = 0
+# Общий планировщик запросов к бирже: лимиты IP и ключей, приоритет ордеров над опросом
+request_scheduler = RequestScheduler(EXCHANGE_IP_RATE, EXCHANGE_KEY_RATE, EXCHANGE_IP_TOTAL_RATE or None,
+                                     max_wait=EXCHANGE_MAX_WAIT)
+
+# Общая HTTP-сессия с keep-alive соединениями для всех клиентов биржи
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=TRADING_WORKERS + 8))
+http_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=TRADING_WORKERS + 8))  # MEXC_API_URL локально
 
 # Инициализация Telegram бота
 bot = telebot.TeleBot(BOT_TOKEN)
+# Уведомления уходят в фоне, торговый цикл не ждет ответа Telegram
+telegram_queue = OutboundQueue(bot.send_message, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_INTERVAL, TELEGRAM_SEND_WORKERS)
+# Сводки о сделках для пользователей с режимом уведомлений batch или digest
+trade_notifier = TradeNotifier(telegram_queue.send)
+# Проверка оплат: один фоновый цикл asyncio опрашивает зарезервированные кошельки
+deposit_watcher = fetch_deposits.DepositWatcher()
 
 
 #############################################################################
@@ -109,41 +183,71 @@ bot = telebot.TeleBot(BOT_TOKEN)
 #############################################################################
 
 def load_settings():
-    global settings
+    global settings, settings_store, settings_writer
     try:
-        if os.path.exists(SETTINGS_PATH):
+        settings_store = open_settings_store(SETTINGS_BACKEND, SETTINGS_PATH, SETTINGS_DB_PATH)
+        users = settings_store.load()
+        if users is None and SETTINGS_BACKEND != 'json' and os.path.exists(SETTINGS_PATH):
+            # Первый запуск с новым хранилищем - переносим пользователей из JSON
             with open(SETTINGS_PATH, 'r') as f:
-                settings = json.load(f)
-        else:
-            settings = {'users': {}}
-            save_settings()
+                users = json.load(f).get('users', {})
+            settings_store.save_all(users)
+            logger.info(f"Настройки {len(users)} пользователей перенесены из {SETTINGS_PATH}")
+        settings = {'users': users or {}}
+        if users is None:
+            settings_store.save_all(settings['users'])
     except Exception as e:
         logger.error(f"Ошибка загрузки настроек: {e}")
         settings = {'users': {}}
 
+    settings_writer = SettingsWriter(settings_store, settings['users'], settings_lock, SETTINGS_FLUSH_INTERVAL)
+    settings_writer.start()
+    atexit.register(settings_writer.stop)
+
 
 def save_settings():
+    """Синхронная запись всех пользователей (при завершении работы)"""
     try:
-        with open(SETTINGS_PATH, 'w') as f:
-            json.dump(settings, f, indent=2)
+        with settings_lock:
+            settings_writer.dirty.update(settings['users'])
+        settings_writer.flush()
     except Exception as e:
         logger.error(f"Ошибка сохранения настроек: {e}")
 
 
+def shutdown(signum=None, frame=None):
+    """Остановка по SIGTERM/SIGINT: изменения настроек и очередь прибыли записываются до выхода,
+    остальное останавливают обработчики atexit"""
+    logger.info(f"Завершение работы (сигнал {signum})...")
+    try:
+        if settings_writer is not None:
+            settings_writer.stop()
+        profit_ledger.stop()
+    finally:
+        sys.exit(0)
+
+
+def save_user_settings(user_id_str):
+    """Пометка пользователя для отложенной записи: вызывающий поток не ждет диска"""
+    settings_writer.mark_dirty(user_id_str)
+
+
 def get_user_settings(user_id):
     user_id_str = str(user_id)
-    if user_id_str not in settings['users']:
-        settings['users'][user_id_str] = DEFAULT_SETTINGS.copy()
-        settings['users'][user_id_str]['subscription_end'] = time.time() + 172800
-        print(settings['users'][user_id_str])
-        save_settings()
-    return settings['users'][user_id_str]
+    with settings_lock:
+        if user_id_str not in settings['users']:
+            settings['users'][user_id_str] = DEFAULT_SETTINGS.copy()
+            settings['users'][user_id_str]['subscription_end'] = time.time() + 172800
+            print(settings['users'][user_id_str])
+            save_user_settings(user_id_str)
+        return settings['users'][user_id_str]
 
 
 def update_user_settings(user_id, new_settings):
     user_id_str = str(user_id)
-    settings['users'][user_id_str] = new_settings
-    save_settings()
+    with settings_lock:
+        settings['users'][user_id_str] = new_settings
+        save_user_settings(user_id_str)
 
 
 def extend_subscription(user_id, seconds=0):
@@ -170,70 +274,246 @@ def extend_subscription(user_id, seconds=0):
         raise
 
 
-def get_available_wallet():
-    global last_wallet_index
-    with wallets_lock:
-        current_time = time.time()
-        # Удаляем только устаревшие кошельки (независимо от статуса проверки)
-        active_wallets[:] = [
-            w for w in active_wallets
-            if current_time - w['reserved_at'] < WALLET_RESERVE_TIME
-        ]
-
-        # Создаем список всех активных адресов
-        occupied_addresses = [w['address'] for w in active_wallets]
-
-        # Поиск свободного кошелька
-        start_index = (last_wallet_index + 1) % len(WALLETS)
-        for i in range(len(WALLETS)):
-            current_index = (start_index + i) % len(WALLETS)
-            candidate = WALLETS[current_index]
-            if candidate not in occupied_addresses:
-                last_wallet_index = current_index
-                return candidate
-        return None
+def init_wallet_pool():
+    """Открытие резервов кошельков; прерванные перезапуском проверки оплат ставятся заново"""
+    global wallet_pool
+    wallet_pool = WalletPool(WALLETS_DB_PATH, WALLETS, WALLET_RESERVE_TIME,
+                             on_release=lambda r: deposit_watcher.unwatch(r['address'], r['amount'], r['reserved_at']))
+    wallet_pool.start()
+    for reservation in wallet_pool.checking():
+        watch_payment(reservation['user_id'], reservation)
 
 
 #############################################################################
 # Система обновления цен
 #############################################################################
 
+#############################################################################
+# Пул клиентов биржи
+#############################################################################
+
+def exchange_key(api_key, api_secret):
+    """Ключ пула по учетным данным (секреты не хранятся в ключах словаря)"""
+    return hashlib.sha256(f"{api_key}:{api_secret}".encode()).hexdigest()
+
+
+def create_mexc_client(config):
+    """Клиент ccxt MEXC; при заданном MEXC_API_URL запросы идут на указанный адрес"""
+    exchange = ccxt.mexc(config)
+    if MEXC_API_URL:
+        exchange.urls['api']['spot'] = {'public': MEXC_API_URL, 'private': MEXC_API_URL}
+        exchange.urls['api']['contract'] = {'public': f"{MEXC_API_URL}/api/v1/contract",
+                                            'private': f"{MEXC_API_URL}/api/v1/private"}
+    return exchange
+
+
+def get_shared_markets():
+    """Общий справочник рынков: загружается один раз и раздается всем клиентам"""
+    global markets_source, markets_loaded_at, markets_failed_at
+    with markets_lock:
+        current_time = time.time()
+        stale = markets_source is None or current_time - markets_loaded_at > MARKETS_RELOAD_INTERVAL
+        # После неудачной загрузки не повторяем запрос чаще раза в минуту
+        if stale and current_time - markets_failed_at > 60:
+            source = None
+            try:
+                source = request_scheduler.attach(create_mexc_client({'session': http_session}))
+                source.load_markets()
+                if markets_source is not None:
+                    # Сессия общая - не даем ccxt закрыть ее в __del__
+                    markets_source.session = None
+                markets_source = source
+                markets_loaded_at = current_time
+                logger.info(f"Загружен справочник рынков: {len(source.markets)} пар")
+            except Exception as e:
+                markets_failed_at = current_time
+                if source is not None:
+                    source.session = None
+                logger.error(f"Ошибка загрузки справочника рынков: {e}")
+        if markets_source is None:
+            raise ccxt.ExchangeNotAvailable("Справочник рынков не загружен")
+        return markets_source
+
+
+def get_exchange(api_key='', api_secret=''):
+    """Клиент биржи из пула: один экземпляр на учетные данные, общие рынки и HTTP-сессия"""
+    key = exchange_key(api_key, api_secret)
+    with exchange_lock:
+        entry = exchange_instances.get(key)
+        if entry is None:
+            exchange = create_mexc_client({
+                'apiKey': api_key,
+                'secret': api_secret,
+                'options': {'recvWindow': 60000},
+                'session': http_session
+            })
+            request_scheduler.attach(exchange, key)
+            entry = {'exchange': exchange, 'markets_source': None, 'last_used': time.time()}
+            exchange_instances[key] = entry
+        entry['last_used'] = time.time()
+
+    # Подключаем общий справочник рынков вместо отдельного load_markets
+    if entry['markets_source'] is None or entry['markets_source'] is not markets_source:
+        try:
+            source = get_shared_markets()
+            entry['exchange'].set_markets_from_exchange(source)
+            entry['markets_source'] = source
+        except ccxt.ExchangeNotAvailable:
+            # Клиент загрузит рынки сам при первом запросе
+            pass
+    return entry['exchange']
+
+
+def evict_idle_exchanges():
+    """Выгрузка клиентов, которые давно не использовались"""
+    current_time = time.time()
+    with exchange_lock:
+        for key in list(exchange_instances.keys()):
+            entry = exchange_instances[key]
+            if current_time - entry['last_used'] > EXCHANGE_IDLE_TTL:
+                # Сессия общая - не даем ccxt закрыть ее в __del__
+                entry['exchange'].session = None
+                del exchange_instances[key]
+                request_scheduler.forget(key)
+                logger.debug("Выгружен неиспользуемый клиент биржи")
+
+
+def get_ticker_exchange():
+    """Клиент биржи для обновления цен"""
+    return get_exchange(os.getenv("API_TICKER_UPDATER") or '', os.getenv("API_TICKER_UPDATER_SECRET") or '')
+
+
+def fetch_prices(exchange, symbols):
+    """Пакетное получение цен: один запрос fetch_tickers на каждые PRICE_BATCH_SIZE символов"""
+    prices = {}
+    errors = 0
+    symbols = sorted(symbols)
+    for i in range(0, len(symbols), PRICE_BATCH_SIZE):
+        chunk = symbols[i:i + PRICE_BATCH_SIZE]
+        try:
+            tickers = exchange.fetch_tickers(chunk)
+        except Exception as e:
+            # Один неверный символ не должен ломать весь пакет - добираем поштучно
+            logger.error(f"Ошибка пакетного обновления цен ({len(chunk)} символов): {e}")
+            tickers = {}
+            for symbol in chunk:
+                try:
+                    tickers[symbol] = exchange.fetch_ticker(symbol)
+                except Exception as e:
+                    logger.error(f"Ошибка обновления цены для {symbol}: {e}")
+                    errors += 1
+
+        for symbol in chunk:
+            ticker = tickers.get(symbol)
+            if ticker and ticker.get('last') is not None:
+                prices[symbol] = ticker['last']
+    return prices, errors
+
+
+def update_price_cache(prices, timestamp=None):
+    """Атомарное обновление кэша цен одним блоком"""
+    if timestamp is None:
+        timestamp = time.time()
+    updates = {symbol: {'price': price, 'timestamp': timestamp} for symbol, price in prices.items()}
+    with price_cache_lock:
+        changed = [symbol for symbol, price in prices.items()
+                   if symbol not in price_cache or price_cache[symbol]['price'] != price]
+        price_cache.update(updates)
+
+    # Будим только пользователей, подписанных на изменившиеся символы
+    for symbol in changed:
+        trading_engine.on_price(symbol, prices[symbol])
+
+
+def record_price_cycle(duration, symbols_count, errors):
+    """Метрики длительности цикла обновления цен"""
+    stats = price_update_stats
+    stats['cycles'] += 1
+    stats['last_duration'] = duration
+    stats['max_duration'] = max(stats['max_duration'], duration)
+    # Экспоненциальное скользящее среднее
+    if stats['cycles'] == 1:
+        stats['avg_duration'] = duration
+    else:
+        stats['avg_duration'] = stats['avg_duration'] * 0.9 + duration * 0.1
+    stats['symbols'] = symbols_count
+    stats['errors'] += errors
+
+    if duration > PRICE_UPDATE_INTERVAL:
+        logger.warning(f"Цикл обновления цен занял {duration:.2f} сек "
+                       f"(интервал {PRICE_UPDATE_INTERVAL} сек, символов: {symbols_count})")
+    else:
+        logger.debug(f"Цикл обновления цен: {duration:.3f} сек, символов: {symbols_count}")
+
+
+def on_stream_tick(symbol, price, timestamp):
+    """Тик из WebSocket сразу попадает в кэш"""
+    update_price_cache({symbol: price}, timestamp)
+
+
+def start_price_stream():
+    """Запуск потоковых цен; при ошибке остаемся на REST-опросе"""
+    global price_stream
+    try:
+        markets = None
+        try:
+            markets = get_shared_markets().markets
+        except Exception as e:
+            logger.error(f"Ошибка загрузки рынков для потока цен: {e}")
+        stream = PriceStream(on_stream_tick, ws_url=MEXC_WS_URL, markets=markets,
+                             record_path=PRICE_STREAM_RECORD)
+        stream.start()
+        price_stream = stream
+        logger.info("Запуск потоковых цен через WebSocket")
+    except Exception as e:
+        logger.error(f"Не удалось запустить поток цен, используется REST-опрос: {e}")
+
+
+def start_user_streams():
+    """Запуск приватных потоков ордеров; при ошибке исполнения отслеживаются опросом"""
+    global user_streams
+    try:
+        markets = None
+        try:
+            markets = get_shared_markets().markets
+        except Exception as e:
+            logger.error(f"Ошибка загрузки рынков для приватных потоков: {e}")
+        streams = UserDataStreams(trading_engine.on_order_update, trading_engine.on_account_reconnect,
+                                  ws_url=MEXC_WS_URL, rest_url=MEXC_API_URL, markets=markets)
+        streams.start()
+        user_streams = streams
+        logger.info("Запуск приватных потоков исполнения ордеров")
+    except Exception as e:
+        logger.error(f"Не удалось запустить приватные потоки, используется опрос: {e}")
+
+
 def price_updater():
     """Фоновый поток для обновления цен"""
     logger.info("Запуск системы обновления цен")
     last_cleanup = time.time()
     while True:
         try:
-            # Собираем уникальные символы из всех пользовательских настроек
-            symbols = set()
-            for user_id, user_settings in settings['users'].items():
-                if user_settings.get('enabled', False):
-                    symbols.add(user_settings['symbol'])
-
-            # Обновляем цены для каждого символа
-            for symbol in symbols:
-                try:
-                    # Создаем временный экземпляр биржи
-                    API_KEY = os.getenv("API_TICKER_UPDATER")
-                    API_SECRET = os.getenv("API_TICKER_UPDATER_SECRET")
-                    temp_exchange = ccxt.mexc({
-                        'apiKey': API_KEY,
-                        'secret': API_SECRET,
-                        'enableRateLimit': True,
-                    })
-                    ticker = temp_exchange.fetch_ticker(symbol)
-
-                    with price_cache_lock:
-                        price_cache[symbol] = {
-                            'price': ticker['last'],
-                            'timestamp': time.time()
-                        }
-
-                    logger.debug(f"Обновлена цена для {symbol}: {ticker['last']}")
-                except Exception as e:
-                    logger.error(f"Ошибка обновления цены для {symbol}: {e}")
+            cycle_start = time.time()
 
-                    # Очистка каждые 10 минут
+            # Символы работающих ботов берем из индекса подписчиков
+            symbols = trading_engine.active_symbols()
+
+            # Символы со свежими тиками из WebSocket не опрашиваем через REST
+            rest_symbols = symbols
+            if price_stream is not None:
+                price_stream.set_symbols(symbols)
+                rest_symbols = {s for s in symbols if not price_stream.is_fresh(s, PRICE_UPDATE_INTERVAL)}
+
+            # Обновляем цены всех символов пакетно
+            errors = 0
+            if rest_symbols:
+                prices, errors = fetch_prices(get_ticker_exchange(), rest_symbols)
+                update_price_cache(prices)
+
+            duration = time.time() - cycle_start
+            record_price_cycle(duration, len(rest_symbols), errors)
+
+            # Очистка каждые 10 минут
             if time.time() - last_cleanup > 600:
                 with price_cache_lock:
                     current_time = time.time()
@@ -243,10 +523,11 @@ def price_updater():
                         if current_time - data['timestamp'] > 7200:
                             del price_cache[symbol]
                             logger.debug(f"Удалён устаревший символ: {symbol}")
+                evict_idle_exchanges()
                 last_cleanup = time.time()
 
-            # Пауза между обновлениями
-            time.sleep(PRICE_UPDATE_INTERVAL)
+            # Пауза между обновлениями с учетом длительности цикла
+            time.sleep(max(0.0, PRICE_UPDATE_INTERVAL - (time.time() - cycle_start)))
 
         except Exception as e:
             logger.error(f"Ошибка в потоке обновления цен: {e}")
@@ -263,8 +544,7 @@ def get_cached_price(symbol):
 
     # Если данных нет или они устарели, делаем прямой запрос
     try:
-        temp_exchange = ccxt.mexc()
-        ticker = temp_exchange.fetch_ticker(symbol)
+        ticker = get_exchange().fetch_ticker(symbol)
         price = ticker['last']
 
         with price_cache_lock:
@@ -282,263 +562,702 @@ def get_cached_price(symbol):
 #############################################################################
 # Торговая логика
 #############################################################################
+class BalanceCache:
+    """Кэш свободного USDT по аккаунтам: ведется по своим ордерам, с биржей сверяется редко"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # хэш учетных данных -> состояние баланса
+        self.fetches = 0
+
+    def _entry(self, account):
+        entry = self.entries.get(account)
+        if entry is None:
+            entry = {'free': None, 'refreshed_at': 0, 'underfunded_until': 0, 'backoff': BALANCE_BACKOFF_MIN}
+            self.entries[account] = entry
+        return entry
+
+    def get_free(self, account, exchange):
+        """Свободный USDT: из кэша, с биржи - только если кэш пуст или устарел"""
+        with self.lock:
+            entry = self._entry(account)
+            if entry['free'] is not None and time.time() - entry['refreshed_at'] < BALANCE_REFRESH_INTERVAL:
+                return entry['free']
+        return self.refresh(account, exchange)
+
+    def refresh(self, account, exchange):
+        try:
+            balance = exchange.fetch_balance()
+            free = float(balance['USDT']['free'] or 0)
+        except Exception as e:
+            logger.error(f"Ошибка получения баланса: {e}")
+            return 0
+        with self.lock:
+            self.fetches += 1
+            entry = self._entry(account)
+            entry['free'] = free
+            entry['refreshed_at'] = time.time()
+        return free
+
+    def refresh_if_stale(self, account, exchange):
+        """Фоновая сверка с низкой частотой"""
+        with self.lock:
+            entry = self.entries.get(account)
+            if entry is None or time.time() - entry['refreshed_at'] < BALANCE_REFRESH_INTERVAL:
+                return
+        self.refresh(account, exchange)
+
+    def spend(self, account, cost):
+        with self.lock:
+            entry = self._entry(account)
+            if entry['free'] is not None:
+                entry['free'] = max(0.0, entry['free'] - cost)
+
+    def credit(self, account, amount):
+        """Поступление от исполненной продажи снимает паузу по нехватке средств"""
+        with self.lock:
+            entry = self._entry(account)
+            if entry['free'] is not None:
+                entry['free'] += amount
+            entry['underfunded_until'] = 0
+            entry['backoff'] = BALANCE_BACKOFF_MIN
+
+    def invalidate(self, account):
+        with self.lock:
+            self._entry(account)['free'] = None
+
+    def is_underfunded(self, account):
+        with self.lock:
+            entry = self.entries.get(account)
+            return entry is not None and time.time() < entry['underfunded_until']
+
+    def mark_underfunded(self, account):
+        """Экспоненциальная пауза; после нее баланс перечитывается с биржи"""
+        with self.lock:
+            entry = self._entry(account)
+            delay = entry['backoff']
+            entry['underfunded_until'] = time.time() + delay
+            entry['backoff'] = min(delay * 2, BALANCE_BACKOFF_MAX)
+            entry['free'] = None
+            return delay
+
+    def mark_funded(self, account):
+        with self.lock:
+            entry = self._entry(account)
+            entry['underfunded_until'] = 0
+            entry['backoff'] = BALANCE_BACKOFF_MIN
+
+    def forget(self, account):
+        with self.lock:
+            self.entries.pop(account, None)
+
+
+balance_cache = BalanceCache()
+
+
+def order_fee_cost(fee, price, quote='USDT'):
+    """Комиссия ордера в USDT: ccxt отдает словарь {'cost', 'currency'}, комиссия в монете пересчитывается по цене"""
+    if isinstance(fee, dict):
+        cost = float(fee.get('cost') or 0)
+        currency = fee.get('currency')
+        if currency and currency != quote:
+            cost *= float(price)
+        return cost
+    return float(fee or 0)
+
+
 # Сохранение информации о сделке
 def record_profit(user_id, profit, symbol, buy_price, sell_price):
-    conn = sqlite3.connect('profits.db')
-    c = conn.cursor()
-    try:
-        c.execute(
-            "INSERT INTO profits (user_id, profit, timestamp, symbol, buy_price, sell_price) VALUES (?, ?, ?, ?, ?, ?)",
-            (user_id, profit, time.time(), symbol, buy_price, sell_price))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Ошибка записи прибыли: {e}")
-    finally:
-        conn.close()
+    """Сделка уходит в очередь журнала, запись пачкой в отдельном потоке"""
+    profit_ledger.record(user_id, profit, symbol, buy_price, sell_price)
+
+
+class UserBot:
+    """Состояние торговой стратегии пользователя"""
+
+    def __init__(self, user_id, user_settings):
+        self.user_id = user_id
+        self.user_id_str = str(user_id)
+        self.settings = user_settings
+        self.symbol = user_settings['symbol']
+        self.api_key = user_settings['api_key']
+        self.api_secret = user_settings['api_secret']
+        self.account = exchange_key(self.api_key, self.api_secret)
+
+        self.active_orders = []
+        self.last_buy_price = None
+        self.cooldown_until = 0  # пауза перед следующей покупкой
+        self.paused_until = 0  # пауза после ошибок биржи
+        self.last_user_msg = ''
+        self.last_subscription_check = time.time()
+        self.start_time = time.time()
+
+        self.running = True
+        self.queued = False  # оценка уже стоит в очереди пула
+        self.order_check_scheduled = False
+        self.order_check_interval = ORDER_CHECK_INTERVAL
+        self.lock = threading.RLock()
+
+    @property
+    def exchange(self):
+        """Клиент биржи из пула (учетные данные фиксируются при запуске)"""
+        return get_exchange(self.api_key, self.api_secret)
+
+    @property
+    def strategy(self):
+        """Параметры стратегии из текущих настроек"""
+        return DcaStrategy.from_settings(self.settings)
+
+    def log(self, text):
+        """Логирование для конкретного пользователя"""
+        try:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            log_text = f"{timestamp} - {text}"
 
+            # Всегда отправляем логи в Telegram (через очередь, без ожидания)
+            telegram_queue.send(self.user_id, log_text)
 
-def user_trading_bot(user_id):
-    """Основной торговый цикл для пользователя"""
-    logger.info(f"Запуск торгового бота для пользователя {user_id}")
+            logger.info(f"[USER {self.user_id}] {text}")
+        except Exception as e:
+            logger.error(f"Ошибка логирования для {self.user_id}: {e}")
 
-    user_settings = get_user_settings(user_id)
-    user_id_str = str(user_id)
-    if time.time() > user_settings['subscription_end']:
-        bot.send_message(user_id, "❌ Ваша подписка истекла! Бот не может быть запущен.")
-        return
+    def notify_trade(self, kind, text, cost=0.0, profit=0.0):
+        """Уведомление о сделке по режиму пользователя: сразу или в сводке"""
+        mode = self.settings.get('notify_mode', NOTIFY_INSTANT)
+        if mode == NOTIFY_INSTANT:
+            self.log(text)
+            return
+        logger.info(f"[USER {self.user_id}] {text}")
+        trade_notifier.add(self.user_id, mode, self.settings.get('notify_interval', 60), kind, text,
+                           self.symbol, cost, profit)
+
+
+class TradingEngine:
+    """Событийный торговый движок: общий пул потоков и таймеры вместо потока на пользователя"""
+
+    def __init__(self, workers=TRADING_WORKERS):
+        self.workers = workers
+        self.bots = {}  # user_id_str -> UserBot
+        self.starting = set()
+        self.index = SubscriberIndex()  # symbol -> пороги следующей покупки
+        self.accounts = {}  # хэш учетных данных -> set(user_id_str)
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='trading')
+        self.timers = []
+        self.timers_cond = threading.Condition()
+        self.timer_seq = 0
+        self.timer_thread = None
+
+    def start(self):
+        self.timer_thread = threading.Thread(target=self._timer_loop, name='trading_timers', daemon=True)
+        self.timer_thread.start()
+
+    #########################################################################
+    # Таймеры и пул
+    #########################################################################
+
+    def call_later(self, delay, callback, *args):
+        """Отложенный вызов в пуле потоков (вместо time.sleep в потоке пользователя)"""
+        with self.timers_cond:
+            self.timer_seq += 1
+            heapq.heappush(self.timers, (time.time() + delay, self.timer_seq, callback, args))
+            self.timers_cond.notify()
+
+    def _timer_loop(self):
+        while True:
+            with self.timers_cond:
+                while not self.timers or self.timers[0][0] > time.time():
+                    timeout = self.timers[0][0] - time.time() if self.timers else None
+                    self.timers_cond.wait(timeout)
+                _, _, callback, args = heapq.heappop(self.timers)
+            try:
+                self.executor.submit(self._safe_call, callback, *args)
+            except RuntimeError:
+                return  # пул остановлен при завершении процесса
 
-    # Создаем экземпляр биржи для пользователя
-    try:
-        exchange = ccxt.mexc({
-            'apiKey': user_settings['api_key'],
-            'secret': user_settings['api_secret'],
-            'enableRateLimit': True,
-            'options': {'recvWindow': 60000}
-        })
-        exchange_instances[user_id_str] = exchange
-    except Exception as e:
-        error_msg = f"Ошибка создания экземпляра биржи: {e}"
-        logger.error(error_msg)
-        bot.send_message(user_id, error_msg)
-        return
+    def _safe_call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Ошибка в торговом цикле: {e}")
+
+    def _run_locked(self, user_bot, callback, *args):
+        """Все действия с одним пользователем выполняются последовательно"""
+        with user_bot.lock:
+            if user_bot.running:
+                callback(user_bot, *args)
+                self._update_threshold(user_bot)
+
+    #########################################################################
+    # Управление ботами
+    #########################################################################
+
+    def start_user(self, user_id):
+        """Запуск торговой стратегии пользователя"""
+        user_id_str = str(user_id)
+        with self.lock:
+            if user_id_str in self.bots or user_id_str in self.starting:
+                return True
+            self.starting.add(user_id_str)
+        try:
+            return self._start_user(user_id)
+        finally:
+            with self.lock:
+                self.starting.discard(user_id_str)
+
+    def _start_user(self, user_id):
+        user_id_str = str(user_id)
+        logger.info(f"Запуск торгового бота для пользователя {user_id}")
+        user_settings = get_user_settings(user_id)
+        if time.time() > user_settings['subscription_end']:
+            # Сначала выключаем: при ошибке отправки sync_enabled не будет пытаться запустить бота снова
+            user_settings['enabled'] = False
+            update_user_settings(user_id, user_settings)
+            telegram_queue.send(user_id, "❌ Ваша подписка истекла! Бот не может быть запущен.")
+            return False
+
+        # Получаем клиент биржи для пользователя из пула
+        try:
+            get_exchange(user_settings['api_key'], user_settings['api_secret'])
+        except Exception as e:
+            error_msg = f"Ошибка создания экземпляра биржи: {e}"
+            logger.error(error_msg)
+            user_settings['enabled'] = False
+            update_user_settings(user_id, user_settings)
+            telegram_queue.send(user_id, error_msg)
+            return False
+
+        user_bot = UserBot(user_id, user_settings)
+        with self.lock:
+            self.bots[user_id_str] = user_bot
+            self.accounts.setdefault(user_bot.account, set()).add(user_id_str)
+        self.index.add(user_id_str, user_bot.symbol, math.inf)
+        if user_streams is not None:
+            user_streams.add_account(user_bot.account, user_bot.api_key, user_bot.api_secret)
+
+        user_bot.log("Торговый бот запущен")
+        self.call_later(SUBSCRIPTION_CHECK_INTERVAL, self._run_locked, user_bot, self._housekeeping)
+        self.wake(user_bot)
+        return True
+
+    def stop_user(self, user_id):
+        """Остановка торговой стратегии пользователя"""
+        user_id_str = str(user_id)
+        with self.lock:
+            user_bot = self.bots.get(user_id_str)
+            if user_bot is None:
+                return False
+
+        # Обновляем статус пользователя до удаления, чтобы sync_enabled не перезапустил бота
+        user_settings = get_user_settings(user_id)
+        user_settings['enabled'] = False
+        update_user_settings(user_id, user_settings)
 
-    # Переменные состояния для пользователя
-    active_orders = []
-    last_buy_price = None
-    last_subscription_check = time.time()  # Время последней проверки подписки
-    SUBSCRIPTION_CHECK_INTERVAL = 60  # Проверять подписку каждые 60 секунд
-    last_user_msg = ''
+        with self.lock:
+            if self.bots.pop(user_id_str, None) is None:
+                return False
+            account_users = self.accounts.get(user_bot.account)
+            if account_users is not None:
+                account_users.discard(user_id_str)
+                if not account_users:
+                    del self.accounts[user_bot.account]
+        self.index.remove(user_id_str)
+        if user_streams is not None:
+            user_streams.remove_account(user_bot.account)
+        with self.lock:
+            if user_bot.account not in self.accounts:
+                balance_cache.forget(user_bot.account)
+
+        # Дожидаемся завершения текущего шага стратегии
+        with user_bot.lock:
+            user_bot.running = False
+
+        user_bot.log("Торговый бот остановлен")
+        return True
+
+    def sync_enabled(self):
+        """Запуск ботов, включенных в настройках, но не работающих (например, через /admin_edit_user)"""
+        for user_id_str, user_data in list(settings['users'].items()):
+            if user_data.get('enabled', False) and user_id_str not in self.bots:
+                # Ошибка одного пользователя не мешает запуску остальных
+                try:
+                    self.start_user(int(user_id_str))
+                except Exception as e:
+                    logger.error(f"Ошибка запуска торгового бота для {user_id_str}: {e}")
 
-    def user_log(text):
-        """Логирование для конкретного пользователя"""
-        try:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            log_text = f"{timestamp} - {text}"
+    def active_symbols(self):
+        return self.index.symbols()
+
+    #########################################################################
+    # События
+    #########################################################################
+
+    def on_price(self, symbol, price):
+        """Обновление цены будит только подписчиков символа, чей порог покупки пересечен"""
+        user_ids = self.index.triggered(symbol, price)
+        if not user_ids:
+            return
+        with self.lock:
+            user_bots = [self.bots[uid] for uid in user_ids if uid in self.bots]
+        for user_bot in user_bots:
+            self.wake(user_bot)
+
+    def on_order_update(self, account, order_info):
+        """Событие приватного потока: исполнение сразу идет в расчет прибыли, без опроса"""
+        if order_info.get('status') not in ('closed', 'canceled'):
+            return
+        with self.lock:
+            user_bots = [self.bots[uid] for uid in self.accounts.get(account, ()) if uid in self.bots]
+        for user_bot in user_bots:
+            self.executor.submit(self._safe_call, self._run_locked, user_bot, self._apply_stream_order, order_info)
+
+    def on_account_reconnect(self, account):
+        """Сверка ордеров через REST после разрыва приватного потока"""
+        with self.lock:
+            user_bots = [self.bots[uid] for uid in self.accounts.get(account, ()) if uid in self.bots]
+        for user_bot in user_bots:
+            user_bot.order_check_interval = ORDER_CHECK_INTERVAL
+            self.executor.submit(self._safe_call, self._run_locked, user_bot, self._check_orders)
+
+    def _apply_stream_order(self, user_bot, order_info):
+        for order in user_bot.active_orders:
+            if str(order['id']) == str(order_info['id']):
+                self._apply_order_update(user_bot, order, order_info)
+                return
+
+    def wake(self, user_bot):
+        """Ставит оценку условий покупки в очередь пула (не более одной на пользователя)"""
+        with self.lock:
+            if user_bot.queued:
+                return
+            user_bot.queued = True
+        self.executor.submit(self._safe_call, self._evaluate, user_bot)
+
+    def _evaluate(self, user_bot):
+        with user_bot.lock:
+            user_bot.queued = False
+            if user_bot.running:
+                self._try_buy(user_bot)
+                self._update_threshold(user_bot)
+
+    def _update_threshold(self, user_bot):
+        """Порог следующей покупки в индексе; None - сейчас пользователь купить не может"""
+        strategy = user_bot.strategy
+        current_time = time.time()
+        if current_time < user_bot.cooldown_until or current_time < user_bot.paused_until:
+            threshold = None
+        elif not strategy.can_open(len(user_bot.active_orders)):
+            threshold = None
+        else:
+            threshold = strategy.threshold(user_bot.last_buy_price)
+        self.index.set_threshold(user_bot.user_id_str, threshold)
+
+    def _schedule_order_check(self, user_bot):
+        if user_bot.order_check_scheduled or not user_bot.active_orders:
+            return
+        user_bot.order_check_scheduled = True
+        self.call_later(user_bot.order_check_interval, self._run_locked, user_bot, self._order_check_tick)
+
+    def _order_check_tick(self, user_bot):
+        user_bot.order_check_scheduled = False
+        changed = self._check_orders(user_bot)
+
+        # Адаптивный интервал: замедляемся, пока ордера не меняются,
+        # и возвращаемся к частым проверкам при изменениях или цене у уровня продажи
+        current_price = None
+        with price_cache_lock:
+            if user_bot.symbol in price_cache:
+                current_price = price_cache[user_bot.symbol]['price']
+        near_fill = current_price is not None and any(
+            current_price >= order['sell_price'] * 0.999 for order in user_bot.active_orders)
+        if user_streams is not None and user_streams.is_connected(user_bot.account):
+            # Исполнения приходят из приватного потока, опрос нужен только для страховки
+            user_bot.order_check_interval = ORDER_CHECK_STREAM_INTERVAL
+        elif changed or near_fill:
+            user_bot.order_check_interval = ORDER_CHECK_INTERVAL
+        else:
+            user_bot.order_check_interval = min(user_bot.order_check_interval * ORDER_CHECK_BACKOFF,
+                                                ORDER_CHECK_MAX_INTERVAL)
+        self._schedule_order_check(user_bot)
+
+    def _housekeeping(self, user_bot):
+        """Периодическая проверка подписки и настроек"""
+        current_time = time.time()
+        user_bot.settings = get_user_settings(user_bot.user_id)
+        user_bot.last_subscription_check = current_time
 
-            # Всегда отправляем логи в Telegram
+        if not user_bot.settings.get('enabled', False):
+            self.stop_user(user_bot.user_id)
+            return
+
+        # Проверяем, не истекла ли подписка
+        if current_time > user_bot.settings['subscription_end']:
+            user_bot.log("❌ Ваша подписка истекла! Бот остановлен.")
+            self.stop_user(user_bot.user_id)
+            return
+
+        # Смена пары у припаркованного пользователя (порог None) иначе ждала бы цены старой пары
+        self._sync_symbol(user_bot)
+
+        # Редкая фоновая сверка кэша баланса с биржей
+        balance_cache.refresh_if_stale(user_bot.account, user_bot.exchange)
+
+        self.call_later(SUBSCRIPTION_CHECK_INTERVAL, self._run_locked, user_bot, self._housekeeping)
+
+    def _sync_symbol(self, user_bot):
+        """Переподписка при смене торговой пары"""
+        symbol = user_bot.settings['symbol']
+        if symbol == user_bot.symbol:
+            return
+        user_bot.symbol = symbol
+        user_bot.last_buy_price = None
+        self.index.add(user_bot.user_id_str, symbol, math.inf)
+
+    #########################################################################
+    # Торговая логика
+    #########################################################################
+
+    def _check_orders(self, user_bot):
+        """Сверка активных ордеров: один запрос открытых ордеров на символ вместо fetch_order на каждый"""
+        exchange = user_bot.exchange
+        changed = False
+
+        orders_by_symbol = {}
+        for order in user_bot.active_orders:
+            orders_by_symbol.setdefault(order['symbol'], []).append(order)
+
+        for symbol, orders in orders_by_symbol.items():
+            if time.time() < user_bot.paused_until:
+                return changed
             try:
-                bot.send_message(user_id, log_text)
+                open_ids = {str(o['id']) for o in exchange.fetch_open_orders(symbol)}
+            except ccxt.RateLimitExceeded:
+                logger.error("Превышен лимит запросов, пауза 60 секунд")
+                user_bot.paused_until = time.time() + 60
+                return changed
+            except ccxt.NetworkError as e:
+                logger.error(f"Сетевая ошибка при проверке ордеров: {e}")
+                continue
             except Exception as e:
-                logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+                logger.error(f"Ошибка при выполнении операции: {e}")
+                continue
+
+            missing = [order for order in orders if str(order['id']) not in open_ids]
+            if not missing:
+                continue
 
-            logger.info(f"[USER {user_id}] {text}")
+            # Исполненные и отмененные ордера забираем одним запросом истории
+            history = {}
+            try:
+                since = int(min(order['timestamp'] for order in missing) * 1000) - 60000
+                history = {str(o['id']): o for o in exchange.fetch_orders(symbol, since=since)}
+            except ccxt.RateLimitExceeded:
+                logger.error("Превышен лимит запросов, пауза 60 секунд")
+                user_bot.paused_until = time.time() + 60
+                return changed
+            except Exception as e:
+                logger.error(f"Ошибка получения истории ордеров {symbol}: {e}")
+
+            for order in missing:
+                order_info = history.get(str(order['id']))
+                if order_info is None:
+                    order_info = self._fetch_single_order(user_bot, order)
+                    if order_info is None:
+                        changed = changed or order not in user_bot.active_orders
+                        continue
+                if self._apply_order_update(user_bot, order, order_info):
+                    changed = True
+        return changed
+
+    def _fetch_single_order(self, user_bot, order):
+        """Запрос одного ордера, если его нет ни в открытых, ни в истории"""
+        try:
+            order_info = user_bot.exchange.fetch_order(order['id'], order['symbol'])
+
+            if order_info is None:
+                logger.error(f"Ошибка: не получена информация об ордере {order['id']}")
+                if time.time() - order['timestamp'] > 600:
+                    user_bot.active_orders.remove(order)
+                return None
+
+            # Проверка типа данных
+            if not isinstance(order_info, dict):
+                logger.error(f"Некорректный формат ордера: {type(order_info)}")
+                return None
+            return order_info
+
+        except ccxt.OrderNotFound:
+            user_bot.log(f"Ордер {order['id']} не найден, удаление")
+            user_bot.last_user_msg = ''
+            user_bot.active_orders.remove(order)
+        except ccxt.RateLimitExceeded:
+            logger.error("Превышен лимит запросов, пауза 60 секунд")
+            user_bot.paused_until = time.time() + 60
+        except ccxt.NetworkError as e:
+            logger.error(f"Сетевая ошибка при проверке ордера: {e}")
         except Exception as e:
-            logger.error(f"Ошибка логирования для {user_id}: {e}")
+            logger.error(f"Ошибка при выполнении операции: {e}")
+        return None
 
-    user_log("Торговый бот запущен")
+    def _apply_order_update(self, user_bot, order, order_info):
+        """Обработка исполнения или отмены ордера; True - ордер снят с учета"""
+        active_orders = user_bot.active_orders
+        if order not in active_orders:
+            return False
 
-    try:
-        while user_settings.get('enabled', False):
+        if order_info['status'] == 'closed':
+
+            # Расчет прибыли
             try:
-                current_time = time.time()
-                if current_time - last_subscription_check > SUBSCRIPTION_CHECK_INTERVAL:
-                    # Обновляем настройки для получения актуальных данных
-                    user_settings = get_user_settings(user_id)
-                    last_subscription_check = current_time
-
-                    # Проверяем, не истекла ли подписка
-                    if current_time > user_settings['subscription_end']:
-                        user_log("❌ Ваша подписка истекла! Бот остановлен.")
-                        # Отключаем бота
-                        user_settings['enabled'] = False
-                        update_user_settings(user_id, user_settings)
-                        break  # Немедленный выход из цикла
-                # Проверка активных ордеров
-                for order in active_orders.copy():
-                    try:
-                        order_info = exchange.fetch_order(order['id'], user_settings['symbol'])
-
-                        if order_info is None:
-                            logger.error(f"Ошибка: не получена информация об ордере {order['id']}")
-                            if time.time() - order['timestamp'] > 600:
-                                active_orders.remove(order)
-                            continue
-
-                            # Проверка типа данных
-                        if not isinstance(order_info, dict):
-                            logger.error(f"Некорректный формат ордера: {type(order_info)}")
-                            continue
-
-                        if order_info['status'] == 'closed':
-
-                            # Расчет прибыли
-                            try:
-                                buy_price = float(order['buy_price'])
-                                sell_price = float(order_info.get('price'))
-                                buy_fee = float(order.get('buy_fee') or 0)
-                                sell_fee = float(order_info.get('fee') or 0)
-                                amount = float(order_info.get('amount') or 0)
-
-                                if sell_price <= 0 or amount <= 0:
-                                    logger.error(
-                                        f"Некорректные данные для расчета прибыли: sell_price={sell_price}, amount={amount}")
-                                    active_orders.remove(order)
-                                    continue
-
-                                profit = round((sell_price - buy_price) * amount - buy_fee - sell_fee, 6)
-                            except (ValueError, TypeError) as e:
-                                logger.error(f"Ошибка расчета прибыли: {e}, данные ордера: {order_info}")
-                                active_orders.remove(order)
-                                continue
-
-                            record_profit(user_id, profit, user_settings['symbol'], buy_price,
-                                          float(order_info['price']))
-
-                            active_orders.remove(order)
-
-                            # Пауза перед следующей покупкой
-                            if float(user_settings['cooldown']) > 0:
-                                time.sleep(float(user_settings['cooldown']))
-
-                            last_buy_price = None
-
-                            user_log(f"Ордер {order_info['id']} исполнен по цене {order_info['price']}\n"
-                                     f"Прибыль: {profit:.6f} USDT\n")
-                            last_user_msg = ''
-
-
-                        elif order_info['status'] == 'canceled':
-                            user_log(f"Ордер {order['id']} отменен")
-                            active_orders.remove(order)
-                            last_user_msg = ''
-
-                    except ccxt.OrderNotFound:
-                        user_log(f"Ордер {order['id']} не найден, удаление")
-                        last_user_msg = ''
-                        active_orders.remove(order)
-                        continue
-                    except ccxt.RateLimitExceeded:
-                        logger.error("Превышен лимит запросов, пауза 60 секунд")
-                        time.sleep(60)
-                    except ccxt.NetworkError as e:
-                        logger.error(f"Сетевая ошибка при проверке ордера: {e}")
-                        continue
-                    except Exception as e:
-                        logger.error(f"Ошибка при выполнении операции: {e}")
+                buy_price = float(order['buy_price'])
+                sell_price = float(order_info.get('price'))
+                buy_fee = float(order.get('buy_fee') or 0)
+                sell_fee = order_fee_cost(order_info.get('fee'), sell_price)
+                amount = float(order_info.get('amount') or 0)
+
+                if sell_price <= 0 or amount <= 0:
+                    logger.error(
+                        f"Некорректные данные для расчета прибыли: sell_price={sell_price}, amount={amount}")
+                    active_orders.remove(order)
+                    return True
+
+                profit = DcaStrategy.profit(buy_price, sell_price, amount, buy_fee, sell_fee)
+            except (ValueError, TypeError) as e:
+                logger.error(f"Ошибка расчета прибыли: {e}, данные ордера: {order_info}")
+                active_orders.remove(order)
+                return True
+
+            record_profit(user_bot.user_id, profit, order['symbol'], buy_price,
+                          float(order_info['price']))
+            balance_cache.credit(user_bot.account, sell_price * amount - sell_fee)
+
+            active_orders.remove(order)
+
+            # Пауза перед следующей покупкой - таймер вместо sleep
+            cooldown = user_bot.strategy.cooldown
+            user_bot.last_buy_price = None
+            if cooldown > 0:
+                user_bot.cooldown_until = time.time() + cooldown
+                self.call_later(cooldown, self.wake, user_bot)
+            else:
+                self.wake(user_bot)
+
+            user_bot.notify_trade('fill', f"Ордер {order_info['id']} исполнен по цене {order_info['price']}\n"
+                                          f"Прибыль: {profit:.6f} USDT\n", profit=profit)
+            user_bot.last_user_msg = ''
+            return True
+
+        elif order_info['status'] == 'canceled':
+            user_bot.log(f"Ордер {order['id']} отменен")
+            active_orders.remove(order)
+            user_bot.last_user_msg = ''
+            return True
+
+        return False
+
+    def _try_buy(self, user_bot):
+        """Проверка условий и покупка по текущей цене"""
+        self._sync_symbol(user_bot)
+        strategy = user_bot.strategy
+        exchange = user_bot.exchange
+        symbol = user_bot.symbol
 
-                # Получаем текущую цену
-                try:
-                    current_price = get_cached_price(user_settings['symbol'])
-                    if current_price is None:
-                        logger.error("Не удалось получить текущую цену, пропускаем цикл")
-                        time.sleep(10)
-                        continue
-                except Exception as e:
-                    logger.error(f"Ошибка получения цены: {e}")
-                    time.sleep(30)
-                    continue
-
-                should_buy = True
-                # Проверка условий для покупки
-                if last_buy_price is None:
-                    should_buy = True
-                else:
-                    if last_buy_price <= 0:
-                        logger.error(f"Некорректное значение last_buy_price: {last_buy_price}")
-                    else:
-                        price_drop = (last_buy_price - current_price) / last_buy_price * 100
-                        should_buy = price_drop >= user_settings['fall_percent']
-
-                if should_buy:
-                    if len(active_orders) <= user_settings['orders_limit'] or user_settings['orders_limit'] == 0:
-                        # Выполнение покупки
-                        if current_price <= 0:
-                            logger.error(f"Некорректная текущая цена: {current_price}")
-                            continue
-
-                        # Проверяем доступный баланс USDT перед покупкой
-                        try:
-                            balance = exchange.fetch_balance()
-                            available_balance = balance['USDT']['free']
-                        except Exception as e:
-                            logger.error(f"Ошибка получения баланса: {e}")
-                            available_balance = 0
-
-                        if available_balance < float(user_settings['amount']):
-                            if last_user_msg != "Недостаточно средств для операции":
-                                user_log("Недостаточно средств для операции")
-                                last_user_msg = "Недостаточно средств для операции"
-                            time.sleep(5)
-                            continue
-
-                        amount = float(user_settings['amount']) / current_price
-
-                        try:
-                            # Рыночная покупка
-                            buy_order = exchange.create_market_buy_order(
-                                user_settings['symbol'],
-                                amount
-                            )
-                            buy_order_info = exchange.fetch_order(buy_order['id'], user_settings['symbol'])
-
-                            # Проверяем наличие необходимых данных
-                            if buy_order_info.get('average') is None or buy_order_info.get('amount') is None:
-                                logger.error(f"Ошибка: buy_order_info содержит None значения: {buy_order_info}")
-                                continue
-
-                            last_buy_price = float(buy_order_info['average'])
-
-                            # Лимитная продажа
-                            sell_price = last_buy_price * (1 + float(user_settings['rise_percent']) / 100)
-                            sell_order = exchange.create_limit_sell_order(
-                                user_settings['symbol'],
-                                float(buy_order_info['amount']),
-                                sell_price
-                            )
-
-                            user_log(f"Куплено {amount:.6f} {user_settings['symbol']} по {current_price:.6f}\n"
-                                     f"Выставлен ордер на продажу по {sell_price:.6f}")
-                            last_user_msg = ''
-
-                            active_orders.append({
-                                'id': sell_order['id'],
-                                'amount': float(sell_order['amount']) if sell_order.get('amount') else 0.0,
-                                'sell_price': sell_price,
-                                'timestamp': time.time(),
-                                'buy_price': float(buy_order_info['average']),
-                                'buy_fee': float(buy_order_info.get('fee') or 0),
-                            })
-
-                        except ccxt.InsufficientFunds:
-                            user_log("Недостаточно средств для операции")
-                            last_user_msg = ''
-                    else:
-                        continue
+        current_time = time.time()
+        if current_time < user_bot.cooldown_until or current_time < user_bot.paused_until:
+            return
 
-                time.sleep(2)
+        # Получаем текущую цену
+        current_price = get_cached_price(symbol)
+        if current_price is None:
+            logger.error("Не удалось получить текущую цену, пропускаем цикл")
+            return
 
-            except Exception as e:
-                logger.error(f"Ошибка в торговом цикле: {e}")
-                time.sleep(30)
+        # Проверка условий для покупки
+        if user_bot.last_buy_price is not None and user_bot.last_buy_price <= 0:
+            logger.error(f"Некорректное значение last_buy_price: {user_bot.last_buy_price}")
+        if not strategy.should_buy(current_price, user_bot.last_buy_price):
+            return
+        if not strategy.can_open(len(user_bot.active_orders)):
+            return
 
-    except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
-    finally:
-        user_log("Торговый бот остановлен")
-        user_settings = get_user_settings(user_id)
-        # Обновляем статус пользователя
-        user_settings['enabled'] = False
-        update_user_settings(user_id, user_settings)
+        # Выполнение покупки
+        if current_price <= 0:
+            logger.error(f"Некорректная текущая цена: {current_price}")
+            return
+
+        # Пока аккаунт в паузе по нехватке средств, к бирже не обращаемся
+        if balance_cache.is_underfunded(user_bot.account):
+            return
+
+        # Проверяем доступный баланс USDT перед покупкой (из кэша)
+        available_balance = balance_cache.get_free(user_bot.account, exchange)
+
+        if available_balance < strategy.amount:
+            self._pause_underfunded(user_bot)
+            return
+        balance_cache.mark_funded(user_bot.account)
+
+        amount = strategy.buy_amount(current_price)
+
+        try:
+            # Рыночная покупка
+            buy_order = exchange.create_market_buy_order(symbol, amount)
+            with request_priority(PRIORITY_ORDER):
+                buy_order_info = exchange.fetch_order(buy_order['id'], symbol)
+
+            # Проверяем наличие необходимых данных
+            if buy_order_info.get('average') is None or buy_order_info.get('amount') is None:
+                logger.error(f"Ошибка: buy_order_info содержит None значения: {buy_order_info}")
+                return
+
+            user_bot.last_buy_price = float(buy_order_info['average'])
+            buy_cost = buy_order_info.get('cost') or user_bot.last_buy_price * float(buy_order_info['amount'])
+            balance_cache.spend(user_bot.account, float(buy_cost))
+
+            # Лимитная продажа
+            sell_price = strategy.sell_price(user_bot.last_buy_price)
+            sell_order = exchange.create_limit_sell_order(
+                symbol,
+                float(buy_order_info['amount']),
+                sell_price
+            )
+
+            user_bot.notify_trade('buy', f"Куплено {amount:.6f} {symbol} по {current_price:.6f}\n"
+                                         f"Выставлен ордер на продажу по {sell_price:.6f}", cost=float(buy_cost))
+            user_bot.last_user_msg = ''
+
+            user_bot.active_orders.append({
+                'id': sell_order['id'],
+                'symbol': symbol,
+                'amount': float(sell_order['amount']) if sell_order.get('amount') else 0.0,
+                'sell_price': sell_price,
+                'timestamp': time.time(),
+                'buy_price': float(buy_order_info['average']),
+                'buy_fee': order_fee_cost(buy_order_info.get('fee'), buy_order_info['average']),
+            })
+            user_bot.order_check_interval = ORDER_CHECK_INTERVAL
+            self._schedule_order_check(user_bot)
+
+        except ccxt.InsufficientFunds:
+            # Кэш разошелся с биржей - сбрасываем его и уходим в паузу
+            balance_cache.invalidate(user_bot.account)
+            self._pause_underfunded(user_bot)
+        except ccxt.RateLimitExceeded:
+            logger.error("Превышен лимит запросов, пауза 60 секунд")
+            user_bot.paused_until = time.time() + 60
+            self.call_later(60, self.wake, user_bot)
+
+    def _pause_underfunded(self, user_bot):
+        """Нехватка средств: одно сообщение и экспоненциально растущая пауза"""
+        if user_bot.last_user_msg != "Недостаточно средств для операции":
+            user_bot.log("Недостаточно средств для операции")
+            user_bot.last_user_msg = "Недостаточно средств для операции"
+        delay = balance_cache.mark_underfunded(user_bot.account)
+        user_bot.paused_until = time.time() + delay
+        self.call_later(delay, self.wake, user_bot)
+
+
+trading_engine = TradingEngine()
 
 
 #############################################################################
@@ -646,11 +1365,13 @@ def handle_help(message):
         "/set_rise_percent - Установить процент роста\n"
         "/set_cooldown - Установить время ожидания\n"
         "/set_orders_limit - Установить ограничение на количество ордеров\n"
+        "/set_notify - Режим уведомлений о сделках (сразу, пачкой, сводка)\n"
         "/view_settings - Показать ваши настройки\n\n"
         "🚀 <b>Управление ботом:</b>\n"
         "/start_bot - Запустить торгового бота\n"
         "/stop_bot - Остановить торгового бота\n"
-        "/get_profit - Показать прибыль за месяц\n\n"
+        "/get_profit - Показать прибыль за месяц\n"
+        "/suggest_params [дней] - Подобрать параметры по истории цен\n\n"
         "ℹ️ <b>Прочее:</b>\n"
         "/status - Показать статус бота"
     )
@@ -665,7 +1386,8 @@ def handle_help(message):
             "/admin_add_subscription [user_id] [секунды] - Изменить подписку\n\n"
             "⚙️ <b>Система:</b>\n"
             "/get_logs - Скачать файл логов\n"
-            "/admin_status - Статус системы")
+            "/admin_status - Статус системы\n"
+            "/admin_rebuild_profit - Пересчитать свертки прибыли")
     bot.send_message(message.chat.id, help_text, reply_markup=make_keyboard(), parse_mode='HTML')
 
 
@@ -786,25 +1508,27 @@ def handle_admin_broadcast(message):
         text = parts[2].strip()
 
         if target == 'all':
-            # Отправка всем пользователям
+            # Отправка всем пользователям через очередь (лимиты Telegram соблюдает она), отчет - по завершении
             user_ids = [int(uid) for uid in settings['users'].keys()]
-            success = 0
-            failed = 0
+            results = {'success': 0, 'failed': 0}
+            results_lock = threading.Lock()
+            admin_chat_id = message.chat.id
+
+            def on_sent(ok):
+                with results_lock:
+                    results['success' if ok else 'failed'] += 1
+                    finished = results['success'] + results['failed'] == len(user_ids)
+                if finished:
+                    telegram_queue.send(admin_chat_id,
+                                        f"✅ Рассылка завершена!\n"
+                                        f"• Успешно: {results['success']}\n"
+                                        f"• Не удалось: {results['failed']}")
 
             for uid in user_ids:
-                try:
-                    bot.send_message(uid, f"📢 <b>Важное сообщение:</b>\n\n{text}", parse_mode='HTML')
-                    success += 1
-                    time.sleep(0.1)  # Защита от флуд-контроля
-                except Exception as e:
-                    logger.error(f"Ошибка отправки сообщения {uid}: {e}")
-                    failed += 1
+                telegram_queue.send(uid, f"📢 <b>Важное сообщение:</b>\n\n{text}", callback=on_sent,
+                                    parse_mode='HTML')
 
-            report = (
-                f"✅ Рассылка завершена!\n"
-                f"• Успешно: {success}\n"
-                f"• Не удалось: {failed}"
-            )
+            report = f"📨 Рассылка поставлена в очередь: {len(user_ids)} получателей"
         elif target.isdigit():
             # Отправка конкретному пользователю
             try:
@@ -864,23 +1588,12 @@ def handle_admin_user_info(message):
         conn = sqlite3.connect('profits.db')
         c = conn.cursor()
 
-        # Общая прибыль
-        c.execute('''SELECT SUM(profit) FROM profits WHERE user_id = ?''', (target_user_id,))
-        total_profit = c.fetchone()[0] or 0
-
-        # Общее количество сделок
-        c.execute('''SELECT COUNT(*) FROM profits WHERE user_id = ?''', (target_user_id,))
-        total_trades = c.fetchone()[0]
+        # Общая прибыль и количество сделок
+        c.execute(SELECT_USER_TOTALS, (target_user_id,))
+        total_profit, total_trades = c.fetchone() or (0, 0)
 
         # Прибыль по месяцам
-        c.execute('''SELECT 
-                     strftime('%Y-%m', datetime(timestamp, 'unixepoch')) as month,
-                     SUM(profit), COUNT(*)
-                     FROM profits 
-                     WHERE user_id = ?
-                     GROUP BY month
-                     ORDER BY month DESC
-                     LIMIT 6''', (target_user_id,))
+        c.execute(SELECT_USER_MONTHS, (target_user_id,))
 
         monthly_data = c.fetchall()
 
@@ -900,10 +1613,7 @@ def handle_admin_user_info(message):
         # Последние сделки
         trade_info = ""
         if trade_limit > 0 and total_trades > 0:
-            c.execute('''SELECT * FROM profits 
-                         WHERE user_id = ? 
-                         ORDER BY timestamp DESC
-                         LIMIT ?''', (target_user_id, trade_limit))
+            c.execute(SELECT_RECENT_TRADES, (target_user_id, trade_limit))
 
             trades = c.fetchall()
 
@@ -957,16 +1667,24 @@ def handle_admin_edit_user(message):
         # Преобразование типов
         if setting_name in ['fall_percent', 'rise_percent', 'amount']:
             setting_value = float(setting_value)
-        elif setting_name in ['cooldown', 'orders_limit', 'subscription_price']:
+        elif setting_name in ['cooldown', 'orders_limit', 'subscription_price', 'notify_interval']:
             setting_value = int(setting_value)
         elif setting_name == 'enabled':
             setting_value = setting_value.lower() in ['true', '1', 'yes', 'y']
         elif setting_name == 'symbol':
             setting_value = setting_value.upper()
+        elif setting_name == 'notify_mode':
+            setting_value = parse_notify_mode(setting_value)[0]
 
         user_settings[setting_name] = setting_value
         update_user_settings(target_user_id, user_settings)
 
+        if setting_name == 'enabled':
+            if setting_value:
+                trading_engine.start_user(target_user_id)
+            else:
+                trading_engine.stop_user(target_user_id)
+
         bot.reply_to(
             message,
             f"✅ Настройка обновлена:\n"
@@ -1000,25 +1718,32 @@ def handle_admin_status(message):
 
     # Статистика потоков
     total_threads = threading.active_count()
-    active_trading_threads = []
-    for user_id_str, data in user_threads.items():
-        if data['thread'].is_alive():
-            user_id = int(user_id_str)
-            user_settings = get_user_settings(user_id)
-            runtime = time.time() - data['start_time']
-            mins, secs = divmod(int(runtime), 60)
-            hours, mins = divmod(mins, 60)
-            active_trading_threads.append(
-                f"• ID: {user_id} | Пара: {user_settings['symbol']} | "
-                f"Время: {hours:02d}:{mins:02d}:{secs:02d} | "
-                f"Рестартов: {data.get('restart_count', 0)}"
-            )
+    active_trading_bots = []
+    for user_bot in list(trading_engine.bots.values()):
+        runtime = time.time() - user_bot.start_time
+        mins, secs = divmod(int(runtime), 60)
+        hours, mins = divmod(mins, 60)
+        active_trading_bots.append(
+            f"• ID: {user_bot.user_id} | Пара: {user_bot.symbol} | "
+            f"Время: {hours:02d}:{mins:02d}:{secs:02d} | "
+            f"Ордеров: {len(user_bot.active_orders)}"
+        )
 
     # Статистика кошельков
-    with wallets_lock:
-        reserved_wallets = len(active_wallets)
-        checking_wallets = sum(1 for w in active_wallets if w.get('checking', False))
-        wallet_occupation = f"{reserved_wallets}/{len(WALLETS)}"
+    reserved_wallets, checking_wallets, used_wallets, total_wallets = wallet_pool.summary()
+
+    # Статистика потока цен
+    if price_stream is None:
+        stream_status = "выключен (REST)"
+    else:
+        stream_status = (f"{len(price_stream.tasks)} подписок, тиков: {price_stream.ticks}, "
+                         f"переподключений: {price_stream.reconnects}")
+
+    if user_streams is None:
+        user_stream_status = "выключены (опрос)"
+    else:
+        user_stream_status = (f"{len(user_streams.accounts)} аккаунтов, событий: {user_streams.events}, "
+                              f"переподключений: {user_streams.reconnects}")
 
     # Статистика памяти
     process = psutil.Process(os.getpid())
@@ -1028,7 +1753,7 @@ def handle_admin_status(message):
     # Статистика файлов
     log_size = os.path.getsize(LOG_FILE) if os.path.exists(LOG_FILE) else 0
     db_size = os.path.getsize('profits.db') if os.path.exists('profits.db') else 0
-    settings_size = os.path.getsize(SETTINGS_PATH) if os.path.exists(SETTINGS_PATH) else 0
+    settings_size = os.path.getsize(settings_store.path) if os.path.exists(settings_store.path) else 0
 
     # Статистика ошибок
     error_count = 0
@@ -1062,17 +1787,32 @@ def handle_admin_status(message):
 
         "🧵 <b>Потоки:</b>\n"
         f"• Всего потоков: {total_threads}\n"
-        f"• Торговых потоков: {len(active_trading_threads)}\n\n"
+        f"• Торговых ботов: {len(active_trading_bots)}\n"
+        f"• Рабочих потоков пула: {trading_engine.workers}\n\n"
 
         "💼 <b>Кошельки:</b>\n"
-        f"• Занято/Всего: {wallet_occupation}\n"
-        f"• В процессе проверки: {checking_wallets}\n\n"
+        f"• Ожидают оплаты: {reserved_wallets} на {used_wallets}/{total_wallets} кошельках\n"
+        f"• В процессе проверки: {checking_wallets}\n"
+        f"• Проверка оплат: ожидают {deposit_watcher.waiting}, опросов {deposit_watcher.stats['polls']}, "
+        f"запросов {deposit_watcher.stats['requests']}, найдено {deposit_watcher.stats['matched']}\n\n"
 
         "📊 <b>Данные:</b>\n"
         f"• Кэш цен: {len(price_cache)} символов\n"
+        f"• Клиентов биржи в пуле: {len(exchange_instances)}\n"
+        f"• Лимиты биржи: {request_scheduler.summary()}\n"
+        f"• Очередь Telegram: {telegram_queue.summary()}\n"
+        f"• Сводки о сделках: ожидают {len(trade_notifier.pending)}, отправлено {trade_notifier.sent}\n"
+        f"• Цикл обновления цен: {price_update_stats['last_duration']:.2f} сек "
+        f"(сред. {price_update_stats['avg_duration']:.2f}, макс. {price_update_stats['max_duration']:.2f})\n"
+        f"• Поток цен: {stream_status}\n"
+        f"• Приватные потоки: {user_stream_status}\n"
         f"• Размер лога: {log_size / 1024:.1f} KB\n"
         f"• Размер БД: {db_size / 1024:.1f} KB\n"
+        f"• Журнал прибыли: очередь {profit_ledger.depth}, {profit_ledger.rows} строк, "
+        f"коммит {profit_ledger.last_latency * 1000:.1f} мс (макс. {profit_ledger.max_latency * 1000:.1f})\n"
         f"• Размер настроек: {settings_size / 1024:.1f} KB\n"
+        f"• Запись настроек: {settings_writer.written} изм. за {settings_writer.flushes} сбросов, "
+        f"в очереди {len(settings_writer.dirty)}\n"
         f"• Ошибок в логе: {error_count}\n\n"
 
         "💻 <b>Ресурсы:</b>\n"
@@ -1084,16 +1824,32 @@ def handle_admin_status(message):
         f"• Системы: {format_uptime(time.time() - start_time)}"
     )
 
-    # Активные торговые потоки
-    if active_trading_threads:
-        response += "🔥 <b>Активные торговые потоки:</b>\n" + "\n".join(active_trading_threads)
+    # Активные торговые боты
+    if active_trading_bots:
+        response += "\n\n🔥 <b>Активные торговые боты:</b>\n" + "\n".join(active_trading_bots)
     else:
-        response += "\nℹ️ Нет активных торговых потоков"
+        response += "\nℹ️ Нет активных торговых ботов"
 
     # Отправка отчета
     bot.send_message(message.chat.id, response, parse_mode='HTML')
 
 
+@bot.message_handler(commands=['admin_rebuild_profit'])
+def handle_admin_rebuild_profit(message):
+    if message.from_user.id not in ADMINS_ID:
+        return
+
+    try:
+        # Сначала дописываем очередь журнала, чтобы пересчет учел все сделки
+        profit_ledger.flush()
+        start_time = time.time()
+        trades = rebuild_rollups('profits.db')
+        bot.reply_to(message, f"✅ Свертки прибыли пересчитаны: {trades} сделок за {time.time() - start_time:.1f} сек")
+    except Exception as e:
+        logger.error(f"Ошибка пересчета сверток прибыли: {e}")
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+
 @bot.message_handler(commands=['admin_add_subscription'])
 def handle_add_subscription(message):
     user_id = message.from_user.id
@@ -1124,6 +1880,7 @@ def handle_view_settings(message):
         'cooldown': 'Время ожидания',
         'amount': 'Сумма покупки',
         'orders_limit': 'Лимит ордеров',
+        'notify_mode': 'Уведомления о сделках',
         'subscription_price': 'Цена подписки',
         'subscription_end': 'Окончание подписки',
         'enabled': 'Статус бота'
@@ -1133,7 +1890,7 @@ def handle_view_settings(message):
     formatted_settings = []
     for key, value in user_settings.items():
         # Пропускаем ненужные параметры
-        if key in ['subscription_price', 'sub']:
+        if key in ['subscription_price', 'sub', 'notify_interval']:
             continue
 
         # Форматирование специальных значений
@@ -1141,6 +1898,8 @@ def handle_view_settings(message):
             value = datetime.fromtimestamp(value).strftime('%d.%m.%Y %H:%M:%S')
         elif key == 'enabled':
             value = "🟢 запущен" if value else "🔴 остановлен"
+        elif key == 'notify_mode':
+            value = describe_notify_mode(value, user_settings.get('notify_interval', 60))
         elif key == 'api_key' and value:
             value = '*****' + value[-4:]
         elif key == 'api_secret' and value:
@@ -1243,6 +2002,20 @@ def set_cooldown(message):
     )
 
 
+@bot.message_handler(commands=['set_notify'])
+def set_notify(message):
+    user_id = message.from_user.id
+    user_states[user_id] = 'waiting_notify'
+    bot.send_message(
+        message.chat.id,
+        "Выберите режим уведомлений о сделках:\n"
+        "instant - каждая покупка и продажа отдельным сообщением\n"
+        "batch 60 - одно сообщение раз в указанное число секунд\n"
+        "digest - сводка раз в час",
+        reply_markup=make_keyboard()
+    )
+
+
 @bot.message_handler(commands=['start_bot'])
 def start_user_bot(message):
     user_id = message.from_user.id
@@ -1275,18 +2048,8 @@ def start_user_bot(message):
     user_settings['enabled'] = True
     update_user_settings(user_id, user_settings)
 
-    # Создаем и запускаем поток для пользователя
-    thread = threading.Thread(
-        target=user_trading_bot,
-        args=(user_id,),
-        daemon=True
-    )
-    user_threads[user_id_str] = {
-        'thread': thread,
-        'start_time': time.time(),
-        'restart_count': 0
-    }
-    thread.start()
+    if not trading_engine.start_user(user_id):
+        return
 
     bot.reply_to(message, "🚀 Торговый бот запущен!")
 
@@ -1301,12 +2064,13 @@ def stop_user_bot(message):
         bot.reply_to(message, "❌ Бот не был запущен")
         return
 
-    # Остановка бота
-    user_settings['enabled'] = False
-    update_user_settings(user_id, user_settings)
-
     bot.reply_to(message, "Остановка...")
 
+    # Остановка бота
+    if not trading_engine.stop_user(user_id):
+        user_settings['enabled'] = False
+        update_user_settings(user_id, user_settings)
+
 
 @bot.message_handler(commands=['get_profit'])
 def get_user_profit(message):
@@ -1315,19 +2079,9 @@ def get_user_profit(message):
         conn = sqlite3.connect('profits.db')
         c = conn.cursor()
 
-        # Рассчитываем начало и конец текущего месяца
+        # Свертка за текущий месяц (местное время)
         today = datetime.now()
-        first_day = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        _, last_day_of_month = monthrange(today.year, today.month)
-        last_day = today.replace(day=last_day_of_month, hour=23, minute=59, second=59)
-
-        # Выполняем запрос
-        c.execute('''SELECT SUM(profit), COUNT(*), symbol 
-                     FROM profits 
-                     WHERE user_id = ? 
-                     AND timestamp BETWEEN ? AND ? 
-                     GROUP BY symbol''',
-                  (user_id, first_day.timestamp(), last_day.timestamp()))
+        c.execute(SELECT_MONTH_PROFIT, (user_id, today.strftime('%Y-%m')))
 
         results = c.fetchall()
         conn.close()
@@ -1360,6 +2114,56 @@ def get_user_profit(message):
         bot.reply_to(message, f"❌ Ошибка получения данных: {str(e)}")
 
 
+@bot.message_handler(commands=['suggest_params'])
+def suggest_params(message):
+    user_id = message.from_user.id
+    try:
+        parts = message.text.split()
+        days = int(parts[1]) if len(parts) > 1 else SUGGEST_DEFAULT_DAYS
+        if not 1 <= days <= SUGGEST_MAX_DAYS:
+            raise ValueError(f"Период должен быть от 1 до {SUGGEST_MAX_DAYS} дней")
+        user_settings = get_user_settings(user_id)
+
+        bot.reply_to(message, f"⏳ Подбираю параметры для {user_settings['symbol']} по истории за {days} дн...")
+        threading.Thread(target=run_suggest_params,
+                         args=(message.chat.id, user_settings['symbol'], days, float(user_settings['amount'])),
+                         daemon=True).start()
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+
+def run_suggest_params(chat_id, symbol, days, amount):
+    """Бэктест вариантов параметров на минутных свечах; результаты кэшируются по символу и периоду"""
+    try:
+        with suggest_lock:
+            key = (symbol, days)
+            cached = suggest_cache.get(key)
+            if cached is None or time.time() - cached[0] > SUGGEST_CACHE_TTL:
+                data = fetch_ohlcv_history(get_ticker_exchange(), symbol, days)
+                results = optimize(data, random_candidates(SUGGEST_CANDIDATES), 10.0, symbol,
+                                   workers=SUGGEST_WORKERS)
+                cached = suggest_cache[key] = (time.time(), results)
+
+        # Прибыль считалась для покупок по 10 USDT - масштабируем на сумму пользователя
+        scale = amount / 10.0
+        results = [dict(result, profit=result['profit'] * scale, drawdown=result['drawdown'] * scale)
+                   for result in cached[1]]
+        best = results[0]
+        computed = datetime.fromtimestamp(cached[0]).strftime('%d.%m.%Y %H:%M')
+        bot.send_message(
+            chat_id,
+            f"📈 <b>Лучшие параметры для {symbol}</b> (история {days} дн., расчет {computed}):\n"
+            f"<pre>{format_table(results, 5)}</pre>\n"
+            f"Лучший вариант: падение {best['fall_percent']}%, рост {best['rise_percent']}%, "
+            f"ожидание {best['cooldown']} сек, лимит ордеров {best['orders_limit']}\n"
+            f"Установить: /set_fall_percent, /set_rise_percent, /set_cooldown, /set_orders_limit\n\n"
+            f"⚠️ Результаты на истории не гарантируют прибыль в будущем",
+            parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"Ошибка подбора параметров для {symbol}: {e}")
+        bot.send_message(chat_id, f"❌ Ошибка подбора параметров: {str(e)}")
+
+
 @bot.message_handler(commands=['status'])
 def bot_status(message):
     user_id = message.from_user.id
@@ -1399,50 +2203,41 @@ def handle_buy_subscription(message):
     user_settings = get_user_settings(user_id)
 
     # Проверяем, не имеет ли пользователь уже активный кошелек
-    with wallets_lock:
-        user_wallets = [w for w in active_wallets if w['user_id'] == user_id]
-        if user_wallets:
-            wallet = user_wallets[0]
-            remaining = int(WALLET_RESERVE_TIME - (time.time() - wallet['reserved_at']))
-            mins, secs = divmod(remaining, 60)
-
-            bot.send_message(
-                message.chat.id,
-                f"⚠️ У вас уже зарезервирован кошелек:\n<code>{wallet['address']}</code>\n\n"
-                f"⏳ Осталось времени: {mins} мин {secs} сек\n\n"
-                "После оплаты нажмите '✅ Оплатил'",
-                parse_mode='HTML',
-                reply_markup=payment_keyboard()
-            )
-            return
+    wallet = wallet_pool.get(user_id)
+    if wallet is not None:
+        remaining = int(WALLET_RESERVE_TIME - (time.time() - wallet['reserved_at']))
+        mins, secs = divmod(max(remaining, 0), 60)
 
-    # Выдаем свободный кошелек
-    wallet_address = get_available_wallet()
-    if not wallet_address:
         bot.send_message(
             message.chat.id,
-            "😔 Все кошельки заняты. Попробуйте позже.",
-            reply_markup=make_keyboard()
+            f"⚠️ У вас уже зарезервирован кошелек:\n<code>{wallet['address']}</code>\n"
+            f"Сумма к оплате: <code>{wallet['amount']:.4f}</code> USDT\n\n"
+            f"⏳ Осталось времени: {mins} мин {secs} сек\n\n"
+            "После оплаты нажмите '✅ Оплатил'",
+            parse_mode='HTML',
+            reply_markup=payment_keyboard()
         )
         return
 
-    # Резервируем кошелек
+    # Кошелек и уникальная на нем сумма: по ней перевод находит именно этого пользователя
     subscription_price = user_settings['subscription_price']
-    with wallets_lock:
-        active_wallets.append({
-            'address': wallet_address,
-            'user_id': user_id,
-            'reserved_at': time.time(),
-            'amount': subscription_price})
+    wallet = wallet_pool.reserve(user_id, subscription_price)
+    if wallet is None:
+        bot.send_message(
+            message.chat.id,
+            "😔 Не удалось подготовить оплату. Попробуйте позже.",
+            reply_markup=make_keyboard()
+        )
+        return
 
     # Отправляем информацию пользователю
-    subscription_price = user_settings['subscription_price']
     bot.send_message(message.chat.id,
                      f"Стоимость подписки {subscription_price} USDT за 30 дней\n"
-                     f"💳 Для оплаты подписки отправьте {subscription_price} USDT на кошелек:\n\n"
-                     f"<code>{wallet_address}</code>\n\n"
+                     f"💳 Для оплаты подписки отправьте ровно <code>{wallet['amount']:.4f}</code> USDT на кошелек:\n\n"
+                     f"<code>{wallet['address']}</code>\n\n"
                      "⚠️ Внимание:\n"
-                     "1. Отправляйте только USDT (сеть - BSC-20).\n"
+                     "1. Отправляйте только USDT (сеть - BSC-20) и точно указанную сумму: "
+                     "по дробной части мы узнаем ваш платеж.\n"
                      "2. Проверяйте адрес перед отправкой, утерянные средства невозможно вернуть.\n"
                      "3. В случае Вашей ошибки при совершении транзакции потерянные средства возвращены не будут!\n\n"
                      "⏳ Кошелек зарезервирован на 60 минут\n"
@@ -1451,30 +2246,28 @@ def handle_buy_subscription(message):
                      reply_markup=payment_keyboard())
 
 
-# Добавляем функцию для обработки платежа в отдельном потоке
-def process_payment_confirmation(user_id, wallet_data):
+# Результат проверки платежа приходит из deposit_watcher (вызывается в его потоке, отправка - через очередь)
+def process_payment_confirmation(user_id, wallet_data, future):
+    if future.cancelled():
+        return  # резерв снят (отмена или истечение), ожидание больше не нужно
     try:
         wallet_address = wallet_data['address']
-        amount = wallet_data['amount']
+        payment_confirmed = future.result() is not None
 
-        payment_confirmed = fetch_deposits.sync_main(amount, wallet_address)
-
-        with wallets_lock:
-            # Удаляем кошелек только после успешной проверки
-            if payment_confirmed and wallet_data in active_wallets:
-                active_wallets.remove(wallet_data)
-            elif wallet_data in active_wallets:
-                # Снимаем флаг проверки при неудаче
-                wallet_data['checking'] = False
+        # Снимаем резерв только после успешной проверки, при неудаче - флаг проверки
+        if payment_confirmed:
+            wallet_pool.release(user_id, wallet_data, paid=True)
+        else:
+            wallet_pool.end_check(wallet_data)
 
         if payment_confirmed:
             # Продлеваем подписку
             new_end = extend_subscription(user_id, seconds=30 * 24 * 60 * 60)
             end_date = datetime.fromtimestamp(new_end).strftime('%d.%m.%Y %H:%M:%S')
-            bot.send_message(user_id, f"✅ Оплата подтверждена! Ваша подписка продлена до {end_date}",
-                             reply_markup=make_keyboard())
+            telegram_queue.send(user_id, f"✅ Оплата подтверждена! Ваша подписка продлена до {end_date}",
+                                reply_markup=make_keyboard())
         else:
-            bot.send_message(
+            telegram_queue.send(
                 user_id,
                 f"❌ Платеж на кошелек <code>{wallet_address}</code> не обнаружен.\n\n"
                 "Если вы отправили средства:\n"
@@ -1487,43 +2280,40 @@ def process_payment_confirmation(user_id, wallet_data):
     except Exception as e:
         logger.error(f"Ошибка обработки платежа для {user_id}: {e}")
         # Снимаем флаг проверки при ошибке
-        with wallets_lock:
-            if wallet_data in active_wallets:
-                wallet_data['checking'] = False
+        wallet_pool.end_check(wallet_data)
 
-        bot.send_message(user_id, "⚠️ Произошла ошибка при обработке платежа. Попробуйте позже.",
-                         reply_markup=payment_keyboard())
+        telegram_queue.send(user_id, "⚠️ Произошла ошибка при обработке платежа. Попробуйте позже.",
+                            reply_markup=payment_keyboard())
 
 
 @bot.message_handler(func=lambda m: m.text == '✅ Оплатил')
 def handle_payment_confirmation(message):
     user_id = message.from_user.id
 
-    with wallets_lock:
-        user_wallets = [w for w in active_wallets if w['user_id'] == user_id]
-        if not user_wallets:
-            bot.send_message(
-                message.chat.id,
-                "❌ У вас нет активного резерва кошелька.\n"
-                "Начните процесс оплаты заново.",
-                reply_markup=make_keyboard())
-            return
-
-        wallet = user_wallets[0]
-        # Добавляем метку о начале проверки (НЕ УДАЛЯЕМ!)
-        wallet['checking'] = True
-        wallet['checking_start'] = time.time()
+    # Отмечаем начало проверки (резерв НЕ снимается до подтверждения оплаты)
+    wallet, started = wallet_pool.begin_check(user_id)
+    if wallet is None:
+        bot.send_message(
+            message.chat.id,
+            "❌ У вас нет активного резерва кошелька.\n"
+            "Начните процесс оплаты заново.",
+            reply_markup=make_keyboard())
+        return
+    if not started:
+        bot.send_message(message.chat.id, "🔄 Платеж уже проверяется, мы сообщим о результате.")
+        return
 
     # Уведомляем пользователя
     bot.send_message(message.chat.id, "🔄 Проверяем ваш платеж... Это может занять несколько минут.",
                      reply_markup=ReplyKeyboardRemove())
+    watch_payment(user_id, wallet)
+
 
-    # Запускаем проверку
-    thread = threading.Thread(
-        target=process_payment_confirmation,
-        args=(user_id, wallet),
-        daemon=True)
-    thread.start()
+def watch_payment(user_id, wallet):
+    """Кошелек на проверку: переводы ищутся с момента резерва до его истечения"""
+    timeout = wallet['reserved_at'] + WALLET_RESERVE_TIME - time.time()
+    future = deposit_watcher.watch(wallet['address'], wallet['amount'], wallet['reserved_at'], timeout=timeout)
+    future.add_done_callback(lambda f: process_payment_confirmation(user_id, wallet, f))
 
 
 # Обработчик отмены оплаты
@@ -1531,23 +2321,18 @@ def handle_payment_confirmation(message):
 def handle_payment_cancel(message):
     user_id = message.from_user.id
 
-    with wallets_lock:
-        user_wallets = [w for w in active_wallets if w['user_id'] == user_id]
-        if user_wallets:
-            # Удаляем кошелек из активных
-            active_wallets.remove(user_wallets[0])
-
-            bot.send_message(
-                message.chat.id,
-                "❌ Резерв кошелька отменен.\n"
-                "Вы можете начать заново в любое время.",
-                reply_markup=make_keyboard()
-            )
-        else:
-            bot.send_message(
-                message.chat.id,
-                "ℹ️ У вас нет активного резерва кошелька.",
-                reply_markup=make_keyboard())
+    if wallet_pool.release(user_id) is not None:
+        bot.send_message(
+            message.chat.id,
+            "❌ Резерв кошелька отменен.\n"
+            "Вы можете начать заново в любое время.",
+            reply_markup=make_keyboard()
+        )
+    else:
+        bot.send_message(
+            message.chat.id,
+            "ℹ️ У вас нет активного резерва кошелька.",
+            reply_markup=make_keyboard())
 
 
 @bot.message_handler(func=lambda message: True)
@@ -1610,6 +2395,15 @@ def handle_all_messages(message):
             except:
                 bot.reply_to(message, "❌ Неверный формат. Введите целое число.")
 
+        elif state == 'waiting_notify':
+            try:
+                mode, interval = parse_notify_mode(message.text, user_settings.get('notify_interval', 60))
+                user_settings['notify_mode'] = mode
+                user_settings['notify_interval'] = interval
+                bot.reply_to(message, f"✅ Уведомления о сделках: {describe_notify_mode(mode, interval)}")
+            except ValueError as e:
+                bot.reply_to(message, f"❌ {e}")
+
         elif state == 'waiting_subscription_data':
             try:
                 # Парсим ввод: ID и секунд
@@ -1672,7 +2466,7 @@ def subscription_notifier():
                         )
 
                         # Отправляем сообщение
-                        bot.send_message(user_id, message, parse_mode='HTML')
+                        telegram_queue.send(user_id, message, parse_mode='HTML')
 
                         # Запоминаем, что уведомление отправлено
                         sent_notifications.add((user_id, int(days_left)))
@@ -1706,7 +2500,28 @@ def run_telegram_bot():
 
 if __name__ == "__main__":
     init_profit_db()
+    profit_ledger.start()
+    atexit.register(profit_ledger.stop)
+    telegram_queue.start()
+    atexit.register(telegram_queue.stop)
+    trade_notifier.start()
+    atexit.register(trade_notifier.stop)  # выполняется раньше остановки очереди: сводки успевают уйти
+    deposit_watcher.start()
     load_settings()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    # После настроек: восстановленная проверка может сразу продлить подписку
+    init_wallet_pool()
+    atexit.register(wallet_pool.stop)
+    atexit.register(deposit_watcher.stop)  # выполняется раньше: результаты проверок успевают записаться в пул
+
+    # Запуск потоковых цен (REST-опрос остается резервом)
+    if PRICE_STREAM_ENABLED:
+        start_price_stream()
+
+    # Запуск приватных потоков исполнения ордеров (опрос остается резервом)
+    if USER_STREAM_ENABLED:
+        start_user_streams()
 
     # Запуск системы обновления цен
     price_thread = threading.Thread(target=price_updater, daemon=True)
@@ -1720,70 +2535,26 @@ if __name__ == "__main__":
     notifier_thread = threading.Thread(target=subscription_notifier, daemon=True)
     notifier_thread.start()
 
-    # Автозапуск торговых потоков для включенных пользователей
-    for user_id_str, user_data in settings['users'].items():
+    # Запуск торгового движка и автозапуск включенных пользователей
+    trading_engine.start()
+    for user_id_str, user_data in list(settings['users'].items()):
         if user_data.get('enabled', False):
             user_id = int(user_id_str)
             logger.info(f"Автозапуск торгового бота для пользователя {user_id}")
-
-            thread = threading.Thread(
-                target=user_trading_bot,
-                args=(user_id,),
-                daemon=True
-            )
-            user_threads[user_id_str] = {
-                'thread': thread,
-                'start_time': time.time(),
-                'restart_count': 0
-            }
-            thread.start()
+            try:
+                trading_engine.start_user(user_id)
+            except Exception as e:
+                logger.error(f"Ошибка автозапуска торгового бота для {user_id}: {e}")
 
     # Основной цикл мониторинга
     while True:
         try:
-            # Проверка состояния потоков
-            for user_id_str, data in list(user_threads.items()):
-                thread = data['thread']
-                user_id = int(user_id_str)
-
-                if not thread.is_alive():
-                    user_settings = get_user_settings(user_id)
-
-                    # Если бот должен быть активен - перезапускаем
-                    if user_settings.get('enabled', False):
-                        restart_count = data.get('restart_count', 0) + 1
-
-                        # Логируем перезапуск
-                        logger.warning(f"Перезапуск торгового потока для {user_id} (попытка #{restart_count})")
-
-                        # Создаем новый поток
-                        new_thread = threading.Thread(
-                            target=user_trading_bot,
-                            args=(user_id,),
-                            daemon=True
-                        )
-                        new_thread.start()
-
-                        # Обновляем данные потока
-                        user_threads[user_id_str] = {
-                            'thread': new_thread,
-                            'start_time': time.time(),
-                            'restart_count': restart_count
-                        }
-                    else:
-                        # Удаляем неактивный поток
-                        del user_threads[user_id_str]
-                        logger.info(f"Удален остановленный поток для {user_id}")
+            # Запуск ботов, включенных в настройках, но не работающих
+            trading_engine.sync_enabled()
 
             # Пауза между проверками
             time.sleep(15)
 
-        except KeyboardInterrupt:
-            logger.info("Завершение работы...")
-            # Останавливаем все пользовательские боты
-            for user_id_str in list(settings['users'].keys()):
-                settings['users'][user_id_str]['enabled'] = False
-            save_settings()
         except Exception as e:
             logger.error(f"Ошибка в основном цикле: {e}")
             time.sleep(30)
@@ -0,0 +1,293 @@
+import argparse
+import bisect
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+from dca_strategy import DcaStrategy
+
+# Запас на погрешность float при сравнении цены с порогом (как в subscriber_index)
+THRESHOLD_EPSILON = 1e-12
+
+
+class MarketData:
+    """История цен в массивах NumPy; для тиков open = high = low = close = цена сделки"""
+
+    def __init__(self, timestamps, open_, high, low, close, kind='ticks'):
+        self.t = np.asarray(timestamps, dtype=np.float64)
+        self.open = np.asarray(open_, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        self.kind = kind
+        # Время в миллисекундах (ccxt, MEXC) переводим в секунды
+        if len(self.t) and self.t[0] > 1e11:
+            self.t = self.t / 1000
+
+    @classmethod
+    def from_ticks(cls, timestamps, prices):
+        prices = np.asarray(prices, dtype=np.float64)
+        return cls(timestamps, prices, prices, prices, prices, 'ticks')
+
+    @classmethod
+    def from_ohlcv(cls, timestamps, open_, high, low, close):
+        return cls(timestamps, open_, high, low, close, 'ohlcv')
+
+    def __len__(self):
+        return len(self.t)
+
+
+def _has_header(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.readline().split(',')[0].strip()
+    try:
+        float(first)
+        return False
+    except ValueError:
+        return True
+
+
+def load_market_data(path, symbol=None):
+    """CSV/Parquet с тиками (timestamp, price[, amount]) или свечами (timestamp, open, high, low, close[, volume]),
+    а также JSONL, записанный PRICE_STREAM_RECORD"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        if pq is None:
+            raise RuntimeError("Для чтения Parquet нужен пакет pyarrow")
+        table = pq.read_table(path)
+        columns = {name.lower(): table.column(name).to_numpy() for name in table.column_names}
+        timestamps = columns.get('timestamp', columns.get('t'))
+        if 'price' in columns:
+            return MarketData.from_ticks(timestamps, columns['price'])
+        return MarketData.from_ohlcv(timestamps, columns['open'], columns['high'], columns['low'], columns['close'])
+
+    if ext == '.jsonl':
+        wanted = symbol.replace('/', '') if symbol else None
+        timestamps, prices = [], []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                tick = json.loads(line)
+                if wanted and tick['s'] != wanted:
+                    continue
+                timestamps.append(tick['t'])
+                prices.append(float(tick['p']))
+        return MarketData.from_ticks(timestamps, prices)
+
+    data = np.loadtxt(path, delimiter=',', skiprows=1 if _has_header(path) else 0, ndmin=2)
+    if data.shape[1] >= 5:
+        return MarketData.from_ohlcv(data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4])
+    return MarketData.from_ticks(data[:, 0], data[:, 1])
+
+
+def fetch_ohlcv_history(exchange, symbol, days, timeframe='1m', limit=1000):
+    """Свечи за последние days дней через ccxt fetch_ohlcv, постранично"""
+    step = exchange.parse_timeframe(timeframe) * 1000
+    now = exchange.milliseconds()
+    since = now - int(days * 86400 * 1000)
+    rows = []
+    while since < now:
+        batch = exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+        if not batch:
+            break
+        rows.extend(batch)
+        since = batch[-1][0] + step
+        if len(batch) < limit:
+            break
+    if not rows:
+        raise ValueError(f"Нет истории цен для {symbol}")
+    data = np.asarray(rows, dtype=np.float64)
+    return MarketData.from_ohlcv(data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4])
+
+
+def first_index(values, start, end, predicate, chunk=4096):
+    """Первый индекс в [start, end), где predicate истинен; end, если такого нет.
+    Поиск блоками растущего размера: близкие события находятся быстро, далекие - без цикла Python"""
+    while start < end:
+        stop = min(end, start + chunk)
+        hits = np.flatnonzero(predicate(values[start:stop]))
+        if hits.size:
+            return start + int(hits[0])
+        start = stop
+        chunk = min(chunk * 4, 1 << 22)
+    return end
+
+
+class BacktestResult:
+    """Итог прогона: записи в формате журнала profits и метрики"""
+
+    def __init__(self, records, open_orders, unrealized, equity_t, equity, ticks, elapsed, max_open_orders):
+        self.records = records  # (user_id, profit, timestamp, symbol, buy_price, sell_price)
+        self.open_orders = open_orders
+        self.unrealized = unrealized
+        self.equity_t = np.asarray(equity_t, dtype=np.float64)
+        self.equity = np.asarray(equity, dtype=np.float64)
+        self.ticks = ticks
+        self.elapsed = elapsed
+        self.max_open_orders = max_open_orders
+
+    @property
+    def trades(self):
+        return len(self.records)
+
+    @property
+    def total_profit(self):
+        return sum(record[1] for record in self.records)
+
+    @property
+    def max_drawdown(self):
+        """Наибольшая просадка кривой капитала (реализованная прибыль + открытые позиции по цене события)"""
+        if not len(self.equity):
+            return 0.0
+        return float(np.max(np.maximum.accumulate(self.equity) - self.equity))
+
+    def summary(self):
+        speed = self.ticks / self.elapsed if self.elapsed > 0 else float('inf')
+        return (f"Сделок: {self.trades}\n"
+                f"Прибыль: {self.total_profit:.6f} USDT\n"
+                f"Открытых ордеров: {len(self.open_orders)} (нереализовано {self.unrealized:.6f} USDT)\n"
+                f"Макс. открытых ордеров: {self.max_open_orders}\n"
+                f"Макс. просадка: {self.max_drawdown:.6f} USDT\n"
+                f"Тиков: {self.ticks} за {self.elapsed:.3f} сек ({speed / 1e6:.1f} млн/сек)")
+
+
+class Backtest:
+    """Воспроизведение истории цен через DcaStrategy с исполнением лимитных продаж и комиссиями.
+
+    Между событиями (покупка, исполнение продажи) цикл Python не выполняется: следующее событие
+    находится векторным поиском по массивам цен"""
+
+    def __init__(self, data, strategy, symbol='BTC/USDT', taker_fee=0.0005, maker_fee=0.0, user_id=0):
+        self.data = data
+        self.strategy = strategy
+        self.symbol = symbol
+        self.taker_fee = taker_fee
+        self.maker_fee = maker_fee
+        self.user_id = user_id
+
+    def run(self):
+        started = time.perf_counter()
+        data, strategy = self.data, self.strategy
+        t, open_, high, low = data.t, data.open, data.high, data.low
+        n = len(data)
+        # На тиках покупка после исполнения возможна по той же цене, на свечах - со следующей свечи
+        rebuy_offset = 0 if data.kind == 'ticks' else 1
+
+        orders = []  # отсортированы по цене продажи: (sell_price, amount, buy_price, buy_fee)
+        records = []
+        equity_t, equity = [], []
+        realized = 0.0
+        last_buy_price = None
+        cooldown_until = -np.inf
+        max_open_orders = 0
+        i = 0
+        fill_at = n  # кэш поиска исполнения для текущей минимальной цены продажи
+
+        while i < n:
+            # Следующая покупка
+            buy_at = n
+            if strategy.can_open(len(orders)):
+                start = max(i, int(np.searchsorted(t, cooldown_until, 'left')))
+                if last_buy_price is None:
+                    buy_at = start
+                else:
+                    threshold = strategy.threshold(last_buy_price) * (1 + THRESHOLD_EPSILON)
+                    # Дальше найденного исполнения не ищем: при равенстве индексов первым идет исполнение
+                    buy_at = first_index(low, start, fill_at, lambda v: v <= threshold)
+
+            if buy_at >= n and fill_at >= n:
+                break
+
+            if fill_at <= buy_at:
+                # Исполнение всех продаж, чья цена достигнута
+                index = fill_at
+                price = high[index]
+                filled = bisect.bisect_right(orders, (price, np.inf))
+                for sell_price, amount, buy_price, buy_fee in orders[:filled]:
+                    sell_fee = sell_price * amount * self.maker_fee
+                    profit = strategy.profit(buy_price, sell_price, amount, buy_fee, sell_fee)
+                    realized += profit
+                    records.append((self.user_id, profit, float(t[index]), self.symbol, buy_price, sell_price))
+                del orders[:filled]
+                last_buy_price = None
+                cooldown_until = t[index] + strategy.cooldown
+                i = index + rebuy_offset
+                fill_at = self._next_fill(orders, i, n)
+            else:
+                index = buy_at
+                if last_buy_price is None:
+                    price = open_[index]
+                else:
+                    price = min(open_[index], strategy.threshold(last_buy_price))
+                amount = strategy.buy_amount(price)
+                buy_fee = price * amount * self.taker_fee
+                sell_price = strategy.sell_price(price)
+                bisect.insort(orders, (sell_price, amount, price, buy_fee))
+                max_open_orders = max(max_open_orders, len(orders))
+                last_buy_price = price
+                i = index + 1
+                if orders[0][0] == sell_price:
+                    # Новая минимальная цена продажи может сработать раньше найденного исполнения
+                    fill_at = self._next_fill(orders, i, fill_at)
+
+            equity_t.append(t[index])
+            equity.append(realized + sum((price - o[2]) * o[1] for o in orders))
+
+        last_price = data.close[-1] if n else 0.0
+        unrealized = sum((last_price - o[2]) * o[1] for o in orders)
+        if n:
+            equity_t.append(t[-1])
+            equity.append(realized + unrealized)
+        return BacktestResult(records, orders, unrealized, equity_t, equity, n,
+                              time.perf_counter() - started, max_open_orders)
+
+    def _next_fill(self, orders, start, end):
+        """Первое исполнение минимальной продажи в [start, end); end, если его нет"""
+        if not orders:
+            return end
+        target = orders[0][0]
+        return first_index(self.data.high, start, end, lambda v: v >= target)
+
+
+def write_records(path, records):
+    """Сделки в CSV с колонками таблицы profits"""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user_id', 'profit', 'timestamp', 'symbol', 'buy_price', 'sell_price'])
+        writer.writerows(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест DCA-стратегии на исторических тиках или свечах")
+    parser.add_argument('data', help="CSV/Parquet (тики или OHLCV) или JSONL из PRICE_STREAM_RECORD")
+    parser.add_argument('--symbol', default='BTC/USDT')
+    parser.add_argument('--fall', type=float, default=1.0, help="fall_percent")
+    parser.add_argument('--rise', type=float, default=1.5, help="rise_percent")
+    parser.add_argument('--amount', type=float, default=10.0, help="Сумма покупки, USDT")
+    parser.add_argument('--orders-limit', type=int, default=0)
+    parser.add_argument('--cooldown', type=float, default=60, help="Пауза после продажи, сек")
+    parser.add_argument('--taker-fee', type=float, default=0.0005, help="Комиссия рыночной покупки (доля)")
+    parser.add_argument('--maker-fee', type=float, default=0.0, help="Комиссия лимитной продажи (доля)")
+    parser.add_argument('--out', help="CSV для записей о сделках")
+    args = parser.parse_args()
+
+    data = load_market_data(args.data, args.symbol)
+    strategy = DcaStrategy(args.fall, args.rise, args.amount, args.orders_limit, args.cooldown)
+    result = Backtest(data, strategy, args.symbol, args.taker_fee, args.maker_fee).run()
+    print(result.summary())
+    if args.out:
+        write_records(args.out, result.records)
+
+
+if __name__ == "__main__":
+    main()
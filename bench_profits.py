@@ -0,0 +1,123 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from profit_ledger import (INSERT_PROFIT, MIGRATIONS, REPORT_QUERIES, audit_query_plans, explain_reports,
+                           migrate_profit_db)
+
+SYMBOLS = ['BTC/USDT', 'ETH/USDT', 'SOL/USDT', 'XRP/USDT', 'DOGE/USDT', 'TON/USDT']
+
+
+def generate_ledger(path, rows, users, days, chunk=100000):
+    """Синтетический журнал сделок: равномерно по пользователям и времени за последние days дней"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    rng = random.Random(42)
+    now = time.time()
+    start = now - days * 86400
+    written = 0
+    while written < rows:
+        size = min(chunk, rows - written)
+        batch = []
+        for _ in range(size):
+            buy_price = rng.uniform(0.1, 100)
+            sell_price = buy_price * 1.01
+            batch.append((rng.randrange(users), rng.uniform(0.01, 0.5), rng.uniform(start, now),
+                          rng.choice(SYMBOLS), buy_price, sell_price))
+        with conn:
+            conn.executemany(INSERT_PROFIT, batch)
+        written += size
+        print(f"\rСгенерировано {written}/{rows}", end='', flush=True)
+    print()
+    conn.close()
+
+
+def report_params(users):
+    """Параметры запросов для случайного пользователя (текущий месяц)"""
+    user_id = random.randrange(users)
+    return {
+        'get_profit': (user_id, time.strftime('%Y-%m')),
+        'user_totals': (user_id,),
+        'user_months': (user_id,),
+        'recent_trades': (user_id, 3),
+    }
+
+
+def time_reports(path, users, runs):
+    """Медиана и 95-й перцентиль времени каждого запроса отчетов, мс"""
+    conn = sqlite3.connect(path)
+    results = {}
+    for name, (sql, _) in REPORT_QUERIES.items():
+        samples = []
+        for _ in range(runs):
+            params = report_params(users)[name]
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        results[name] = (statistics.median(samples), samples[int(len(samples) * 0.95) - 1])
+    conn.close()
+    return results
+
+
+def print_plans(path):
+    conn = sqlite3.connect(path)
+    for name, plan in explain_reports(conn).items():
+        print(f"  {name}:")
+        for step in plan:
+            print(f"    {step}")
+    problems = audit_query_plans(conn)
+    conn.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов отчетов profits.db до и после миграции индексов")
+    parser.add_argument('--rows', type=int, default=10_000_000, help="Количество синтетических сделок")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--runs', type=int, default=200, help="Запусков каждого запроса")
+    parser.add_argument('--db', help="Файл базы (по умолчанию временный)")
+    parser.add_argument('--audit', metavar='PATH', help="Только проверить планы запросов существующей базы")
+    args = parser.parse_args()
+
+    if args.audit:
+        problems = print_plans(args.audit)
+        for problem in problems:
+            print(f"ПРОБЛЕМА {problem}")
+        raise SystemExit(1 if problems else 0)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'profits_bench.db')
+    migrate_profit_db(path, target=1)
+    generate_ledger(path, args.rows, args.users, args.days)
+
+    # Схема до миграции индексов: одноколоночные индексы и свертки
+    start = time.time()
+    migrate_profit_db(path, target=len(MIGRATIONS) - 1)
+    print(f"Свертки построены за {time.time() - start:.1f} сек")
+    print("Планы до миграции индексов:")
+    print_plans(path)
+    before = time_reports(path, args.users, args.runs)
+
+    start = time.time()
+    migrate_profit_db(path)
+    print(f"Миграция индексов за {time.time() - start:.1f} сек")
+    print("Планы после миграции:")
+    problems = print_plans(path)
+    after = time_reports(path, args.users, args.runs)
+
+    print(f"\n{'Запрос':<18}{'до, мс (p50/p95)':>22}{'после, мс (p50/p95)':>24}")
+    for name in REPORT_QUERIES:
+        b, a = before[name], after[name]
+        print(f"{name:<18}{b[0]:>11.3f}/{b[1]:<10.3f}{a[0]:>13.3f}/{a[1]:<10.3f}")
+    for problem in problems:
+        print(f"ПРОБЛЕМА {problem}")
+
+
+if __name__ == "__main__":
+    main()
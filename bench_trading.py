@@ -0,0 +1,350 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import psutil
+
+from mock_mexc import MockMexc, PricePath
+
+# Сценарий цены каждого символа (доли базовой цены): две нейтральные фазы, падение, рост.
+# При fall = rise = 1%: покупка на падении, на росте исполняются обе продажи,
+# повторная покупка после паузы cooldown приходится на нейтральную фазу
+CYCLE = (1.0, 1.0, 0.985, 1.016)
+DROP_PHASE = 2
+FALL_PERCENT = 1.0
+RISE_PERCENT = 1.0
+ORDER_FILLED_RE = re.compile(r"Ордер (\S+) исполнен")
+# Потоки фиктивных бэкендов, не относящиеся к боту
+BACKEND_THREADS = ('mock_mexc', 'fake_telegram', 'process_request_thread', 'bench_')
+
+
+class FakeTelegram:
+    """HTTP-сервер вместо api.telegram.org: отвечает на любой метод Bot API и запоминает сообщения"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.messages = []  # (время получения, chat_id, текст)
+        self.requests = 0
+        self.message_ids = 0
+        self.listener = None  # listener(timestamp, chat_id, text)
+        self.server = None
+
+    @property
+    def api_url(self):
+        """Шаблон для telebot.apihelper.API_URL"""
+        return f"http://{self.host}:{self.port}/bot{{0}}/{{1}}"
+
+    def handle(self, method_name, params):
+        now = time.time()
+        with self.lock:
+            self.requests += 1
+            self.message_ids += 1
+            message_id = self.message_ids
+        if method_name == 'getUpdates':
+            return []
+        if method_name == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        if method_name in ('sendMessage', 'editMessageText'):
+            chat_id = params.get('chat_id')
+            text = params.get('text', '')
+            with self.lock:
+                self.messages.append((now, chat_id, text))
+            if self.listener:
+                self.listener(now, chat_id, text)
+            return {'message_id': message_id, 'date': int(now), 'text': text,
+                    'chat': {'id': int(chat_id) if chat_id and chat_id.lstrip('-').isdigit() else 0,
+                             'type': 'private'}}
+        return True
+
+    def serve_in_thread(self):
+        handler = type('FakeTelegramHandler', (_TelegramHandler,), {'telegram': self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name='fake_telegram', daemon=True).start()
+        return self.api_url
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class _TelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    telegram = None
+
+    def _dispatch(self):
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length)
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                params.update({key: str(value) for key, value in json.loads(body).items()})
+            else:
+                params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+        method_name = parsed.path.rsplit('/', 1)[-1]
+        data = json.dumps({'ok': True, 'result': self.telegram.handle(method_name, params)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_symbols(count):
+    """Символы бенчмарка и базовые цены"""
+    return {f"BENCH{i}/USDT": 10.0 * (i + 1) for i in range(count)}
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    array = np.asarray(values, dtype=np.float64) * 1000
+    return {'count': len(values),
+            'p50_ms': round(float(np.percentile(array, 50)), 3),
+            'p95_ms': round(float(np.percentile(array, 95)), 3),
+            'p99_ms': round(float(np.percentile(array, 99)), 3),
+            'max_ms': round(float(array.max()), 3)}
+
+
+class Recorder:
+    """События фиктивных бэкендов: шаги цены, ордера, исполнения и уведомления"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.step_time = None
+        self.step_phase = None
+        self.tick_to_order = []
+        self.buys_by_phase = [0] * len(CYCLE)
+        self.fill_times = {}  # order_id -> время исполнения лимитной продажи
+        self.fill_to_notification = []
+        self.unmatched_notifications = 0
+
+    def on_exchange(self, event, data):
+        now = time.time()
+        with self.lock:
+            if event == 'step':
+                self.step_time = now
+                self.step_phase = data % len(CYCLE)
+            elif event == 'order' and data['type'] == 'MARKET' and data['side'] == 'BUY':
+                if self.step_phase is None:
+                    return  # первая покупка до начала сценария
+                self.buys_by_phase[self.step_phase] += 1
+                if self.step_phase == DROP_PHASE:
+                    self.tick_to_order.append(now - self.step_time)
+            elif event == 'fill' and data['side'] == 'SELL' and data['type'] == 'LIMIT':
+                self.fill_times[data['orderId']] = now
+
+    def on_telegram(self, timestamp, chat_id, text):
+        # Очередь отправки склеивает сообщения одному чату - в тексте может быть несколько исполнений
+        order_ids = ORDER_FILLED_RE.findall(text)
+        with self.lock:
+            for order_id in order_ids:
+                filled_at = self.fill_times.pop(order_id, None)
+                if filled_at is None:
+                    self.unmatched_notifications += 1
+                else:
+                    self.fill_to_notification.append(timestamp - filled_at)
+
+
+class ResourceSampler(threading.Thread):
+    """Раз в interval секунд снимает RSS, загрузку CPU и число потоков процесса"""
+
+    def __init__(self, interval=1.0):
+        super().__init__(name='bench_sampler', daemon=True)
+        self.interval = interval
+        self.process = psutil.Process(os.getpid())
+        self.samples = []  # (время, RSS МБ, CPU %, потоков всего, потоков бота)
+        self._stopped = threading.Event()
+
+    def run(self):
+        self.process.cpu_percent(None)
+        while not self._stopped.wait(self.interval):
+            threads = threading.enumerate()
+            bot_threads = sum(1 for thread in threads if not thread.name.startswith(BACKEND_THREADS)
+                              and not thread.name.endswith('(process_request_thread)'))
+            self.samples.append((time.time(), self.process.memory_info().rss / 1024 / 1024,
+                                 self.process.cpu_percent(None), self.process.num_threads(), bot_threads))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        data = np.asarray([sample[1:] for sample in self.samples])
+        cpu_times = self.process.cpu_times()
+        return {'rss_mb': {'avg': round(float(data[:, 0].mean()), 1), 'max': round(float(data[:, 0].max()), 1)},
+                'cpu_percent': {'avg': round(float(data[:, 1].mean()), 1), 'max': round(float(data[:, 1].max()), 1)},
+                'cpu_seconds': round(cpu_times.user + cpu_times.system, 2),
+                'threads': {'avg': round(float(data[:, 2].mean()), 1), 'max': int(data[:, 2].max())},
+                'bot_threads': {'avg': round(float(data[:, 3].mean()), 1), 'max': int(data[:, 3].max())}}
+
+
+def run_benchmark(users, symbols, duration, step, price_interval=None, latency=0.0, rate_limit=None,
+                  amount=10.0, workdir=None, notify_mode='instant', notify_interval=60):
+    """Бот с фиктивными биржей и Telegram; возвращает словарь результатов"""
+    symbol_prices = bench_symbols(symbols)
+    paths = {symbol: PricePath([base * k for k in CYCLE], loop=True) for symbol, base in symbol_prices.items()}
+    recorder = Recorder()
+    mock = MockMexc(paths, step_interval=None, initial_balance=amount * 1000, latency=latency,
+                    rate_limit=rate_limit)
+    mock.listener = recorder.on_exchange
+    telegram = FakeTelegram()
+    telegram.listener = recorder.on_telegram
+
+    # Бот читает адреса бэкендов и пишет свои файлы (настройки, profits.db) при импорте - в рабочем каталоге
+    os.environ['MEXC_API_URL'] = mock.serve_in_thread()
+    os.environ.setdefault('BOT_TOKEN', '0:bench')
+    os.chdir(workdir or tempfile.mkdtemp(prefix='bench-trading-'))
+    import telebot.apihelper
+    telebot.apihelper.API_URL = telegram.serve_in_thread()
+    import ScalperBot as bot_module
+    if price_interval is not None:
+        bot_module.PRICE_UPDATE_INTERVAL = price_interval
+
+    bot_module.init_profit_db()
+    bot_module.profit_ledger.start()
+    bot_module.telegram_queue.start()
+    bot_module.trade_notifier.start()
+    bot_module.load_settings()
+    threading.Thread(target=bot_module.price_updater, name='price_updater', daemon=True).start()
+    bot_module.trading_engine.start()
+
+    sampler = ResourceSampler()
+    sampler.start()
+    started = time.time()
+    symbol_list = list(symbol_prices)
+    for user_id in range(1, users + 1):
+        user_settings = bot_module.get_user_settings(user_id)
+        user_settings.update(api_key=f"bench-key-{user_id}", api_secret='secret',
+                             symbol=symbol_list[user_id % symbols], fall_percent=FALL_PERCENT,
+                             rise_percent=RISE_PERCENT, cooldown=step * 1.5, amount=amount, enabled=True,
+                             notify_mode=notify_mode, notify_interval=notify_interval)
+        bot_module.update_user_settings(user_id, user_settings)
+        bot_module.trading_engine.start_user(user_id)
+    startup = time.time() - started
+
+    # Сценарий цены начинается после запуска всех пользователей: первые покупки идут по нейтральной цене
+    requests_before = mock.stats['requests']
+    endpoints_before = dict(mock.endpoint_stats)
+    messages_before = telegram.requests
+    stopped = threading.Event()
+
+    def clock():
+        while not stopped.wait(step):
+            mock.step()
+
+    threading.Thread(target=clock, name='bench_clock', daemon=True).start()
+    measured_from = time.time()
+    time.sleep(duration)
+    stopped.set()
+    elapsed = time.time() - measured_from
+    sampler.stop()
+    bot_module.profit_ledger.flush()
+    bot_module.telegram_queue.flush(10)
+
+    requests = mock.stats['requests'] - requests_before
+    endpoints = {endpoint: count - endpoints_before.get(endpoint, 0)
+                 for endpoint, count in mock.endpoint_stats.items()
+                 if count > endpoints_before.get(endpoint, 0)}
+    ledger = bot_module.profit_ledger
+    price_stats = bot_module.price_update_stats
+    minutes = elapsed / 60
+    result = {
+        'config': {'users': users, 'symbols': symbols, 'duration': duration, 'step': step,
+                   'price_interval': bot_module.PRICE_UPDATE_INTERVAL, 'latency': latency,
+                   'rate_limit': rate_limit, 'trading_workers': bot_module.TRADING_WORKERS,
+                   'notify_mode': notify_mode},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'timestamp': int(started)},
+        'startup_seconds': round(startup, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'running_bots': len(bot_module.trading_engine.bots),
+        'tick_to_order': percentiles(recorder.tick_to_order),
+        'fill_to_notification': percentiles(recorder.fill_to_notification),
+        'unmatched_notifications': recorder.unmatched_notifications,
+        'buys_by_phase': recorder.buys_by_phase,
+        'api_calls': {'total': requests,
+                      'per_user_per_minute': round(requests / users / minutes, 3) if minutes else 0,
+                      'by_endpoint': dict(sorted(endpoints.items(), key=lambda item: -item[1])),
+                      'rate_limited': mock.stats['rate_limited']},
+        'orders': mock.stats['orders'],
+        'fills': mock.stats['fills'],
+        'telegram_requests': telegram.requests - messages_before,
+        'request_scheduler': bot_module.request_scheduler.summary(),
+        'telegram_queue': dict(bot_module.telegram_queue.stats, depth=bot_module.telegram_queue.depth),
+        'price_updater': {'cycles': price_stats['cycles'],
+                          'avg_ms': round(price_stats['avg_duration'] * 1000, 3),
+                          'max_ms': round(price_stats['max_duration'] * 1000, 3),
+                          'errors': price_stats['errors']},
+        'profit_ledger': {'rows': ledger.rows, 'commits': ledger.commits, 'errors': ledger.errors,
+                          'dropped': ledger.dropped,
+                          'avg_commit_ms': round(ledger.avg_latency * 1000, 3),
+                          'max_commit_ms': round(ledger.max_latency * 1000, 3)},
+    }
+    result.update(sampler.summary())
+    telegram.close()
+    mock.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк торгового цикла с фиктивными MEXC и Telegram")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--symbols', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=300, help="Секунд измерения после запуска пользователей")
+    parser.add_argument('--step', type=float, default=15.0,
+                        help="Секунд на фазу сценария цены (больше интервала опроса цен)")
+    parser.add_argument('--price-interval', type=float,
+                        help="PRICE_UPDATE_INTERVAL бота (по умолчанию как в ScalperBot.py)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Задержка ответа биржи, сек")
+    parser.add_argument('--rate-limit', type=float, help="Лимит биржи, запросов в секунду на ключ")
+    parser.add_argument('--notify-mode', default='instant', choices=('instant', 'batch', 'digest'),
+                        help="Режим уведомлений о сделках у всех пользователей")
+    parser.add_argument('--notify-interval', type=int, default=60, help="Секунд между сообщениями в режиме batch")
+    parser.add_argument('--workdir', help="Каталог для файлов бота (по умолчанию временный)")
+    parser.add_argument('--out', default='bench_trading.json', help="JSON с результатами")
+    parser.add_argument('--verbose', action='store_true', help="Не приглушать журнал бота")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger('TRADING_BOT').setLevel(logging.WARNING)
+    out = os.path.abspath(args.out)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    result = run_benchmark(args.users, args.symbols, args.duration, args.step, args.price_interval,
+                           args.latency, args.rate_limit, workdir=args.workdir, notify_mode=args.notify_mode,
+                           notify_interval=args.notify_interval)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps({key: result[key] for key in ('tick_to_order', 'fill_to_notification', 'api_calls')},
+                     ensure_ascii=False, indent=2)[:4000])
+    print(f"Результаты: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from subscriber_index import buy_threshold
+
+
+class DcaStrategy:
+    """Решения DCA-стратегии без обращения к бирже: общие для торгового движка и бэктеста"""
+
+    def __init__(self, fall_percent, rise_percent, amount, orders_limit=0, cooldown=0):
+        self.fall_percent = float(fall_percent)
+        self.rise_percent = float(rise_percent)
+        self.amount = float(amount)
+        self.orders_limit = int(orders_limit)
+        self.cooldown = float(cooldown)
+
+    @classmethod
+    def from_settings(cls, user_settings):
+        return cls(user_settings['fall_percent'], user_settings['rise_percent'], user_settings['amount'],
+                   user_settings['orders_limit'], user_settings['cooldown'])
+
+    def can_open(self, open_orders):
+        """Можно ли выставить еще один ордер (0 - без ограничения)"""
+        return self.orders_limit == 0 or open_orders <= self.orders_limit
+
+    def should_buy(self, price, last_buy_price):
+        """Первая покупка - сразу, следующие - после падения на fall_percent от последней"""
+        if last_buy_price is None or last_buy_price <= 0:
+            return True
+        return (last_buy_price - price) / last_buy_price * 100 >= self.fall_percent
+
+    def threshold(self, last_buy_price):
+        """Цена, при которой сработает следующая покупка"""
+        return buy_threshold(last_buy_price, self.fall_percent)
+
+    def buy_amount(self, price):
+        """Количество базовой валюты на сумму amount USDT"""
+        return self.amount / price
+
+    def sell_price(self, buy_price):
+        return buy_price * (1 + self.rise_percent / 100)
+
+    @staticmethod
+    def profit(buy_price, sell_price, amount, buy_fee=0.0, sell_fee=0.0):
+        """Прибыль сделки в USDT с учетом комиссий, как в журнале profits"""
+        return round((sell_price - buy_price) * amount - buy_fee - sell_fee, 6)
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import websockets
+
+logger = logging.getLogger('FAKE_MEXC_WS')
+
+
+def load_ticks(path):
+    """Тики в формате JSONL: {"s": "BTCUSDT", "p": "20382.70", "v": "0.0438", "t": 1678593222456}"""
+    ticks = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                ticks.append(json.loads(line))
+    return ticks
+
+
+def deal_message(tick):
+    """Сообщение ленты сделок в JSON-формате MEXC spot v3"""
+    timestamp = tick.get('t') or int(time.time() * 1000)
+    return {
+        'c': f"spot@public.deals.v3.api@{tick['s']}",
+        'd': {
+            'deals': [{
+                'p': str(tick['p']),
+                'v': str(tick.get('v') or '0'),
+                'S': tick.get('S', 1),
+                't': timestamp
+            }],
+            'e': 'spot@public.deals.v3.api'
+        },
+        's': tick['s'],
+        't': timestamp
+    }
+
+
+def order_message(symbol_id, order_id, price, quantity, status=2, side=2):
+    """Событие приватного потока ордеров (статус 2 - исполнен, 4 - отменен; сторона 2 - продажа)"""
+    timestamp = int(time.time() * 1000)
+    filled = quantity if status == 2 else 0
+    return {
+        'c': 'spot@private.orders.v3.api',
+        'd': {
+            'id': str(order_id),
+            'price': str(price),
+            'quantity': str(quantity),
+            'avgPrice': str(price),
+            'cumulativeQuantity': str(filled),
+            'remainQuantity': str(quantity - filled),
+            'status': status,
+            'tradeType': side,
+            'orderType': 1,
+            'createTime': timestamp
+        },
+        's': symbol_id,
+        't': timestamp
+    }
+
+
+class FakeMexcWs:
+    """Локальный WebSocket-сервер, воспроизводящий записанные тики и события ордеров MEXC"""
+
+    def __init__(self, ticks, host='127.0.0.1', port=0, speed=1.0, loop_ticks=False):
+        self.ticks = ticks
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.loop_ticks = loop_ticks
+        self.server = None
+        self.loop = None
+        self.sent = 0
+        self.connections = 0
+        self.private = {}  # listenKey -> множество соединений приватного потока
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/ws"
+
+    async def handler(self, ws):
+        self.connections += 1
+        subscribed = set()
+        replay = None
+        query = parse_qs(urlparse(ws.request.path).query)
+        listen_key = query.get('listenKey', [None])[0]
+        if listen_key:
+            self.private.setdefault(listen_key, set()).add(ws)
+        try:
+            async for raw in ws:
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    continue
+                method = str(message.get('method', '')).upper()
+                if method == 'PING':
+                    await ws.send(json.dumps({'id': 0, 'code': 0, 'msg': 'PONG'}))
+                elif method in ('SUBSCRIPTION', 'UNSUBSCRIPTION'):
+                    for channel in message.get('params', []):
+                        symbol = channel.split('@')[-1]
+                        if method == 'SUBSCRIPTION':
+                            subscribed.add(symbol)
+                        else:
+                            subscribed.discard(symbol)
+                        await ws.send(json.dumps({'id': message.get('id', 0), 'code': 0, 'msg': channel}))
+                    # Воспроизведение начинается с первой подписки
+                    if replay is None and not listen_key:
+                        replay = asyncio.ensure_future(self._replay(ws, subscribed))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if replay is not None:
+                replay.cancel()
+            if listen_key:
+                self.private.get(listen_key, set()).discard(ws)
+
+    async def _replay(self, ws, subscribed):
+        while True:
+            previous = None
+            for tick in self.ticks:
+                if previous is not None and tick.get('t') and previous.get('t'):
+                    delay = (tick['t'] - previous['t']) / 1000 / self.speed
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                previous = tick
+                if tick['s'] not in subscribed:
+                    continue
+                await ws.send(json.dumps(deal_message(tick)))
+                self.sent += 1
+            if not self.loop_ticks:
+                return
+
+    async def start(self):
+        self.server = await websockets.serve(self.handler, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def serve_in_thread(self):
+        """Запуск сервера в фоновом потоке, возвращает URL для PriceStream"""
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, name='fake_mexc_ws', daemon=True).start()
+        ready.wait(10)
+        return self.url
+
+    def push_order(self, listen_key, message):
+        """Отправка события ордера в приватный поток (из любого потока)"""
+        async def send():
+            for ws in list(self.private.get(listen_key, ())):
+                await ws.send(json.dumps(message))
+        asyncio.run_coroutine_threadsafe(send(), self.loop).result(5)
+
+    def drop_connections(self):
+        """Обрыв всех соединений для проверки переподключения"""
+        async def drop():
+            for connections in list(self.private.values()):
+                for ws in list(connections):
+                    await ws.close()
+        asyncio.run_coroutine_threadsafe(drop(), self.loop).result(5)
+
+    def close(self):
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Фейковый WebSocket MEXC для воспроизведения тиков")
+    parser.add_argument('ticks', help="JSONL-файл с тиками (см. PRICE_STREAM_RECORD)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--speed', type=float, default=1.0, help="Множитель скорости воспроизведения")
+    parser.add_argument('--loop', action='store_true', help="Повторять тики по кругу")
+    args = parser.parse_args()
+
+    server = await FakeMexcWs(load_ticks(args.ticks), args.host, args.port, args.speed, args.loop).start()
+    print(f"Фейковый MEXC WebSocket: {server.url}")
+    await asyncio.Future()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
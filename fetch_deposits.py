@@ -1,148 +1,485 @@
+import argparse
 import asyncio
 import aiohttp
+import concurrent.futures
+import logging
 import os
+import sqlite3
 import sys
+import threading
 from datetime import datetime
 import time
 import dotenv
 from dotenv import load_dotenv
 
+from rate_limiter import TokenBucket
+
 load_dotenv()
 
+logger = logging.getLogger('TRADING_BOT')
+
+ETHERSCAN_URL = "https://api.etherscan.io/v2/api"
+BSC_CHAIN_ID = 56
+POLL_INTERVAL = 60  # секунд между запросами по одному кошельку
+ETHERSCAN_RATE = 4  # запросов в секунду на весь цикл (бесплатный тариф - 5)
+AMOUNT_TOLERANCE = 1e-6  # допуск сравнения суммы перевода, USDT
+CLOCK_SLACK = 300  # перевод может быть чуть раньше резерва (расхождение часов), секунд
+DEPOSITS_DB = 'deposits.db'
+COINGECKO_URL = "https://api.coingecko.com/api/v3/simple/price"
+COINGECKO_IDS = {
+    'CAKE': 'pancakeswap-token',
+    'BNB': 'binancecoin',
+    'ETH': 'ethereum',
+}
+RATE_TTL = 300  # время жизни курса, секунд
+RATE_NEGATIVE_TTL = 3600  # столько помним, что CoinGecko не знает символ
+
+DEPOSIT_SCHEMA = (
+    # Курсор по кошельку и типу запроса: следующий опрос начинается с last_block
+    '''CREATE TABLE IF NOT EXISTS deposit_cursors
+       (address TEXT, action TEXT, last_block INTEGER, last_hash TEXT, updated_at REAL,
+        PRIMARY KEY (address, action))''',
+    # Индекс уже увиденных входящих переводов; amount - в токенах, value_usdt NULL - курса пока нет,
+    # matched_at - перевод засчитан в оплату
+    '''CREATE TABLE IF NOT EXISTS deposit_transfers
+       (hash TEXT, address TEXT, token TEXT, sender TEXT, value_usdt REAL, timestamp INTEGER,
+        block INTEGER, matched_at REAL, amount REAL, PRIMARY KEY (hash, address, token))''',
+    '''CREATE INDEX IF NOT EXISTS idx_deposit_transfers_open
+       ON deposit_transfers (address, matched_at, timestamp)''',
+)
+
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
-async def get_usdt_rate():
-    # For simplicity, assuming 1 BNB = X USDT. Fetch BNB price in USD.
-    # CoinGecko API for BNB price in USD
-    url = "https://api.coingecko.com/api/v3/simple/price?ids=binancecoin&vs_currencies=usd"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            data = await resp.json()
-            # Assuming 1 USDT = 1 USD for conversion
-            return data['binancecoin']['usd'] if 'binancecoin' in data and 'usd' in data['binancecoin'] else 1.0
-
-
-async def get_token_usdt_rate(token_symbol):
-    # Fetch token price in USD from CoinGecko API
-    # Note: token_symbol needs to be converted to CoinGecko's ID if different
-    # For common tokens like CAKE, it might be 'pancakeswap-token'
-    # This is a simplified example and might need a mapping for various token symbols
-    coingecko_id_map = {
-        'CAKE': 'pancakeswap-token',
-        'BNB': 'binancecoin',
-        'ETH': 'ethereum',
-        # Add more mappings as needed
-    }
-    coingecko_id = coingecko_id_map.get(token_symbol.upper(), token_symbol.lower())  # Default to lower case symbol
-
-    url = f"https://api.coingecko.com/api/v3/simple/price?ids={coingecko_id}&vs_currencies=usd"
+def usdt_value(token, amount, rates):
+    """Сумма перевода в USDT; None - курса токена нет"""
+    if token.upper() == 'USDT':
+        return amount
+    rate = rates.get(token)
+    return None if rate is None else amount * rate
+
+
+def amount_key(value):
+    """Ключ суммы перевода с точностью AMOUNT_TOLERANCE"""
+    return round(value / AMOUNT_TOLERANCE)
+
+
+class RateCache:
+    """Курсы токенов к USD с CoinGecko с временем жизни.
+
+    Недостающие курсы запрашиваются одним запросом (ids=a,b,c) через сессию вызывающего,
+    одновременные запросы одного id ждут общий ответ. Неизвестные CoinGecko символы
+    запоминаются как None на negative_ttl, чтобы спам-токены не порождали запросов на каждом опросе"""
+
+    def __init__(self, ttl=RATE_TTL, negative_ttl=RATE_NEGATIVE_TTL, url=COINGECKO_URL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.url = url
+        self.rates = {}  # id CoinGecko -> (курс или None, время истечения)
+        self.in_flight = {}  # id -> asyncio.Future текущего запроса
+        self.stats = {'hits': 0, 'misses': 0, 'requests': 0, 'unknown': 0}
+
+    @staticmethod
+    def coingecko_id(symbol):
+        return COINGECKO_IDS.get(symbol.upper(), symbol.lower())
+
+    async def get_many(self, session, symbols):
+        """{символ: курс в USD или None, если CoinGecko его не знает}"""
+        ids = {symbol: self.coingecko_id(symbol) for symbol in symbols}
+        now = time.time()
+        missing, waiting = [], []
+        for coingecko_id in set(ids.values()):
+            cached = self.rates.get(coingecko_id)
+            if cached is not None and cached[1] > now:
+                self.stats['hits'] += 1
+            elif coingecko_id in self.in_flight:
+                waiting.append(self.in_flight[coingecko_id])
+            else:
+                missing.append(coingecko_id)
+        if missing:
+            self.stats['misses'] += len(missing)
+            future = asyncio.get_running_loop().create_future()
+            for coingecko_id in missing:
+                self.in_flight[coingecko_id] = future
+            try:
+                await self._fetch(session, missing)
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()  # ошибку получает этот вызов, ожидающие - через await
+                raise
+            finally:
+                for coingecko_id in missing:
+                    self.in_flight.pop(coingecko_id, None)
+        for future in waiting:
+            await asyncio.shield(future)
+        return {symbol: self.rates[coingecko_id][0] for symbol, coingecko_id in ids.items()}
+
+    async def _fetch(self, session, ids):
+        self.stats['requests'] += 1
+        params = {"ids": ",".join(sorted(ids)), "vs_currencies": "usd"}
+        async with session.get(self.url, params=params) as resp:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None)
+        now = time.time()
+        for coingecko_id in ids:
+            rate = (data.get(coingecko_id) or {}).get('usd')
+            if rate is None:
+                self.stats['unknown'] += 1
+                self.rates[coingecko_id] = (None, now + self.negative_ttl)
+            else:
+                self.rates[coingecko_id] = (float(rate), now + self.ttl)
+
+    async def get(self, session, symbol):
+        return (await self.get_many(session, [symbol]))[symbol]
+
+
+rate_cache = RateCache()
+
+
+async def get_usdt_rate(session=None):
+    """Курс BNB в USDT (1 USDT = 1 USD)"""
+    return await get_token_usdt_rate('BNB', session)
+
+
+async def get_token_usdt_rate(token_symbol, session=None):
+    """Курс токена в USDT; None - CoinGecko не знает токен"""
+    if session is not None:
+        return await rate_cache.get(session, token_symbol)
     async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            data = await resp.json()
-            return data[coingecko_id]['usd'] if coingecko_id in data and 'usd' in data[coingecko_id] else 1.0
-
-
-async def check_new_deposits(CHECK_AMOUNT, API_KEY, ADDRESS, bnb_usdt_rate, session):
-    BASE_URL = "https://api.etherscan.io/v2/api"
-    CHAIN_ID = 56
-    params_base = {
-        "chainid": CHAIN_ID,
-        "module": "account",
-        "address": ADDRESS,
-        "startblock": 0,
-        "endblock": 99999999,
-        "sort": "desc",
-        "apikey": API_KEY
-    }
-    now = datetime.utcnow().timestamp()
-    one_hour_ago = now - 3600
-    # Normal txs
-    normal_params = params_base.copy()
-    normal_params["action"] = "txlist"
-    async with session.get(BASE_URL, params=normal_params) as resp:
-        data = await resp.json()
-        if data.get("status") == "1":
-            normal_txs = data["result"]
-        else:
-            print("Error fetching normal txs:", data.get("message"))
-            return False
-    incoming_normal = [tx for tx in normal_txs if
-                       tx['to'].lower() == ADDRESS.lower() and int(tx['timeStamp']) >= one_hour_ago]
-    for tx in incoming_normal:
-        value_eth = int(tx['value']) / 10 ** 18  # Convert from wei to ETH
-        value_usdt = value_eth * bnb_usdt_rate
-        if abs(value_usdt - CHECK_AMOUNT) < 1e-6:
-            print(True)
-            return True
-    # Token txs
-    token_params = params_base.copy()
-    token_params["action"] = "tokentx"
-    async with session.get(BASE_URL, params=token_params) as resp:
-        data = await resp.json()
+        return await rate_cache.get(session, token_symbol)
+
+
+class DepositWatcher:
+    """Единый фоновый сервис проверки оплат: один цикл asyncio и одна HTTP-сессия на весь бот.
+
+    Каждый кошелек с ожидающими оплатами опрашивается раз в poll_interval секунд (txlist + tokentx),
+    сколько бы пользователей его ни ждали. Запрос идет только с блока из сохраненного курсора, увиденные
+    переводы лежат в deposits.db, поэтому опрос обходится O(новых переводов) и продолжается после перезапуска.
+    Входящие переводы находят ожидание по ключу суммы и проверяются по времени, результат приходит через
+    concurrent.futures.Future: перевод или None по истечении срока"""
+
+    def __init__(self, api_key=None, poll_interval=POLL_INTERVAL, url=ETHERSCAN_URL, chain_id=BSC_CHAIN_ID,
+                 db_path=DEPOSITS_DB, rate=ETHERSCAN_RATE):
+        self.api_key = api_key or os.getenv('API_ETHER_SCAN')
+        self.poll_interval = poll_interval
+        self.url = url
+        self.chain_id = chain_id
+        self.db_path = db_path
+        self.db = None  # соединение открывается в потоке цикла
+        self.rates = RateCache()
+        self.bucket = TokenBucket(rate, rate)  # без накопления: всплеск не больше секундного лимита
+        self.throttle = None  # asyncio.Lock, создается в цикле
+        self.lock = threading.Lock()
+        self.pending = {}  # адрес в нижнем регистре -> список ожиданий
+        self.polled_at = {}  # адрес -> время последнего опроса
+        self.loop = None
+        self.thread = None
+        self.wake = None
+        self.stopping = False
+        self.stats = {'polls': 0, 'requests': 0, 'transfers': 0, 'matched': 0, 'expired': 0, 'errors': 0}
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name='deposit_watcher', daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.db = open_deposits_db(self.db_path)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.db.close()
+
+    def watch(self, address, amount, since, timeout=3600):
+        """Ожидание перевода amount USDT на address, сделанного не раньше since; безопасно из любого потока"""
+        future = concurrent.futures.Future()
+        if not self.api_key:
+            logger.error("Не задан API_ETHER_SCAN, проверка оплат недоступна")
+            future.set_result(None)
+            return future
+        waiter = {'address': address, 'amount': float(amount), 'since': since,
+                  'deadline': time.time() + timeout, 'future': future}
+        with self.lock:
+            self.pending.setdefault(address.lower(), []).append(waiter)
+        self._notify()
+        return future
+
+    def unwatch(self, address, amount, since):
+        """Отмена ожидания (резерв снят): future отменяется, перевод этой суммы достанется только новому ожиданию"""
+        key = amount_key(float(amount))
+        with self.lock:
+            waiters = self.pending.get(address.lower(), [])
+            removed = [w for w in waiters if amount_key(w['amount']) == key and w['since'] == since]
+            for waiter in removed:
+                waiters.remove(waiter)
+        for waiter in removed:
+            waiter['future'].cancel()
+        return len(removed)
+
+    @property
+    def waiting(self):
+        with self.lock:
+            return sum(len(waiters) for waiters in self.pending.values())
+
+    def _notify(self):
+        if self.loop is not None and self.wake is not None:
+            self.loop.call_soon_threadsafe(self.wake.set)
+
+    async def _main(self):
+        self.wake = asyncio.Event()
+        self.throttle = asyncio.Lock()
+        async with aiohttp.ClientSession() as session:
+            while not self.stopping:
+                delay = self.poll_interval
+                try:
+                    delay = await self.poll(session)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Ошибка проверки оплат: {e}")
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def poll(self, session):
+        """Опрос кошельков, чья очередь подошла; возвращает паузу до следующего опроса"""
+        now = time.time()
+        expired = []
+        with self.lock:
+            for address in list(self.pending):
+                alive = [w for w in self.pending[address] if w['deadline'] > now and not w['future'].done()]
+                expired += [w for w in self.pending[address] if w['deadline'] <= now]
+                if alive:
+                    self.pending[address] = alive
+                else:
+                    del self.pending[address]
+                    self.polled_at.pop(address, None)
+            due = [address for address in self.pending
+                   if now - self.polled_at.get(address, 0) >= self.poll_interval]
+        for waiter in expired:
+            self.stats['expired'] += 1
+            if not waiter['future'].done():
+                waiter['future'].set_result(None)
+
+        if due:
+            self.stats['polls'] += 1
+            await asyncio.gather(*(self._check_address(session, address) for address in due))
+
+        with self.lock:
+            if not self.pending:
+                return self.poll_interval
+            next_poll = min(self.polled_at.get(address, 0) for address in self.pending) + self.poll_interval
+        return max(1.0, next_poll - time.time())
+
+    async def _wait_turn(self):
+        """Темп запросов к Etherscan: опросы всех кошельков идут одновременно, но в очереди к общему лимиту"""
+        async with self.throttle:
+            while True:
+                delay = self.bucket.delay(1, 0.0, time.monotonic())
+                if delay <= 0:
+                    self.bucket.tokens -= 1
+                    return
+                await asyncio.sleep(delay)
+
+    async def _request(self, session, params):
+        await self._wait_turn()
+        self.stats['requests'] += 1
+        async with session.get(self.url, params=dict(params, chainid=self.chain_id, apikey=self.api_key)) as resp:
+            data = await resp.json(content_type=None)
         if data.get("status") == "1":
-            token_txs = data["result"]
-        else:
-            print("Error fetching token txs:", data.get("message"))
-            return False
-    incoming_tokens = [tx for tx in token_txs if
-                       tx['to'].lower() == ADDRESS.lower() and int(tx['timeStamp']) >= one_hour_ago]
-    print("\nIncoming BEP20 Token Transfers:")
-    for tx in incoming_tokens:
-        if tx['tokenSymbol'].upper() == 'USDT':
-            value_usdt = int(tx['value']) / (10 ** int(tx['tokenDecimal']))  # Use tokenDecimal for USDT
-            print(
-                f"From: {tx['from']}, Token: {tx['tokenName']}, Value: {value_usdt:.2f} USDT, Hash: {tx['hash']}, Time: {datetime.fromtimestamp(int(tx['timeStamp'])).strftime('%Y-%m-%d %H:%M:%S')}")
-            # Write transaction data to file
-
-            if abs(value_usdt - CHECK_AMOUNT) < 1e-6:
-                with open('usdt_deposits.txt', 'a', encoding='utf-8') as f:
-                    f.write(f"{tx['hash']};{tx['from']};{tx['to']};{value_usdt}\n")
-                print(True)
-                return True
-        else:
-            value_token = int(tx['value']) / (10 ** int(tx['tokenDecimal']))
-            token_usdt_rate = await get_token_usdt_rate(tx['tokenSymbol'])
-            value_usdt = value_token * token_usdt_rate
-            print(
-                f"From: {tx['from']}, Token: {tx['tokenName']}, Value: {value_token:.6f} {tx['tokenSymbol']} (~{value_usdt:.2f} USDT), Hash: {tx['hash']}, Time: {datetime.fromtimestamp(int(tx['timeStamp'])).strftime('%Y-%m-%d %H:%M:%S')}")
-            if abs(value_usdt - CHECK_AMOUNT) < 1e-6:
-                with open('usdt_deposits.txt', 'a', encoding='utf-8') as f:
-                    f.write(f"{tx['hash']};{tx['from']};{tx['to']};{value_usdt}\n")
-                print(True)
-                return True
-    return False
-
-
-async def main(check_amount, address):
-    API_KEY = os.getenv('API_ETHER_SCAN')
-    if not API_KEY:
-        print("Please set ETHERSCAN_API_KEY environment variable.")
-        return False
-    bnb_usdt_rate = await get_usdt_rate()
-    async with aiohttp.ClientSession() as session:
-        start_time = time.time()
-        while time.time() - start_time < 3600:
-            print(f"\nChecking at {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC")
-            found = await check_new_deposits(check_amount, API_KEY, address, bnb_usdt_rate, session)
-            if found:
-                print("Exiting script: matching transaction found.")
-                return True
-            await asyncio.sleep(60)
-        return False
-
-
-def sync_main(amount, wallet_address):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+            return data["result"]
+        if data.get("message") == "No transactions found":
+            return []
+        raise RuntimeError(f"{params.get('action')}: {data.get('message')} {data.get('result')}")
+
+    async def _block_at(self, session, timestamp):
+        """Первый блок не раньше timestamp - начальный курсор нового кошелька"""
+        result = await self._request(session, {"module": "block", "action": "getblocknobytime",
+                                               "timestamp": int(timestamp), "closest": "after"})
+        return int(result)
+
+    async def _fetch(self, session, action, address, start_block):
+        """Переводы с блока start_block включительно, по возрастанию"""
+        return await self._request(session, {"module": "account", "action": action, "address": address,
+                                             "startblock": start_block, "endblock": 99999999, "sort": "asc"})
+
+    def _cursor(self, address, action):
+        row = self.db.execute("SELECT last_block FROM deposit_cursors WHERE address = ? AND action = ?",
+                              (address, action)).fetchone()
+        return row[0] if row else None
+
+    async def _scan(self, session, action, address, oldest):
+        """Новые записи action с последнего курсора и новый курсор (последний увиденный блок, хэш).
+        Курсор не записывается: это делает _save вместе с переводами"""
+        start_block = self._cursor(address, action)
+        if start_block is None:
+            try:
+                start_block = await self._block_at(session, oldest)
+            except Exception as e:
+                logger.error(f"Не удалось определить блок по времени для {address}: {e}")
+                start_block = 0
+        txs = await self._fetch(session, action, address, start_block)
+        last_block, last_hash = start_block, None
+        if txs:
+            last_block, last_hash = int(txs[-1]['blockNumber']), txs[-1]['hash']
+        return txs, (action, last_block, last_hash)
+
+    def _save(self, address, cursors, transfers, repriced=()):
+        """Курсоры и новые переводы адреса одной транзакцией, без await внутри: опросы других адресов
+        не могут зафиксировать курсор этого адреса раньше его переводов"""
+        with self.db:
+            # Последний блок запрашивается повторно: дубликаты отсекает индекс переводов
+            self.db.executemany('''INSERT INTO deposit_cursors (address, action, last_block, last_hash, updated_at)
+                                   VALUES (?, ?, ?, ?, ?)
+                                   ON CONFLICT (address, action) DO UPDATE SET
+                                       last_block = excluded.last_block,
+                                       last_hash = COALESCE(excluded.last_hash, last_hash),
+                                       updated_at = excluded.updated_at''',
+                                [(address, action, last_block, last_hash, time.time())
+                                 for action, last_block, last_hash in cursors])
+            self._store(address, transfers)
+            self.db.executemany("UPDATE deposit_transfers SET value_usdt = ? "
+                                "WHERE hash = ? AND address = ? AND token = ?", repriced)
+
+    async def _check_address(self, session, address):
+        with self.lock:
+            waiters = list(self.pending.get(address, []))
+        if not waiters:
+            return
+        oldest = min(w['since'] for w in waiters) - CLOCK_SLACK
+        # Сначала все сетевые запросы, запись - только если все они удались
+        try:
+            normal_txs, normal_cursor = await self._scan(session, "txlist", address, oldest)
+            token_txs, token_cursor = await self._scan(session, "tokentx", address, oldest)
+            # oldest задает только начальный блок нового курсора: все, что после курсора, сохраняется,
+            # иначе перевод резерва, который еще не ждут (пользователь не нажал "Оплатил"), был бы пропущен
+            transfers = self._incoming(address, normal_txs, token_txs)
+            # Курсы новых переводов и сохраненных ранее без курса - одним запросом
+            unpriced = self.db.execute('''SELECT hash, token, amount FROM deposit_transfers
+                                          WHERE address = ? AND value_usdt IS NULL AND matched_at IS NULL
+                                          AND amount IS NOT NULL AND timestamp >= ?''',
+                                       (address.lower(), oldest)).fetchall()
+            symbols = {tx['token'] for tx in transfers} | {token for _, token, _ in unpriced}
+            symbols = {symbol for symbol in symbols if symbol.upper() != 'USDT'}
+            rates = await self.rates.get_many(session, symbols) if symbols else {}
+            for tx in transfers:
+                tx['value_usdt'] = usdt_value(tx['token'], tx['amount'], rates)
+            repriced = [(usdt_value(token, amount, rates), tx_hash, address.lower(), token)
+                        for tx_hash, token, amount in unpriced]
+            self._save(address, [normal_cursor, token_cursor], transfers,
+                       [row for row in repriced if row[0] is not None])
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Ошибка запроса переводов {address}: {e}")
+            return
+        finally:
+            self.polled_at[address] = time.time()
+
+        # Сопоставление с еще не засчитанными переводами из индекса
+        transfers = self.db.execute('''SELECT hash, token, sender, value_usdt, timestamp FROM deposit_transfers
+                                       WHERE address = ? AND matched_at IS NULL AND value_usdt IS NOT NULL
+                                       AND timestamp >= ?
+                                       ORDER BY timestamp''', (address.lower(), oldest)).fetchall()
+        # Суммы на кошельке уникальны (дробная метка), поэтому перевод находит ожидание по ключу суммы.
+        # Ожидания перечитываются: пока шли запросы, часть могла быть отменена unwatch
+        with self.lock:
+            waiters = [w for w in self.pending.get(address, []) if not w['future'].done()]
+        by_amount = {}
+        for waiter in sorted(waiters, key=lambda w: w['since']):
+            by_amount.setdefault(amount_key(waiter['amount']), []).append(waiter)
+        for tx_hash, token, sender, value_usdt, timestamp in transfers:
+            candidates = by_amount.get(amount_key(value_usdt))
+            for waiter in candidates or ():
+                if waiter['since'] - CLOCK_SLACK <= timestamp <= waiter['deadline']:
+                    candidates.remove(waiter)
+                    self._resolve(waiter, {'hash': tx_hash, 'from': sender, 'to': address, 'token': token,
+                                           'timestamp': timestamp, 'value_usdt': value_usdt})
+                    break
+
+    def _store(self, address, transfers):
+        """Новые переводы в индекс; повторно увиденные игнорируются"""
+        before = self.db.total_changes
+        self.db.executemany('''INSERT OR IGNORE INTO deposit_transfers
+                               (hash, address, token, sender, value_usdt, timestamp, block, amount)
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                            [(tx['hash'], address.lower(), tx['token'], tx['from'], tx['value_usdt'],
+                              tx['timestamp'], tx['block'], tx['amount']) for tx in transfers])
+        self.stats['transfers'] += self.db.total_changes - before
+
+    def _incoming(self, address, normal_txs, token_txs):
+        """Входящие переводы с суммой в токенах, по возрастанию времени"""
+        address = address.lower()
+        transfers = []
+        for tx in normal_txs:
+            if tx['to'].lower() != address or int(tx['value']) == 0:
+                continue
+            transfers.append({'hash': tx['hash'], 'from': tx['from'], 'to': tx['to'], 'token': 'BNB',
+                              'timestamp': int(tx['timeStamp']), 'block': int(tx['blockNumber']),
+                              'amount': int(tx['value']) / 10 ** 18})
+        for tx in token_txs:
+            if tx['to'].lower() != address:
+                continue
+            transfers.append({'hash': tx['hash'], 'from': tx['from'], 'to': tx['to'], 'token': tx['tokenSymbol'],
+                              'timestamp': int(tx['timeStamp']), 'block': int(tx['blockNumber']),
+                              'amount': int(tx['value']) / (10 ** int(tx['tokenDecimal']))})
+        transfers.sort(key=lambda tx: tx['timestamp'])
+        return transfers
+
+    def _resolve(self, waiter, tx):
+        # После этого отменить ожидание уже нельзя; отмененное перевод не забирает
+        if not waiter['future'].set_running_or_notify_cancel():
+            return
+        self.stats['matched'] += 1
+        with self.db:
+            self.db.execute("UPDATE deposit_transfers SET matched_at = ? WHERE hash = ? AND address = ? AND token = ?",
+                            (time.time(), tx['hash'], tx['to'].lower(), tx['token']))
+        with self.lock:
+            waiters = self.pending.get(waiter['address'].lower(), [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+        with open('usdt_deposits.txt', 'a', encoding='utf-8') as f:
+            f.write(f"{tx['hash']};{tx['from']};{tx['to']};{tx['value_usdt']}\n")
+        logger.info(f"Оплата {waiter['amount']} USDT на {waiter['address']} найдена: {tx['hash']}")
+        waiter['future'].set_result(tx)
+
+    def stop(self):
+        self.stopping = True
+        self._notify()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+
+def open_deposits_db(path=DEPOSITS_DB):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    with conn:
+        for statement in DEPOSIT_SCHEMA:
+            conn.execute(statement)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(deposit_transfers)")}
+        if 'amount' not in columns:
+            conn.execute("ALTER TABLE deposit_transfers ADD COLUMN amount REAL")
+    return conn
+
+
+def sync_main(amount, wallet_address, since=None, timeout=3600):
+    """Разовая проверка оплаты (переводы за последний час) отдельным DepositWatcher"""
+    watcher = DepositWatcher()
+    watcher.start()
     try:
-        return loop.run_until_complete(main(amount, wallet_address))
+        future = watcher.watch(wallet_address, amount, since or time.time() - 3600, timeout)
+        return future.result() is not None
     finally:
-        loop.close()
+        watcher.stop()
 
 
 if __name__ == "__main__":
-    if sys.platform == 'win32':
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Ожидание входящего перевода на кошелек")
+    parser.add_argument('amount', type=float, help="Сумма в USDT")
+    parser.add_argument('address')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(sync_main(args.amount, args.address))
@@ -0,0 +1,514 @@
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+logger = logging.getLogger('MOCK_MEXC')
+
+# Эндпоинты без API-ключа
+PUBLIC_PATHS = {'/api/v3/ping', '/api/v3/time', '/api/v3/exchangeInfo', '/api/v3/ticker/24hr',
+                '/api/v3/ticker/price', '/api/v1/contract/detail'}
+
+
+class PricePath:
+    """Сценарий цены символа: значения по шагам; после последнего шага цена остается на месте или идет по кругу"""
+
+    def __init__(self, prices, loop=False):
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.loop = loop
+
+    @classmethod
+    def constant(cls, price):
+        return cls([price])
+
+    @classmethod
+    def random_walk(cls, start, volatility=0.001, steps=100000, seed=0):
+        rng = np.random.default_rng(seed)
+        return cls(start * np.exp(np.cumsum(rng.normal(0, volatility, steps))))
+
+    @classmethod
+    def from_file(cls, path, symbol=None, loop=False):
+        """История из файла в форматах backtest.py (берутся цены закрытия)"""
+        from backtest import load_market_data
+        return cls(load_market_data(path, symbol).close, loop)
+
+    @classmethod
+    def parse(cls, spec, seed=0):
+        """Сценарий из строки: 100 | walk:100[:волатильность] | file:путь"""
+        kind, _, rest = spec.partition(':')
+        if kind == 'walk':
+            parts = rest.split(':')
+            return cls.random_walk(float(parts[0]), float(parts[1]) if len(parts) > 1 else 0.001, seed=seed)
+        if kind == 'file':
+            return cls.from_file(rest, loop=True)
+        return cls.constant(float(spec))
+
+    def price(self, step):
+        if self.loop:
+            return float(self.prices[step % len(self.prices)])
+        return float(self.prices[min(step, len(self.prices) - 1)])
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class MockMexc:
+    """Локальный HTTP-сервер с эндпоинтами MEXC spot v3, которые использует бот через ccxt.
+
+    Цены идут по сценариям PricePath: шаг сценария сменяется раз в step_interval секунд
+    (или вручную через step() при step_interval=None). Лимитные ордера исполняются, когда цена
+    достигает уровня ордера; рыночные - сразу по текущей цене с проскальзыванием."""
+
+    def __init__(self, paths, host='127.0.0.1', port=0, step_interval=1.0, initial_balance=1000.0,
+                 latency=0.0, jitter=0.0, rate_limit=None, burst=None, error_rate=0.0,
+                 fill_delay=0.0, fill_probability=1.0, slippage=0.0, taker_fee=0.0005, maker_fee=0.0, seed=0):
+        self.paths = paths  # symbol 'BTC/USDT' -> PricePath
+        self.host = host
+        self.port = port
+        self.step_interval = step_interval
+        self.initial_balance = initial_balance
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit  # запросов в секунду на ключ (или IP для публичных)
+        self.burst = burst or (rate_limit * 2 if rate_limit else None)
+        self.error_rate = error_rate
+        self.fill_delay = fill_delay
+        self.fill_probability = fill_probability
+        self.slippage = slippage
+        self.taker_fee = taker_fee
+        self.maker_fee = maker_fee
+
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.step_index = 0
+        self.ids = itertools.count(1)
+        self.orders = {}  # order_id -> order
+        self.open_sells = {}  # symbol_id -> куча (price, order_id)
+        self.open_buys = {}  # symbol_id -> куча (-price, order_id)
+        self.balances = {}  # api_key -> {asset: {'free', 'locked'}}
+        self.buckets = {}
+        self.listen_keys = {}
+        self.stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'orders': 0, 'fills': 0}
+        self.endpoint_stats = {}
+        self.listener = None  # listener(event, data) под блокировкой: 'step', 'order', 'fill' - для бенчмарков
+
+        self.symbols = {}  # 'BTCUSDT' -> ('BTC', 'USDT', 'BTC/USDT')
+        for symbol in paths:
+            base, quote = symbol.split('/')
+            self.symbols[base + quote] = (base, quote, symbol)
+
+        self.server = None
+        self._stopped = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    #########################################################################
+    # Время и исполнение ордеров
+    #########################################################################
+
+    def current_price(self, symbol_id):
+        return self.paths[self.symbols[symbol_id][2]].price(self.step_index)
+
+    def step(self, count=1):
+        """Переход сценариев цен на count шагов и проверка лимитных ордеров"""
+        with self.lock:
+            self.step_index += count
+            if self.listener:
+                self.listener('step', self.step_index)
+            self._match_all()
+
+    def _clock(self):
+        while not self._stopped.wait(self.step_interval):
+            self.step()
+
+    def _match_all(self):
+        now = time.time()
+        for symbol_id in self.symbols:
+            price = self.current_price(symbol_id)
+            self._match(self.open_sells.get(symbol_id), price, now, lambda level: level <= price)
+            self._match(self.open_buys.get(symbol_id), price, now, lambda level: -level >= price)
+
+    def _match(self, heap, price, now, reached):
+        if not heap:
+            return
+        postponed = []
+        while heap and reached(heap[0][0]):
+            level, order_id = heapq.heappop(heap)
+            order = self.orders.get(order_id)
+            if order is None or order['status'] != 'NEW':
+                continue
+            if now - order['time'] / 1000 < self.fill_delay or self.rng.random() > self.fill_probability:
+                postponed.append((level, order_id))
+                continue
+            self._fill(order, float(order['price']), self.maker_fee)
+        for item in postponed:
+            heapq.heappush(heap, item)
+
+    def _fill(self, order, price, fee_rate):
+        base, quote, _ = self.symbols[order['symbol']]
+        balances = self._balances(order['api_key'])
+        quantity = float(order['origQty'])
+        cost = quantity * price
+        fee = cost * fee_rate
+        if order['side'] == 'BUY':
+            if order['type'] == 'LIMIT':
+                balances[quote]['locked'] -= float(order['price']) * quantity
+            else:
+                balances[quote]['free'] -= cost
+            balances[quote]['free'] -= fee
+            balances[base]['free'] += quantity
+        else:
+            if order['type'] == 'LIMIT':
+                balances[base]['locked'] -= quantity
+            else:
+                balances[base]['free'] -= quantity
+            balances[quote]['free'] += cost - fee
+        order.update(status='FILLED', executedQty=f"{quantity:.8f}", cummulativeQuoteQty=f"{cost:.8f}",
+                     updateTime=int(time.time() * 1000))
+        self.stats['fills'] += 1
+        if self.listener:
+            self.listener('fill', order)
+
+    def _balances(self, api_key):
+        balances = self.balances.get(api_key)
+        if balances is None:
+            balances = self.balances[api_key] = {}
+        for base, quote, _ in self.symbols.values():
+            for asset in (base, quote):
+                if asset not in balances:
+                    free = self.initial_balance if asset == quote else 0.0
+                    balances[asset] = {'free': free, 'locked': 0.0}
+        return balances
+
+    #########################################################################
+    # Эндпоинты
+    #########################################################################
+
+    def handle(self, method, path, query, api_key, client):
+        """Возвращает (HTTP-статус, тело ответа)"""
+        endpoint = f"{method} {path}"
+        with self.lock:
+            self.stats['requests'] += 1
+            self.endpoint_stats[endpoint] = self.endpoint_stats.get(endpoint, 0) + 1
+
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.rate_limit:
+            with self.lock:
+                bucket_key = api_key or client
+                bucket = self.buckets.get(bucket_key)
+                if bucket is None:
+                    bucket = self.buckets[bucket_key] = TokenBucket(self.rate_limit, self.burst)
+                allowed = bucket.take()
+                if not allowed:
+                    self.stats['rate_limited'] += 1
+            if not allowed:
+                return 429, {'code': 429, 'msg': 'Too Many Requests'}
+        if self.error_rate and self.rng.random() < self.error_rate:
+            with self.lock:
+                self.stats['errors'] += 1
+            return 503, {'code': 503, 'msg': 'Service Unavailable'}
+
+        routes = {
+            ('GET', '/api/v3/ping'): lambda: {},
+            ('GET', '/api/v3/time'): lambda: {'serverTime': int(time.time() * 1000)},
+            ('GET', '/api/v3/exchangeInfo'): self.exchange_info,
+            ('GET', '/api/v1/contract/detail'): lambda: {'success': True, 'code': 0, 'data': []},
+            ('GET', '/api/v3/ticker/24hr'): lambda: self.ticker(query.get('symbol')),
+            ('GET', '/api/v3/ticker/price'): lambda: self.ticker(query.get('symbol')),
+            ('GET', '/api/v3/account'): lambda: self.account(api_key),
+            ('POST', '/api/v3/order'): lambda: self.create_order(api_key, query),
+            ('GET', '/api/v3/order'): lambda: self.get_order(api_key, query),
+            ('DELETE', '/api/v3/order'): lambda: self.cancel_order(api_key, query),
+            ('GET', '/api/v3/openOrders'): lambda: self.open_orders(api_key, query),
+            ('GET', '/api/v3/allOrders'): lambda: self.all_orders(api_key, query),
+            ('POST', '/api/v3/userDataStream'): lambda: self.listen_key(api_key),
+            ('PUT', '/api/v3/userDataStream'): lambda: {},
+            ('DELETE', '/api/v3/userDataStream'): lambda: {},
+        }
+        route = routes.get((method, path))
+        if route is None:
+            return 404, {'code': 404, 'msg': f'Not found: {path}'}
+        if path not in PUBLIC_PATHS and not api_key:
+            return 400, {'code': 700001, 'msg': 'API-key format invalid.'}
+        try:
+            with self.lock:
+                return 200, route()
+        except MockError as e:
+            return 400, {'code': e.code, 'msg': e.msg}
+
+    def exchange_info(self):
+        symbols = []
+        for symbol_id, (base, quote, _) in self.symbols.items():
+            symbols.append({
+                'symbol': symbol_id, 'status': '1', 'baseAsset': base, 'quoteAsset': quote,
+                'baseAssetPrecision': 6, 'quoteAssetPrecision': 6, 'quotePrecision': 6,
+                'baseCommissionPrecision': 6, 'quoteCommissionPrecision': 6,
+                'orderTypes': ['LIMIT', 'MARKET', 'LIMIT_MAKER'],
+                'isSpotTradingAllowed': True, 'isMarginTradingAllowed': False,
+                'quoteAmountPrecision': '1', 'baseSizePrecision': '0.000001',
+                'permissions': ['SPOT'], 'filters': [], 'maxQuoteAmount': '2000000',
+                'makerCommission': str(self.maker_fee), 'takerCommission': str(self.taker_fee),
+            })
+        return {'timezone': 'CST', 'serverTime': int(time.time() * 1000), 'rateLimits': [],
+                'exchangeFilters': [], 'symbols': symbols}
+
+    def _ticker(self, symbol_id):
+        price = f"{self.current_price(symbol_id):.8f}"
+        now = int(time.time() * 1000)
+        return {'symbol': symbol_id, 'priceChange': '0', 'priceChangePercent': '0', 'prevClosePrice': price,
+                'lastPrice': price, 'price': price, 'bidPrice': price, 'bidQty': '1', 'askPrice': price,
+                'askQty': '1', 'openPrice': price, 'highPrice': price, 'lowPrice': price, 'volume': '0',
+                'quoteVolume': '0', 'openTime': now - 86400000, 'closeTime': now, 'count': None}
+
+    def ticker(self, symbol_id):
+        if symbol_id is None:
+            return [self._ticker(symbol_id) for symbol_id in self.symbols]
+        if symbol_id not in self.symbols:
+            raise MockError(-1121, 'Invalid symbol.')
+        return self._ticker(symbol_id)
+
+    def account(self, api_key):
+        balances = [{'asset': asset, 'free': f"{b['free']:.8f}", 'locked': f"{b['locked']:.8f}"}
+                    for asset, b in self._balances(api_key).items()]
+        return {'makerCommission': 0, 'takerCommission': 0, 'canTrade': True, 'canWithdraw': True,
+                'canDeposit': True, 'updateTime': None, 'accountType': 'SPOT', 'balances': balances,
+                'permissions': ['SPOT']}
+
+    def create_order(self, api_key, query):
+        symbol_id = query.get('symbol')
+        if symbol_id not in self.symbols:
+            raise MockError(-1121, 'Invalid symbol.')
+        base, quote, _ = self.symbols[symbol_id]
+        side, order_type = query.get('side'), query.get('type')
+        price = self.current_price(symbol_id)
+        balances = self._balances(api_key)
+
+        if order_type == 'MARKET':
+            fill_price = price * (1 + self.slippage if side == 'BUY' else 1 - self.slippage)
+            if query.get('quoteOrderQty'):
+                quantity = float(query['quoteOrderQty']) / fill_price
+            else:
+                quantity = float(query['quantity'])
+            if side == 'BUY' and balances[quote]['free'] < quantity * fill_price * (1 + self.taker_fee):
+                raise MockError(30004, 'Insufficient position')
+            if side == 'SELL' and balances[base]['free'] < quantity:
+                raise MockError(30004, 'Insufficient position')
+            order = self._new_order(api_key, symbol_id, side, order_type, fill_price, quantity)
+            self._fill(order, fill_price, self.taker_fee)
+        elif order_type in ('LIMIT', 'LIMIT_MAKER'):
+            limit_price, quantity = float(query['price']), float(query['quantity'])
+            if side == 'BUY':
+                if balances[quote]['free'] < limit_price * quantity:
+                    raise MockError(30004, 'Insufficient position')
+                balances[quote]['free'] -= limit_price * quantity
+                balances[quote]['locked'] += limit_price * quantity
+            else:
+                if balances[base]['free'] < quantity * (1 - 1e-9):
+                    raise MockError(30004, 'Insufficient position')
+                quantity = min(quantity, balances[base]['free'])
+                balances[base]['free'] -= quantity
+                balances[base]['locked'] += quantity
+            order = self._new_order(api_key, symbol_id, side, 'LIMIT', limit_price, quantity)
+            if side == 'SELL':
+                heapq.heappush(self.open_sells.setdefault(symbol_id, []), (limit_price, order['orderId']))
+            else:
+                heapq.heappush(self.open_buys.setdefault(symbol_id, []), (-limit_price, order['orderId']))
+            self._match_all()
+        else:
+            raise MockError(1002, f'Unsupported order type {order_type}')
+
+        self.stats['orders'] += 1
+        return {'symbol': symbol_id, 'orderId': order['orderId'], 'orderListId': -1,
+                'price': order['price'], 'origQty': order['origQty'], 'type': order['type'],
+                'side': side, 'transactTime': order['time']}
+
+    def _new_order(self, api_key, symbol_id, side, order_type, price, quantity):
+        now = int(time.time() * 1000)
+        order = {
+            'symbol': symbol_id, 'orderId': f"C02__{next(self.ids)}", 'orderListId': -1, 'clientOrderId': '',
+            'price': f"{price:.8f}", 'origQty': f"{quantity:.8f}", 'executedQty': '0',
+            'cummulativeQuoteQty': '0', 'status': 'NEW', 'timeInForce': None, 'type': order_type,
+            'side': side, 'stopPrice': None, 'icebergQty': None, 'time': now, 'updateTime': now,
+            'isWorking': True, 'origQuoteOrderQty': None, 'api_key': api_key,
+        }
+        self.orders[order['orderId']] = order
+        if self.listener:
+            self.listener('order', order)
+        return order
+
+    def _public(self, order):
+        return {key: value for key, value in order.items() if key != 'api_key'}
+
+    def _own_order(self, api_key, query):
+        order = self.orders.get(query.get('orderId'))
+        if order is None or order['api_key'] != api_key:
+            raise MockError(-2013, 'Order does not exist.')
+        return order
+
+    def get_order(self, api_key, query):
+        return self._public(self._own_order(api_key, query))
+
+    def cancel_order(self, api_key, query):
+        order = self._own_order(api_key, query)
+        if order['status'] != 'NEW':
+            raise MockError(-2011, 'Order cancelled or filled.')
+        base, quote, _ = self.symbols[order['symbol']]
+        balances = self._balances(api_key)
+        quantity = float(order['origQty'])
+        if order['side'] == 'SELL':
+            balances[base]['locked'] -= quantity
+            balances[base]['free'] += quantity
+        else:
+            balances[quote]['locked'] -= quantity * float(order['price'])
+            balances[quote]['free'] += quantity * float(order['price'])
+        order.update(status='CANCELED', updateTime=int(time.time() * 1000))
+        return self._public(order)
+
+    def open_orders(self, api_key, query):
+        symbol_id = query.get('symbol')
+        return [self._public(o) for o in self.orders.values()
+                if o['api_key'] == api_key and o['status'] == 'NEW' and (symbol_id is None or o['symbol'] == symbol_id)]
+
+    def all_orders(self, api_key, query):
+        symbol_id = query.get('symbol')
+        since = int(query.get('startTime') or 0)
+        limit = int(query.get('limit') or 1000)
+        orders = [self._public(o) for o in self.orders.values()
+                  if o['api_key'] == api_key and o['symbol'] == symbol_id and o['updateTime'] >= since]
+        return orders[-limit:]
+
+    def listen_key(self, api_key):
+        key = f"mock-{abs(hash(api_key)) % 10 ** 12}"
+        self.listen_keys[key] = api_key
+        return {'listenKey': key}
+
+    #########################################################################
+    # Сервер
+    #########################################################################
+
+    def start(self):
+        handler = type('MockMexcHandler', (_Handler,), {'mock': self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        if self.step_interval:
+            threading.Thread(target=self._clock, name='mock_mexc_clock', daemon=True).start()
+        return self
+
+    def serve_in_thread(self):
+        """Запуск сервера в фоновом потоке, возвращает URL для MEXC_API_URL"""
+        self.start()
+        threading.Thread(target=self.server.serve_forever, name='mock_mexc', daemon=True).start()
+        return self.url
+
+    def close(self):
+        self._stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class MockError(Exception):
+    def __init__(self, code, msg):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive для общей HTTP-сессии бота
+    mock = None
+
+    def _dispatch(self, method):
+        parsed = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode()
+            query.update({key: values[-1] for key, values in parse_qs(body).items()})
+        api_key = self.headers.get('X-MEXC-APIKEY', '')
+        status, payload = self.mock.handle(method, parsed.path, query, api_key, self.client_address[0])
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный мок REST API MEXC для нагрузочных и интеграционных тестов")
+    parser.add_argument('--path', action='append', default=[], metavar='SYMBOL=СЦЕНАРИЙ',
+                        help="Сценарий цены: BTC/USDT=walk:60000:0.001, ETH/USDT=3000, SOL/USDT=file:sol.csv")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8780)
+    parser.add_argument('--step', type=float, default=1.0, help="Секунд на шаг сценария цены")
+    parser.add_argument('--balance', type=float, default=1000.0, help="Начальный баланс USDT на ключ")
+    parser.add_argument('--latency', type=float, default=0.0, help="Задержка ответа, сек")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, help="Запросов в секунду на ключ/IP")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ответов 503")
+    parser.add_argument('--fill-delay', type=float, default=0.0, help="Минимальный возраст ордера для исполнения, сек")
+    parser.add_argument('--fill-probability', type=float, default=1.0)
+    parser.add_argument('--slippage', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = {}
+    for spec in args.path or ['BTC/USDT=walk:60000:0.0005']:
+        symbol, _, scenario = spec.partition('=')
+        paths[symbol] = PricePath.parse(scenario, args.seed)
+    mock = MockMexc(paths, args.host, args.port, args.step, args.balance, args.latency, args.jitter,
+                    args.rate_limit, None, args.error_rate, args.fill_delay, args.fill_probability,
+                    args.slippage, seed=args.seed)
+    logging.basicConfig(level=logging.INFO)
+    mock.start()
+    print(f"Мок MEXC: {mock.url} (MEXC_API_URL={mock.url})")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import heapq
+import threading
+import time
+from datetime import datetime
+
+NOTIFY_INSTANT = 'instant'  # каждое событие отдельным сообщением
+NOTIFY_BATCH = 'batch'  # одно сообщение раз в notify_interval секунд
+NOTIFY_DIGEST = 'digest'  # сводка раз в час
+NOTIFY_MODES = (NOTIFY_INSTANT, NOTIFY_BATCH, NOTIFY_DIGEST)
+NOTIFY_MODE_NAMES = {NOTIFY_INSTANT: 'сразу', NOTIFY_BATCH: 'пачкой', NOTIFY_DIGEST: 'сводка раз в час'}
+DIGEST_INTERVAL = 3600
+BATCH_MIN_INTERVAL = 10
+BATCH_DETAIL_LIMIT = 5  # до стольких событий сообщение перечисляет их построчно
+
+
+def parse_notify_mode(text, default_interval=60):
+    """Ввод пользователя: instant | batch [секунд] | digest; возвращает (режим, интервал)"""
+    parts = text.strip().lower().split()
+    if not parts or parts[0] not in NOTIFY_MODES:
+        raise ValueError(f"Режим должен быть одним из: {', '.join(NOTIFY_MODES)}")
+    interval = default_interval
+    if parts[0] == NOTIFY_BATCH and len(parts) > 1:
+        interval = int(parts[1])
+        if interval < BATCH_MIN_INTERVAL:
+            raise ValueError(f"Интервал не меньше {BATCH_MIN_INTERVAL} секунд")
+    return parts[0], interval
+
+
+def describe_notify_mode(mode, interval):
+    if mode == NOTIFY_BATCH:
+        return f"{NOTIFY_MODE_NAMES[mode]} раз в {interval} сек"
+    return NOTIFY_MODE_NAMES.get(mode, mode)
+
+
+class _Pending:
+    def __init__(self, mode, due):
+        self.mode = mode
+        self.due = due
+        self.started = time.time()
+        self.buys = 0
+        self.spent = 0.0
+        self.fills = 0
+        self.profit = 0.0
+        self.symbols = set()
+        self.lines = []
+
+
+class TradeNotifier:
+    """Сбор уведомлений о покупках и исполнениях в одно сообщение на пользователя за период"""
+
+    def __init__(self, send):
+        self.send = send  # send(user_id, text)
+        self.cond = threading.Condition()
+        self.pending = {}  # user_id -> _Pending
+        self.due = []  # куча (время отправки, user_id)
+        self.thread = None
+        self.stopping = False
+        self.sent = 0
+        self.events = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='trade_notifier', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def next_due(mode, interval, now):
+        if mode == NOTIFY_DIGEST:
+            return (int(now // DIGEST_INTERVAL) + 1) * DIGEST_INTERVAL  # начало следующего часа
+        return now + max(interval, BATCH_MIN_INTERVAL)
+
+    def add(self, user_id, mode, interval, kind, text, symbol, cost=0.0, profit=0.0):
+        """Событие сделки: kind 'buy' (cost - потрачено USDT) или 'fill' (profit - прибыль)"""
+        now = time.time()
+        with self.cond:
+            self.events += 1
+            pending = self.pending.get(user_id)
+            if pending is None:
+                pending = self.pending[user_id] = _Pending(mode, self.next_due(mode, interval, now))
+                heapq.heappush(self.due, (pending.due, user_id))
+                self.cond.notify()
+            if kind == 'buy':
+                pending.buys += 1
+                pending.spent += cost
+            else:
+                pending.fills += 1
+                pending.profit += profit
+            pending.symbols.add(symbol)
+            pending.lines.append(f"{datetime.fromtimestamp(now).strftime('%H:%M:%S')} {text}")
+
+    @staticmethod
+    def format(pending):
+        period = 'за час' if pending.mode == NOTIFY_DIGEST else f"за {int(time.time() - pending.started)} сек"
+        text = (f"📊 Сделки {period} ({', '.join(sorted(pending.symbols))}):\n"
+                f"• Покупок: {pending.buys} на {pending.spent:.2f} USDT\n"
+                f"• Исполнено продаж: {pending.fills}\n"
+                f"• Прибыль: {pending.profit:.6f} USDT")
+        if pending.mode == NOTIFY_BATCH and len(pending.lines) <= BATCH_DETAIL_LIMIT:
+            text += "\n\n" + "\n".join(pending.lines)
+        return text
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopping:
+                        return
+                    if self.due and self.due[0][0] <= time.time():
+                        _, user_id = heapq.heappop(self.due)
+                        pending = self.pending.pop(user_id)
+                        break
+                    self.cond.wait(self.due[0][0] - time.time() if self.due else None)
+            self._deliver(user_id, pending)
+
+    def _deliver(self, user_id, pending):
+        self.send(user_id, self.format(pending))
+        with self.cond:
+            self.sent += 1
+
+    def flush(self):
+        """Немедленная отправка всего накопленного"""
+        with self.cond:
+            items = list(self.pending.items())
+            self.pending.clear()
+            self.due.clear()
+        for user_id, pending in items:
+            self._deliver(user_id, pending)
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        self.flush()
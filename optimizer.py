@@ -0,0 +1,130 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from backtest import Backtest, MarketData, load_market_data
+from dca_strategy import DcaStrategy
+
+# Пространство поиска: значения для сетки; для fall/rise в случайном поиске берется диапазон min..max
+SEARCH_SPACE = {
+    'fall_percent': [0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0],
+    'rise_percent': [0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0],
+    'cooldown': [0, 30, 60, 300, 900],
+    'orders_limit': [0, 1, 2, 3, 5, 10],
+}
+CONTINUOUS = ('fall_percent', 'rise_percent')
+
+# Данные процесса-исполнителя: открываются один раз из memmap в инициализаторе пула
+_worker_data = None
+_worker_config = None
+
+
+def grid(space=SEARCH_SPACE):
+    """Все сочетания значений пространства поиска"""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+def random_candidates(count, space=SEARCH_SPACE, seed=None):
+    rng = random.Random(seed)
+    candidates = []
+    for _ in range(count):
+        candidate = {}
+        for key, values in space.items():
+            if key in CONTINUOUS:
+                candidate[key] = round(rng.uniform(min(values), max(values)), 2)
+            else:
+                candidate[key] = rng.choice(values)
+        candidates.append(candidate)
+    return candidates
+
+
+def share_market_data(data, directory):
+    """Сохраняет цены в .npy для отображения в память исполнителями (без копии в каждый процесс)"""
+    path = os.path.join(directory, 'market.npy')
+    array = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(5, len(data)))
+    array[0], array[1], array[2], array[3], array[4] = data.t, data.open, data.high, data.low, data.close
+    array.flush()
+    del array
+    return path
+
+
+def _init_worker(path, kind, config):
+    global _worker_data, _worker_config
+    array = np.load(path, mmap_mode='r')
+    _worker_data = MarketData(array[0], array[1], array[2], array[3], array[4], kind)
+    _worker_config = config
+
+
+def _evaluate(candidate):
+    config = _worker_config
+    strategy = DcaStrategy(candidate['fall_percent'], candidate['rise_percent'], config['amount'],
+                           candidate['orders_limit'], candidate['cooldown'])
+    result = Backtest(_worker_data, strategy, config['symbol'], config['taker_fee'], config['maker_fee']).run()
+    return dict(candidate,
+                profit=result.total_profit,
+                unrealized=result.unrealized,
+                drawdown=result.max_drawdown,
+                trades=result.trades,
+                max_open_orders=result.max_open_orders)
+
+
+def optimize(data, candidates, amount=10.0, symbol='BTC/USDT', taker_fee=0.0005, maker_fee=0.0, workers=None):
+    """Прогон кандидатов на всех ядрах; результат отсортирован по прибыли, затем по просадке и числу сделок"""
+    config = {'amount': amount, 'symbol': symbol, 'taker_fee': taker_fee, 'maker_fee': maker_fee}
+    workers = workers or os.cpu_count() or 1
+    directory = tempfile.mkdtemp(prefix='optimizer-')
+    try:
+        path = share_market_data(data, directory)
+        # spawn: безопасно из многопоточного процесса бота
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(path, data.kind, config)) as executor:
+            chunksize = max(1, len(candidates) // (workers * 4))
+            results = list(executor.map(_evaluate, candidates, chunksize=chunksize))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    results.sort(key=lambda r: (-r['profit'], r['drawdown'], -r['trades']))
+    return results
+
+
+def format_table(results, top=10):
+    lines = [f"{'#':>3} {'fall%':>6} {'rise%':>6} {'cooldown':>8} {'limit':>5} "
+             f"{'прибыль':>10} {'просадка':>10} {'сделок':>7}"]
+    for place, r in enumerate(results[:top], 1):
+        lines.append(f"{place:>3} {r['fall_percent']:>6.2f} {r['rise_percent']:>6.2f} {r['cooldown']:>8} "
+                     f"{r['orders_limit']:>5} {r['profit']:>10.2f} {r['drawdown']:>10.2f} {r['trades']:>7}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подбор параметров DCA-стратегии по истории цен")
+    parser.add_argument('data', help="Файл истории цен (см. backtest.py)")
+    parser.add_argument('--symbol', default='BTC/USDT')
+    parser.add_argument('--amount', type=float, default=10.0)
+    parser.add_argument('--random', type=int, default=0, help="Случайный поиск из N кандидатов вместо сетки")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int, help="Процессов (по умолчанию все ядра)")
+    parser.add_argument('--taker-fee', type=float, default=0.0005)
+    parser.add_argument('--maker-fee', type=float, default=0.0)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    data = load_market_data(args.data, args.symbol)
+    candidates = random_candidates(args.random, seed=args.seed) if args.random else grid()
+    start = time.time()
+    results = optimize(data, candidates, args.amount, args.symbol, args.taker_fee, args.maker_fee, args.workers)
+    print(format_table(results, args.top))
+    print(f"\n{len(candidates)} вариантов на {len(data)} точках за {time.time() - start:.1f} сек")
+
+
+if __name__ == "__main__":
+    main()
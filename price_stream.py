@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+try:
+    import ccxt.pro as ccxtpro
+except ImportError:
+    ccxtpro = None
+
+logger = logging.getLogger('TRADING_BOT')
+
+
+class PriceStream:
+    """Потоковые цены MEXC: одна подписка на ленту сделок для каждого символа"""
+
+    def __init__(self, on_tick, ws_url=None, markets=None, record_path=None,
+                 reconnect_delay=1.0, max_reconnect_delay=60.0):
+        if ccxtpro is None:
+            raise RuntimeError("ccxt.pro недоступен, потоковые цены отключены")
+        self.on_tick = on_tick
+        self.ws_url = ws_url
+        self.markets = markets
+        self.record_path = record_path
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.loop = None
+        self.exchange = None
+        self.thread = None
+        self.tasks = {}  # symbol -> asyncio.Task
+        self.last_tick = {}  # symbol -> время последнего тика
+        self.reconnects = 0
+        self.ticks = 0
+        self._ready = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='price_stream', daemon=True)
+        self.thread.start()
+        self._ready.wait(10)
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._shutdown()))
+
+    def set_symbols(self, symbols):
+        """Синхронизирует набор подписок с активными символами (вызывается из любого потока)"""
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._sync_symbols, set(symbols))
+
+    def is_fresh(self, symbol, max_age):
+        """Есть ли по символу свежий тик из потока"""
+        last = self.last_tick.get(symbol)
+        return last is not None and time.time() - last < max_age
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        config = {'enableRateLimit': True}
+        self.exchange = ccxtpro.mexc(config)
+        if self.ws_url:
+            self.exchange.urls['api']['ws']['spot'] = self.ws_url
+        if self.markets:
+            self.exchange.set_markets(self.markets)
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def _sync_symbols(self, symbols):
+        for symbol in set(self.tasks) - symbols:
+            self.tasks.pop(symbol).cancel()
+            # Без живого соединения отписываться не от чего
+            if self.last_tick.pop(symbol, None) is not None:
+                asyncio.ensure_future(self._unwatch(symbol))
+            logger.info(f"Отписка от потока цен {symbol}")
+
+        for symbol in symbols - set(self.tasks):
+            self.tasks[symbol] = asyncio.ensure_future(self._watch_symbol(symbol))
+            logger.info(f"Подписка на поток цен {symbol}")
+
+    async def _unwatch(self, symbol):
+        try:
+            await self.exchange.un_watch_trades(symbol)
+        except Exception as e:
+            logger.debug(f"Ошибка отписки от {symbol}: {e}")
+
+    async def _watch_symbol(self, symbol):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                trades = await self.exchange.watch_trades(symbol)
+                if not trades:
+                    continue
+                trade = trades[-1]
+                timestamp = time.time()
+                self.last_tick[symbol] = timestamp
+                self.ticks += 1
+                delay = self.reconnect_delay
+                self._record(symbol, trade)
+                self.on_tick(symbol, float(trade['price']), timestamp)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # ccxt.pro переподключается при следующем вызове watch_*
+                self.reconnects += 1
+                self.last_tick.pop(symbol, None)
+                logger.error(f"Ошибка потока цен {symbol}: {e}, переподключение через {delay:.0f} сек")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _record(self, symbol, trade):
+        """Запись тиков в JSONL для воспроизведения через fake_mexc_ws.py"""
+        if not self.record_path:
+            return
+        try:
+            with open(self.record_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({
+                    's': symbol.replace('/', ''),
+                    'p': trade['price'],
+                    'v': trade.get('amount'),
+                    't': trade.get('timestamp')
+                }) + '\n')
+        except Exception as e:
+            logger.error(f"Ошибка записи тика {symbol}: {e}")
+
+    async def _shutdown(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        try:
+            await self.exchange.close()
+        finally:
+            self.loop.stop()
@@ -0,0 +1,357 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('TRADING_BOT')
+
+INSERT_PROFIT = ("INSERT INTO profits (user_id, profit, timestamp, symbol, buy_price, sell_price) "
+                 "VALUES (?, ?, ?, ?, ?, ?)")
+
+BUSY_CODES = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def is_busy(error):
+    """База занята другим соединением: только такую ошибку имеет смысл повторять"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is None:
+        return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+    return code & 0xff in BUSY_CODES  # расширенные коды (SQLITE_BUSY_SNAPSHOT и т. п.) - по основному
+
+
+# Свертки прибыли: обновляются в той же транзакции, что и вставка сделок
+ROLLUP_TABLES = {
+    'profit_daily': '''CREATE TABLE IF NOT EXISTS profit_daily
+                       (user_id INTEGER NOT NULL,
+                        symbol TEXT NOT NULL,
+                        day TEXT NOT NULL,
+                        profit REAL NOT NULL,
+                        trades INTEGER NOT NULL,
+                        PRIMARY KEY (user_id, symbol, day))''',
+    'profit_monthly': '''CREATE TABLE IF NOT EXISTS profit_monthly
+                         (user_id INTEGER NOT NULL,
+                          symbol TEXT NOT NULL,
+                          month TEXT NOT NULL,
+                          profit REAL NOT NULL,
+                          trades INTEGER NOT NULL,
+                          PRIMARY KEY (user_id, month, symbol))''',
+    'profit_totals': '''CREATE TABLE IF NOT EXISTS profit_totals
+                        (user_id INTEGER PRIMARY KEY,
+                         profit REAL NOT NULL,
+                         trades INTEGER NOT NULL)'''
+}
+
+UPSERT_DAILY = ("INSERT INTO profit_daily (user_id, symbol, day, profit, trades) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id, symbol, day) DO UPDATE SET "
+                "profit = profit + excluded.profit, trades = trades + excluded.trades")
+UPSERT_MONTHLY = ("INSERT INTO profit_monthly (user_id, symbol, month, profit, trades) VALUES (?, ?, ?, ?, ?) "
+                  "ON CONFLICT(user_id, month, symbol) DO UPDATE SET "
+                  "profit = profit + excluded.profit, trades = trades + excluded.trades")
+UPSERT_TOTALS = ("INSERT INTO profit_totals (user_id, profit, trades) VALUES (?, ?, ?) "
+                 "ON CONFLICT(user_id) DO UPDATE SET "
+                 "profit = profit + excluded.profit, trades = trades + excluded.trades")
+
+
+def ensure_rollups(conn):
+    """Создает таблицы сверток; возвращает True, если их не было (нужен пересчет)"""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for statement in ROLLUP_TABLES.values():
+        conn.execute(statement)
+    return not set(ROLLUP_TABLES) <= existing
+
+
+def _rebuild_rollups(conn):
+    ensure_rollups(conn)
+    for table in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    # Границы дней и месяцев - по местному времени, как в datetime.fromtimestamp
+    conn.execute('''INSERT INTO profit_daily (user_id, symbol, day, profit, trades)
+                    SELECT user_id, symbol, date(timestamp, 'unixepoch', 'localtime'),
+                           SUM(profit), COUNT(*)
+                    FROM profits GROUP BY 1, 2, 3''')
+    conn.execute('''INSERT INTO profit_monthly (user_id, symbol, month, profit, trades)
+                    SELECT user_id, symbol, substr(day, 1, 7), SUM(profit), SUM(trades)
+                    FROM profit_daily GROUP BY 1, 2, 3''')
+    conn.execute('''INSERT INTO profit_totals (user_id, profit, trades)
+                    SELECT user_id, SUM(profit), SUM(trades)
+                    FROM profit_monthly GROUP BY 1''')
+    return conn.execute("SELECT COALESCE(SUM(trades), 0) FROM profit_totals").fetchone()[0]
+
+
+def _transaction(path, action):
+    """Выполняет action(conn) в транзакции с блокировкой на запись"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = action(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+    finally:
+        conn.close()
+
+
+def rebuild_rollups(path):
+    """Полный пересчет сверток по таблице profits одной транзакцией; возвращает число сделок"""
+    return _transaction(path, _rebuild_rollups)
+
+
+#############################################################################
+# Миграции схемы profits.db (номер версии хранится в PRAGMA user_version)
+#############################################################################
+
+def _create_profits(conn):
+    """Исходная схема: таблица сделок и одноколоночные индексы"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS profits
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER NOT NULL,
+                     profit REAL NOT NULL,
+                     timestamp REAL NOT NULL,
+                     symbol TEXT NOT NULL,
+                     buy_price REAL NOT NULL,
+                     sell_price REAL NOT NULL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON profits (user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON profits (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_symbol ON profits (symbol)")
+
+
+def _create_rollups(conn):
+    """Свертки прибыли; в старой базе с данными строятся по всей истории"""
+    if ensure_rollups(conn):
+        _rebuild_rollups(conn)
+
+
+def _composite_indexes(conn):
+    """Все выборки по сделкам идут по user_id с диапазоном или сортировкой по timestamp:
+    один составной индекс вместо трех одноколоночных; symbol и profit покрывают суммы за период"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_profits_user_time ON profits (user_id, timestamp, symbol, profit)")
+    conn.execute("DROP INDEX IF EXISTS idx_user_id")
+    conn.execute("DROP INDEX IF EXISTS idx_timestamp")
+    conn.execute("DROP INDEX IF EXISTS idx_symbol")
+
+
+MIGRATIONS = [_create_profits, _create_rollups, _composite_indexes]
+
+
+def migrate_profit_db(path, target=None):
+    """Применяет недостающие миграции, каждую в своей транзакции; возвращает (было, стало)"""
+    target = len(MIGRATIONS) if target is None else target
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        initial = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+    for version in range(initial, target):
+        def apply(conn, version=version):
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+        _transaction(path, apply)
+    return initial, max(initial, target)
+
+
+#############################################################################
+# Проверка планов запросов отчетов
+#############################################################################
+
+# Запросы отчетов бота: имя -> (SQL, параметры)
+# Запросы отчетов бота: ScalperBot выполняет именно эти строки, аудит планов проверяет их же
+SELECT_MONTH_PROFIT = '''SELECT profit, trades, symbol
+                         FROM profit_monthly
+                         WHERE user_id = ? AND month = ?'''
+SELECT_USER_TOTALS = '''SELECT profit, trades FROM profit_totals WHERE user_id = ?'''
+SELECT_USER_MONTHS = '''SELECT month, SUM(profit), SUM(trades)
+                        FROM profit_monthly
+                        WHERE user_id = ?
+                        GROUP BY month
+                        ORDER BY month DESC
+                        LIMIT 6'''
+SELECT_RECENT_TRADES = '''SELECT * FROM profits
+                          WHERE user_id = ?
+                          ORDER BY timestamp DESC
+                          LIMIT ?'''
+
+REPORT_QUERIES = {
+    'get_profit': (SELECT_MONTH_PROFIT, (1, '2024-01')),
+    'user_totals': (SELECT_USER_TOTALS, (1,)),
+    'user_months': (SELECT_USER_MONTHS, (1,)),
+    'recent_trades': (SELECT_RECENT_TRADES, (1, 3)),
+}
+
+
+def explain_reports(conn):
+    """План каждого запроса отчетов: имя -> список строк EXPLAIN QUERY PLAN"""
+    plans = {}
+    for name, (sql, params) in REPORT_QUERIES.items():
+        plans[name] = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    return plans
+
+
+def audit_query_plans(conn):
+    """Шаги с полным сканированием или сортировкой во временном дереве; пустой список - все в порядке"""
+    problems = []
+    for name, plan in explain_reports(conn).items():
+        for step in plan:
+            if step.startswith('SCAN') or 'TEMP B-TREE FOR ORDER BY' in step:
+                problems.append(f"{name}: {step}")
+    return problems
+
+
+def aggregate_rows(rows):
+    """Суммы пачки сделок по дням, месяцам и пользователям для UPSERT сверток"""
+    daily, monthly, totals = {}, {}, {}
+    for user_id, profit, timestamp, symbol, _, _ in rows:
+        day = time.strftime('%Y-%m-%d', time.localtime(timestamp))
+        for bucket, key in ((daily, (user_id, symbol, day)),
+                            (monthly, (user_id, symbol, day[:7])),
+                            (totals, (user_id,))):
+            current = bucket.get(key, (0.0, 0))
+            bucket[key] = (current[0] + profit, current[1] + 1)
+    return ([key + value for key, value in daily.items()],
+            [key + value for key, value in monthly.items()],
+            [key + value for key, value in totals.items()])
+
+
+class LedgerWriter:
+    """Запись сделок в profits.db одним соединением: строки копятся в очереди и пишутся пачками"""
+
+    def __init__(self, path, batch_size=500, flush_interval=0.05, retry_delay=0.5, max_retries=20):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries  # попыток записи при занятой базе
+        self.queue = queue.Queue()
+        self.thread = None
+        self.commits = 0
+        self.rows = 0
+        self.errors = 0
+        self.dropped = 0  # строк, которые не удалось записать
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.avg_latency = 0.0
+        self._stop = object()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='profit_ledger', daemon=True)
+        self.thread.start()
+
+    def record(self, user_id, profit, symbol, buy_price, sell_price, timestamp=None):
+        """Постановка сделки в очередь, вызывающий поток не ждет записи"""
+        self.queue.put((user_id, profit, timestamp or time.time(), symbol, buy_price, sell_price))
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def flush(self):
+        """Ожидание записи всех поставленных в очередь строк"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def stop(self, timeout=30):
+        """Остановка с записью всего, что осталось в очереди, не дольше timeout секунд"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(self._stop)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            # Незавершенные задачи очереди: строки в записи и в ожидании плюс маркер остановки
+            logger.error(f"Запись прибыли не завершилась за {timeout} сек, "
+                         f"не записано строк: {self.queue.unfinished_tasks - 1}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _collect(self, first):
+        """Добирает пачку: до batch_size строк или пока не истечет flush_interval"""
+        batch = [first]
+        deadline = time.time() + self.flush_interval
+        while first is not self._stop and len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is self._stop:
+                break
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                batch = self._collect(self.queue.get())
+                stopping = batch[-1] is self._stop
+                rows = [item for item in batch if item is not self._stop]
+                if rows:
+                    self._commit(conn, rows)
+                for _ in batch:
+                    self.queue.task_done()
+                if stopping:
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, rows):
+        """Пачка пишется одной транзакцией. Занятую базу пережидаем ограниченным числом повторов;
+        при остальных ошибках пачка пишется по строкам, строки с ошибкой записываются в лог и пропускаются"""
+        start = time.time()
+        try:
+            self._write_retrying(conn, rows)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Ошибка записи прибыли ({len(rows)} строк): {e}, запись по одной строке")
+            rows = self._commit_each(conn, rows)
+
+        latency = time.time() - start
+        self.commits += 1
+        self.rows += len(rows)
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.avg_latency += (latency - self.avg_latency) / self.commits
+
+    def _write_retrying(self, conn, rows):
+        """Транзакция с повтором, пока база занята (не больше max_retries раз); прочие ошибки - сразу наверх"""
+        attempt = 0
+        while True:
+            try:
+                with conn:
+                    self._write_batch(conn, rows)
+                return
+            except sqlite3.Error as e:
+                attempt += 1
+                if not is_busy(e) or attempt >= self.max_retries:
+                    raise
+                self.errors += 1
+                logger.error(f"База прибыли занята ({len(rows)} строк): {e}, повтор {attempt}")
+                time.sleep(self.retry_delay)
+
+    def _commit_each(self, conn, rows):
+        """Запись по одной строке; возвращает записанные"""
+        written = []
+        for row in rows:
+            try:
+                self._write_retrying(conn, [row])
+                written.append(row)
+            except Exception as e:
+                self.dropped += 1
+                logger.error(f"Строка прибыли пропущена: {row}: {e}")
+        return written
+
+    def _write_batch(self, conn, rows):
+        daily, monthly, totals = aggregate_rows(rows)
+        conn.executemany(INSERT_PROFIT, rows)
+        conn.executemany(UPSERT_DAILY, daily)
+        conn.executemany(UPSERT_MONTHLY, monthly)
+        conn.executemany(UPSERT_TOTALS, totals)
@@ -0,0 +1,179 @@
+import contextlib
+import threading
+import time
+
+import ccxt
+
+# Классы приоритета: меньше - важнее
+PRIORITY_ORDER = 0  # выставление и отмена ордеров
+PRIORITY_FILL = 1  # проверка исполнения
+PRIORITY_BALANCE = 2  # баланс и прочие приватные запросы
+PRIORITY_TICKER = 3  # цены, справочники, история
+PRIORITY_NAMES = ('order', 'fill', 'balance', 'ticker')
+# Доля емкости корзины, которую класс оставляет более важным запросам
+PRIORITY_RESERVE = (0.0, 0.1, 0.2, 0.3)
+
+FILL_PATHS = {'order', 'openOrders', 'allOrders', 'myTrades'}
+
+_local = threading.local()
+
+
+class RateLimitTimeout(ccxt.RateLimitExceeded):
+    """Запрос не дождался своей доли лимита; обрабатывается как ответ биржи 429"""
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    """Приоритет для запросов текущего потока вместо определяемого по эндпоинту"""
+    previous = getattr(_local, 'priority', None)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def is_private(api):
+    """ccxt передает api строкой или списком вида ['spot', 'private']"""
+    parts = api if isinstance(api, (list, tuple)) else [api]
+    return 'private' in parts
+
+
+def endpoint_priority(method, path, private):
+    if path in ('order', 'batchOrders', 'openOrders') and method in ('POST', 'DELETE'):
+        return PRIORITY_ORDER
+    if path in FILL_PATHS:
+        return PRIORITY_FILL
+    if private:
+        return PRIORITY_BALANCE
+    return PRIORITY_TICKER
+
+
+class TokenBucket:
+    """Корзина токенов: rate в секунду, не больше capacity накопленных"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, weight, reserve, now):
+        """Сколько ждать, пока в корзине будет weight сверх резерва более важных классов"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        required = min(self.capacity, weight + reserve * self.capacity)
+        if self.tokens >= required:
+            return 0.0
+        return (required - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    """Общий для всех пользователей планировщик запросов к бирже.
+
+    Корзины токенов: публичные запросы - на эндпоинт с одного IP, приватные - на API-ключ,
+    при заданном ip_total_rate еще одна общая корзина IP. Вес запроса берется из описания API в ccxt.
+    Менее важные классы не тратят резерв емкости, поэтому ордера не ждут за массовым опросом цен"""
+
+    def __init__(self, ip_rate=20, key_rate=20, ip_total_rate=None, burst_seconds=10, max_wait=30, penalty=10):
+        self.ip_rate = ip_rate
+        self.key_rate = key_rate
+        self.ip_total_rate = ip_total_rate
+        self.burst_seconds = burst_seconds
+        self.max_wait = max_wait
+        self.penalty = penalty  # пауза корзины после ответа 429
+        self.cond = threading.Condition(threading.Lock())
+        self.buckets = {}
+        self.stats = [{'requests': 0, 'waited': 0, 'wait_time': 0.0, 'max_wait': 0.0, 'timeouts': 0}
+                      for _ in PRIORITY_NAMES]
+        self.penalties = 0
+
+    def _bucket(self, key, rate):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate, rate * self.burst_seconds)
+        return bucket
+
+    def _buckets(self, path, account, private):
+        if private:
+            buckets = [self._bucket(('key', account), self.key_rate)]
+        else:
+            buckets = [self._bucket(('ip', path), self.ip_rate)]
+        if self.ip_total_rate:
+            buckets.append(self._bucket(('ip',), self.ip_total_rate))
+        return buckets
+
+    def acquire(self, path, account='', private=False, weight=1, priority=PRIORITY_TICKER):
+        """Блокирует до появления доли лимита; возвращает время ожидания"""
+        reserve = PRIORITY_RESERVE[priority]
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        stats = self.stats[priority]
+        waited = 0.0
+        with self.cond:
+            buckets = self._buckets(path, account, private)
+            while True:
+                now = time.monotonic()
+                delay = max(bucket.delay(weight, reserve, now) for bucket in buckets)
+                if delay <= 0:
+                    for bucket in buckets:
+                        bucket.tokens -= weight
+                    break
+                if now + delay > deadline:
+                    stats['timeouts'] += 1
+                    raise RateLimitTimeout(f"Лимит запросов {path}: ожидание больше {self.max_wait} сек")
+                self.cond.wait(delay)
+                waited = time.monotonic() - started
+            stats['requests'] += 1
+            if waited > 0:
+                stats['waited'] += 1
+                stats['wait_time'] += waited
+                stats['max_wait'] = max(stats['max_wait'], waited)
+        return waited
+
+    def penalize(self, path, account='', private=False):
+        """Биржа ответила 429: корзина пустеет и закрывается на penalty секунд для всех ее запросов"""
+        with self.cond:
+            blocked_until = time.monotonic() + self.penalty
+            for bucket in self._buckets(path, account, private):
+                bucket.tokens = 0
+                bucket.blocked_until = max(bucket.blocked_until, blocked_until)
+            self.penalties += 1
+
+    def forget(self, account):
+        with self.cond:
+            self.buckets.pop(('key', account), None)
+
+    def attach(self, exchange, account=''):
+        """Все запросы клиента ccxt проходят через планировщик вместо собственного темпа экземпляра"""
+        exchange.enableRateLimit = False
+        fetch2 = exchange.fetch2
+
+        def scheduled_fetch2(path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+            private = is_private(api)
+            priority = getattr(_local, 'priority', None)
+            if priority is None:
+                priority = endpoint_priority(method, path, private)
+            weight = exchange.calculate_rate_limiter_cost(api, method, path, params, config)
+            self.acquire(path, account, private, weight, priority)
+            try:
+                return fetch2(path, api, method, params, headers, body, config)
+            except ccxt.RateLimitExceeded:
+                self.penalize(path, account, private)
+                raise
+
+        exchange.fetch2 = scheduled_fetch2
+        return exchange
+
+    def summary(self):
+        """Строка для статуса администратора"""
+        with self.cond:
+            parts = []
+            for name, stats in zip(PRIORITY_NAMES, self.stats):
+                average = stats['wait_time'] / stats['waited'] if stats['waited'] else 0.0
+                parts.append(f"{name} {stats['requests']} (ждали {stats['waited']}, "
+                             f"ср. {average:.2f} / макс. {stats['max_wait']:.2f} сек, отказов {stats['timeouts']})")
+            return '; '.join(parts) + f"; 429: {self.penalties}"
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+
+logger = logging.getLogger('TRADING_BOT')
+
+
+def atomic_write_json(path, data):
+    """Запись через временный файл и os.replace: файл либо старый, либо новый целиком"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.settings-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class JsonSettingsStore:
+    """Все настройки в одном JSON-файле (исходный формат); любое изменение переписывает файл"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            return json.load(f).get('users', {})
+
+    def save_many(self, items, users):
+        self.save_all(users)
+
+    def save_all(self, users):
+        with self.lock:
+            atomic_write_json(self.path, {'users': users})
+
+    def close(self):
+        pass
+
+
+class SqliteSettingsStore:
+    """Настройки в SQLite: одна строка на пользователя, запись одного пользователя - O(1)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS users
+                             (user_id TEXT PRIMARY KEY,
+                              data TEXT NOT NULL)''')
+        self.conn.commit()
+
+    def load(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT user_id, data FROM users").fetchall()
+        if not rows:
+            return None
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def save_many(self, items, users=None):
+        """Несколько пользователей одной транзакцией"""
+        rows = [(user_id_str, json.dumps(data)) for user_id_str, data in items]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data", rows)
+
+    def save_all(self, users):
+        self.save_many(list(users.items()))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_settings_store(backend, json_path, db_path):
+    """Хранилище настроек по имени: 'sqlite' (по умолчанию) или 'json'"""
+    if backend == 'json':
+        return JsonSettingsStore(json_path)
+    if backend == 'sqlite':
+        return SqliteSettingsStore(db_path)
+    raise ValueError(f"Неизвестное хранилище настроек: {backend}")
+
+
+class SettingsWriter:
+    """Отложенная запись: изменения помечают пользователя, фоновый поток пишет их пачкой"""
+
+    def __init__(self, store, users, lock, interval=0.5):
+        self.store = store
+        self.users = users
+        self.lock = lock
+        self.interval = interval
+        self.dirty = set()
+        self.flushes = 0
+        self.written = 0
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._flush_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='settings_writer', daemon=True)
+        self.thread.start()
+
+    def mark_dirty(self, user_id_str):
+        with self.lock:
+            self.dirty.add(user_id_str)
+
+    def flush(self):
+        """Запись всех накопленных изменений одной транзакцией (или одной заменой файла)"""
+        with self._flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return 0
+                dirty, self.dirty = self.dirty, set()
+                items = [(uid, dict(self.users[uid])) for uid in dirty if uid in self.users]
+                snapshot = None
+                if isinstance(self.store, JsonSettingsStore):
+                    snapshot = {uid: dict(data) for uid, data in self.users.items()}
+            try:
+                self.store.save_many(items, snapshot)
+            except Exception:
+                # Не теряем изменения: попробуем записать при следующем сбросе
+                with self.lock:
+                    self.dirty.update(dirty)
+                raise
+            self.flushes += 1
+            self.written += len(items)
+            return len(items)
+
+    def stop(self):
+        """Остановка с гарантированной записью всех изменений"""
+        self._stopped = True
+        self._wakeup.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(10)
+        self.flush()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения настроек: {e}")
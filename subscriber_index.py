@@ -0,0 +1,96 @@
+import bisect
+import math
+import threading
+
+# Запас на погрешность float при сравнении цены с порогом
+THRESHOLD_EPSILON = 1e-12
+
+
+def buy_threshold(last_buy_price, fall_percent):
+    """Цена, при которой сработает следующая покупка"""
+    if last_buy_price is None:
+        return math.inf
+    return last_buy_price * (1 - float(fall_percent) / 100)
+
+
+class SubscriberIndex:
+    """Индекс подписчиков: символ -> пользователи, отсортированные по порогу следующей покупки"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.members = {}  # symbol -> set(user_id)
+        self.thresholds = {}  # symbol -> отсортированный список (threshold, user_id)
+        self.entries = {}  # user_id -> (symbol, threshold или None)
+
+    def add(self, user_id, symbol, threshold=None):
+        """Подписка пользователя; threshold=None - пользователь не ждет покупки (пауза, лимит ордеров)"""
+        with self.lock:
+            self._remove(user_id)
+            self.members.setdefault(symbol, set()).add(user_id)
+            self._set_threshold(user_id, symbol, threshold)
+
+    def set_threshold(self, user_id, threshold):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return
+            symbol, current = entry
+            if current == threshold:
+                return
+            self._drop_threshold(user_id, symbol, current)
+            self._set_threshold(user_id, symbol, threshold)
+
+    def remove(self, user_id):
+        with self.lock:
+            self._remove(user_id)
+
+    def triggered(self, symbol, price):
+        """Пользователи, чей порог пересечен ценой: O(log n + k)"""
+        with self.lock:
+            thresholds = self.thresholds.get(symbol)
+            if not thresholds:
+                return []
+            start = bisect.bisect_left(thresholds, (price * (1 - THRESHOLD_EPSILON),))
+            return [user_id for _, user_id in thresholds[start:]]
+
+    def symbols(self):
+        with self.lock:
+            return set(self.members)
+
+    def subscribers(self, symbol):
+        with self.lock:
+            return set(self.members.get(symbol, ()))
+
+    def waiting(self, symbol):
+        """Количество пользователей, ожидающих покупки по символу"""
+        with self.lock:
+            return len(self.thresholds.get(symbol, ()))
+
+    def _set_threshold(self, user_id, symbol, threshold):
+        self.entries[user_id] = (symbol, threshold)
+        if threshold is not None:
+            bisect.insort(self.thresholds.setdefault(symbol, []), (threshold, user_id))
+
+    def _drop_threshold(self, user_id, symbol, threshold):
+        if threshold is None:
+            return
+        thresholds = self.thresholds.get(symbol)
+        if not thresholds:
+            return
+        i = bisect.bisect_left(thresholds, (threshold, user_id))
+        if i < len(thresholds) and thresholds[i] == (threshold, user_id):
+            del thresholds[i]
+        if not thresholds:
+            del self.thresholds[symbol]
+
+    def _remove(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return
+        symbol, threshold = entry
+        self._drop_threshold(user_id, symbol, threshold)
+        members = self.members.get(symbol)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self.members[symbol]
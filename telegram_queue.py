@@ -0,0 +1,209 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('TRADING_BOT')
+
+TELEGRAM_MAX_LENGTH = 4096  # предел длины одного сообщения Bot API
+
+
+def retry_after(error):
+    """Пауза из ответа 429 (ApiTelegramException.result_json.parameters.retry_after); None - не 429"""
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    result = getattr(error, 'result_json', None) or {}
+    return float((result.get('parameters') or {}).get('retry_after') or 1)
+
+
+def is_permanent(error):
+    """Чат недоступен или запрос неверен: повтор не поможет"""
+    return getattr(error, 'error_code', None) in (400, 403)
+
+
+class _Chat:
+    def __init__(self):
+        self.pending = deque()  # [текст, параметры отправки, список callback, попыток]
+        self.ready_at = 0.0
+        self.scheduled = False  # чат стоит в очереди готовности или отправляется
+        self.sending = False  # первое сообщение сейчас отправляется - к нему не приклеиваем
+
+
+class OutboundQueue:
+    """Фоновая отправка сообщений Telegram.
+
+    Общий лимит бота (global_rate сообщений в секунду) и интервал между сообщениями в один чат.
+    Подряд идущие сообщения одному чату, ожидающие отправки, склеиваются в одно.
+    На 429 сообщение остается первым в очереди чата и уходит после retry_after"""
+
+    def __init__(self, send, global_rate=30, chat_interval=1.0, workers=4, max_retries=5):
+        self.send_func = send  # send(chat_id, text, **kwargs), например bot.send_message
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self.cond = threading.Condition()
+        self.chats = {}  # chat_id -> _Chat
+        self.ready = []  # куча (время готовности, порядковый номер, chat_id)
+        self.seq = itertools.count()
+        self.tokens = float(global_rate)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0  # общая пауза после 429
+        self.depth = 0
+        self.in_flight = 0
+        self.threads = []
+        self.stopping = False
+        self.stats = {'queued': 0, 'sent': 0, 'coalesced': 0, 'retries': 0, 'rate_limited': 0, 'failed': 0}
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'telegram_out_{number}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def send(self, chat_id, text, coalesce=True, callback=None, **kwargs):
+        """Постановка сообщения в очередь; callback(ok) вызывается после отправки или отказа"""
+        with self.cond:
+            self.stats['queued'] += 1
+            if self.stats['queued'] % 1000 == 0:
+                self._prune()
+            chat = self.chats.get(chat_id)
+            if chat is None:
+                chat = self.chats[chat_id] = _Chat()
+            last = chat.pending[-1] if chat.pending and not (chat.sending and len(chat.pending) == 1) else None
+            # Склеиваем с последним ожидающим сообщением того же формата, если влезает в лимит длины
+            if (coalesce and last is not None and last[1] == kwargs
+                    and len(last[0]) + len(text) + 2 <= TELEGRAM_MAX_LENGTH):
+                last[0] = f"{last[0]}\n\n{text}"
+                if callback:
+                    last[2].append(callback)
+                self.stats['coalesced'] += 1
+                return
+            chat.pending.append([text, kwargs, [callback] if callback else [], 0])
+            self.depth += 1
+            if not chat.scheduled:
+                self._schedule(chat_id, chat)
+
+    def _prune(self):
+        """Удаление чатов без сообщений, у которых истек интервал"""
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, chat in self.chats.items()
+                        if not chat.pending and not chat.scheduled and chat.ready_at <= now]:
+            del self.chats[chat_id]
+
+    def _schedule(self, chat_id, chat):
+        chat.scheduled = True
+        heapq.heappush(self.ready, (chat.ready_at, next(self.seq), chat_id))
+        self.cond.notify()
+
+    def _take_token(self, now):
+        """Общий лимит: 0 - можно отправлять, иначе сколько ждать"""
+        self.tokens = min(self.global_rate, self.tokens + (now - self.updated) * self.global_rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.global_rate
+        self.tokens -= 1
+        return 0.0
+
+    def _next(self):
+        """Следующий чат, которому можно отправить; None при остановке с пустой очередью"""
+        with self.cond:
+            while True:
+                if self.stopping and not self.ready:
+                    return None
+                if not self.ready:
+                    self.cond.wait()
+                    continue
+                now = time.monotonic()
+                ready_at, _, chat_id = self.ready[0]
+                if ready_at > now:
+                    self.cond.wait(ready_at - now)
+                    continue
+                wait = self._take_token(now)
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.ready)
+                chat = self.chats[chat_id]
+                self.in_flight += 1
+                chat.sending = True
+                return chat_id, chat, chat.pending[0]
+
+    def _run(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            chat_id, chat, message = task
+            text, kwargs, callbacks, attempts = message
+            delay = 0.0
+            done = ok = False
+            try:
+                self.send_func(chat_id, text, **kwargs)
+                done = ok = True
+            except Exception as e:
+                pause = retry_after(e)
+                if pause is not None:
+                    with self.cond:
+                        self.stats['rate_limited'] += 1
+                        # Лимит бота целиком: на это время останавливаем все чаты
+                        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                    delay = pause
+                elif is_permanent(e) or attempts + 1 >= self.max_retries:
+                    logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
+                    done = True
+                else:
+                    delay = min(2 ** attempts, 30)
+                    message[3] = attempts + 1
+                    with self.cond:
+                        self.stats['retries'] += 1
+
+            with self.cond:
+                self.in_flight -= 1
+                chat.sending = False
+                if done:
+                    chat.pending.popleft()
+                    self.depth -= 1
+                    self.stats['sent' if ok else 'failed'] += 1
+                chat.ready_at = time.monotonic() + max(delay, self.chat_interval)
+                chat.scheduled = False
+                if chat.pending:
+                    self._schedule(chat_id, chat)
+                self.cond.notify_all()
+            if done:
+                for callback in callbacks:
+                    try:
+                        callback(ok)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработчика отправки: {e}")
+
+    def flush(self, timeout=None):
+        """Ожидание отправки всего, что стоит в очереди"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while self.depth or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=10):
+        """Отправка оставшегося (не дольше timeout секунд) и остановка потоков"""
+        self.flush(timeout)
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=1)
+
+    def summary(self):
+        with self.cond:
+            stats = dict(self.stats)
+            depth = self.depth
+        return (f"в очереди {depth}, отправлено {stats['sent']}, склеено {stats['coalesced']}, "
+                f"429: {stats['rate_limited']}, ошибок {stats['failed']}")
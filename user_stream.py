@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import threading
+import time
+
+try:
+    import ccxt.pro as ccxtpro
+except ImportError:
+    ccxtpro = None
+
+logger = logging.getLogger('TRADING_BOT')
+
+# Сколько секунд поток должен проработать без ошибок, чтобы считаться подключенным
+STREAM_SETTLE_TIME = 15
+
+
+class UserDataStreams:
+    """Приватные потоки ордеров MEXC: одно подключение на API-ключ"""
+
+    def __init__(self, on_order, on_reconnect, ws_url=None, rest_url=None, markets=None,
+                 reconnect_delay=1.0, max_reconnect_delay=60.0):
+        if ccxtpro is None:
+            raise RuntimeError("ccxt.pro недоступен, приватные потоки отключены")
+        self.on_order = on_order
+        self.on_reconnect = on_reconnect
+        self.ws_url = ws_url
+        self.rest_url = rest_url
+        self.markets = markets
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.loop = None
+        self.thread = None
+        self.accounts = {}  # account -> {'refs', 'task', 'exchange', 'since', 'generation', 'listen_key'}
+        self.events = 0
+        self.reconnects = 0
+        self._ready = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='user_streams', daemon=True)
+        self.thread.start()
+        self._ready.wait(10)
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._shutdown()))
+
+    def add_account(self, account, api_key, api_secret, listen_key=None):
+        """Подписка на ордера аккаунта (повторный вызов увеличивает счетчик ссылок)"""
+        self.loop.call_soon_threadsafe(self._add_account, account, api_key, api_secret, listen_key)
+
+    def remove_account(self, account):
+        self.loop.call_soon_threadsafe(self._remove_account, account)
+
+    def is_connected(self, account):
+        """Поток аккаунта работает без ошибок дольше STREAM_SETTLE_TIME"""
+        state = self.accounts.get(account)
+        return state is not None and state['since'] is not None and \
+            time.time() - state['since'] > STREAM_SETTLE_TIME
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def _make_exchange(self, api_key, api_secret, listen_key):
+        exchange = ccxtpro.mexc({
+            'apiKey': api_key,
+            'secret': api_secret,
+            'enableRateLimit': True,
+            'options': {'recvWindow': 60000}
+        })
+        if self.ws_url:
+            exchange.urls['api']['ws']['spot'] = self.ws_url
+        if self.rest_url:
+            exchange.urls['api']['spot']['private'] = self.rest_url
+            exchange.urls['api']['spot']['public'] = self.rest_url
+        if self.markets:
+            exchange.set_markets(self.markets)
+        if listen_key:
+            # Готовый listenKey (например, для фейкового сервера) - без REST-запроса
+            exchange.options['listenKey'] = listen_key
+        return exchange
+
+    def _add_account(self, account, api_key, api_secret, listen_key):
+        state = self.accounts.get(account)
+        if state is not None:
+            state['refs'] += 1
+            return
+        state = {
+            'refs': 1,
+            'exchange': self._make_exchange(api_key, api_secret, listen_key),
+            'since': None,
+            'generation': 0
+        }
+        self.accounts[account] = state
+        state['task'] = asyncio.ensure_future(self._watch_account(account, state))
+
+    def _remove_account(self, account):
+        state = self.accounts.get(account)
+        if state is None:
+            return
+        state['refs'] -= 1
+        if state['refs'] > 0:
+            return
+        del self.accounts[account]
+        state['task'].cancel()
+        asyncio.ensure_future(state['exchange'].close())
+
+    async def _watch_account(self, account, state):
+        exchange = state['exchange']
+        delay = self.reconnect_delay
+        state['since'] = time.time()
+        while True:
+            try:
+                orders = await exchange.watch_orders()
+                delay = self.reconnect_delay
+                for order in orders:
+                    self.events += 1
+                    try:
+                        self.on_order(account, order)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки события ордера: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                state['since'] = None
+                state['generation'] += 1
+                logger.error(f"Ошибка приватного потока: {e}, переподключение через {delay:.0f} сек")
+                # Сразу сверяем ордера через REST: пока потока нет, работает обычный опрос
+                self._notify_reconnect(account)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                state['since'] = time.time()
+                asyncio.ensure_future(self._reconcile_after_settle(account, state, state['generation']))
+
+    async def _reconcile_after_settle(self, account, state, generation):
+        """Повторная сверка после восстановления потока - закрывает разрыв между ошибкой и подпиской"""
+        await asyncio.sleep(STREAM_SETTLE_TIME)
+        if state['generation'] == generation and self.accounts.get(account) is state:
+            logger.info("Приватный поток восстановлен, сверка ордеров")
+            self._notify_reconnect(account)
+
+    def _notify_reconnect(self, account):
+        try:
+            self.on_reconnect(account)
+        except Exception as e:
+            logger.error(f"Ошибка сверки ордеров после переподключения: {e}")
+
+    async def _shutdown(self):
+        for state in self.accounts.values():
+            state['task'].cancel()
+            try:
+                await state['exchange'].close()
+            except Exception:
+                pass
+        self.accounts.clear()
+        self.loop.stop()
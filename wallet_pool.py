@@ -0,0 +1,274 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('TRADING_BOT')
+
+WHEEL_TICK = 10  # шаг колеса таймеров, секунд: резерв снимается не позже чем через WHEEL_TICK после срока
+AMOUNT_DECIMALS = 4  # знаков дробной метки суммы: 30 -> 30.0137
+AMOUNT_TAGS = 9999  # меток на одну базовую сумму и кошелек
+TAG_ATTEMPTS = 16  # случайных попыток найти свободную метку до перебора по порядку
+
+
+def amount_units(amount):
+    """Сумма в единицах последнего знака метки - ключ уникальности на кошельке"""
+    return round(float(amount) * 10 ** AMOUNT_DECIMALS)
+
+
+def load_wallets(path=None, env=None, default=()):
+    """Адреса для оплаты: файл (по одному в строке, # - комментарий), иначе список через запятую, иначе default"""
+    addresses = []
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            addresses = [line.split('#', 1)[0].strip() for line in f]
+    elif env:
+        addresses = [item.strip() for item in env.split(',')]
+    addresses = [address for address in addresses if address] or list(default)
+    # Дубликаты (в том числе в другом регистре) убираем, порядок сохраняем
+    seen = set()
+    return [address for address in addresses if not (address.lower() in seen or seen.add(address.lower()))]
+
+
+class WalletPool:
+    """Намерения оплаты подписки: кошелек и уникальная для него сумма.
+
+    Каждому покупателю выдается цена с дробной меткой (например, 30.0137 USDT), уникальной на кошельке,
+    поэтому один кошелек одновременно принимает оплаты многих пользователей, а перевод находит свой резерв
+    по сумме. Кошельки выдаются по кругу. Резервы хранятся в SQLite и переживают перезапуск,
+    проиндексированы по пользователю и по (адрес, сумма), истечение - колесо таймеров с шагом tick.
+    on_release(резерв) вызывается после снятия резерва, чтобы его ожидание перевода не досталось
+    следующему владельцу той же суммы"""
+
+    def __init__(self, path, wallets, reserve_time=3600, tick=WHEEL_TICK, tags=AMOUNT_TAGS, on_release=None):
+        self.path = path
+        self.on_release = on_release
+        self.reserve_time = reserve_time
+        self.tick = tick
+        self.tags = tags
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            # Список кошельков берется только из конфигурации; таблица прежних версий не нужна
+            self.conn.execute("DROP TABLE IF EXISTS wallets")
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS payment_intents
+                                 (user_id INTEGER PRIMARY KEY, address TEXT NOT NULL,
+                                  amount REAL NOT NULL, amount_units INTEGER NOT NULL, reserved_at REAL NOT NULL,
+                                  checking INTEGER NOT NULL DEFAULT 0, UNIQUE (address, amount_units))''')
+            self._migrate()
+        self.wallets = []  # адреса для новых резервов в порядке конфигурации
+        self.next_wallet = 0
+        self.by_user = {}  # user_id -> резерв
+        self.by_address = {}  # адрес -> {единицы суммы -> резерв}
+        self.wheel = {}  # номер шага -> set(user_id), срок которых истекает в этом шаге
+        self.wheel_position = int(time.time() // tick)
+        self.thread = None
+        self.stopping = threading.Event()
+        self.stats = {'reserved': 0, 'paid': 0, 'cancelled': 0, 'expired': 0, 'no_wallet': 0}
+        self.configure(wallets)
+        self._load()
+
+    def _migrate(self):
+        """Резервы прежнего формата (один пользователь на кошелек) переносятся с исходной суммой"""
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                   "AND name = 'wallet_reservations'").fetchone()
+        if not exists:
+            return
+        rows = self.conn.execute("SELECT user_id, address, amount, reserved_at, checking "
+                                 "FROM wallet_reservations").fetchall()
+        self.conn.executemany("INSERT OR IGNORE INTO payment_intents "
+                              "(user_id, address, amount, amount_units, reserved_at, checking) "
+                              "VALUES (?, ?, ?, ?, ?, ?)",
+                              [(user_id, address, amount, amount_units(amount), reserved_at, checking)
+                               for user_id, address, amount, reserved_at, checking in rows])
+        self.conn.execute("DROP TABLE wallet_reservations")
+
+    def configure(self, wallets):
+        """Набор кошельков из конфигурации; убранные отключаются, их резервы доживают до срока"""
+        with self.lock:
+            self.wallets = list(wallets)
+            self.next_wallet = 0
+
+    def _load(self):
+        now = time.time()
+        with self.lock:
+            rows = self.conn.execute("SELECT user_id, address, amount, amount_units, reserved_at, checking "
+                                     "FROM payment_intents").fetchall()
+            stale = []
+            for user_id, address, amount, units, reserved_at, checking in rows:
+                if reserved_at + self.reserve_time <= now:
+                    stale.append((user_id,))
+                    continue
+                self._add({'address': address, 'user_id': user_id, 'amount': amount, 'units': units,
+                           'reserved_at': reserved_at, 'checking': bool(checking)})
+            if stale:
+                with self.conn:
+                    self.conn.executemany("DELETE FROM payment_intents WHERE user_id = ?", stale)
+        if rows:
+            logger.info(f"Восстановлено резервов оплаты: {len(rows) - len(stale)}, устаревших: {len(stale)}")
+
+    def _slot(self, reservation):
+        # Шаг, к концу которого срок уже истек
+        return int((reservation['reserved_at'] + self.reserve_time) // self.tick) + 1
+
+    def _add(self, reservation):
+        self.by_user[reservation['user_id']] = reservation
+        self.by_address.setdefault(reservation['address'], {})[reservation['units']] = reservation
+        self.wheel.setdefault(self._slot(reservation), set()).add(reservation['user_id'])
+
+    def _remove(self, reservation):
+        """Снятие резерва из индексов и таблицы; сумма на кошельке снова свободна"""
+        user_id = reservation['user_id']
+        del self.by_user[user_id]
+        amounts = self.by_address[reservation['address']]
+        del amounts[reservation['units']]
+        if not amounts:
+            del self.by_address[reservation['address']]
+        slot = self.wheel.get(self._slot(reservation))
+        if slot is not None:
+            slot.discard(user_id)
+        with self.conn:
+            self.conn.execute("DELETE FROM payment_intents WHERE user_id = ?", (user_id,))
+
+    def _free_units(self, address, price):
+        """Свободная сумма с меткой на кошельке: сначала случайные попытки, затем перебор"""
+        base = amount_units(price)
+        taken = self.by_address.get(address, {})
+        for _ in range(TAG_ATTEMPTS):
+            units = base + random.randint(1, self.tags)
+            if units not in taken:
+                return units
+        for units in range(base + 1, base + self.tags + 1):
+            if units not in taken:
+                return units
+        return None
+
+    def get(self, user_id):
+        with self.lock:
+            return self.by_user.get(user_id)
+
+    def reserve(self, user_id, price):
+        """Кошелек и уникальная на нем сумма (price с дробной меткой); уже имеющийся резерв возвращается как есть.
+        None - на всех кошельках заняты все метки этой цены"""
+        self.expire()
+        with self.lock:
+            reservation = self.by_user.get(user_id)
+            if reservation is not None:
+                return reservation
+            for _ in range(len(self.wallets)):
+                address = self.wallets[self.next_wallet % len(self.wallets)]
+                self.next_wallet = (self.next_wallet + 1) % len(self.wallets)
+                units = self._free_units(address, price)
+                if units is not None:
+                    break
+            else:
+                self.stats['no_wallet'] += 1
+                return None
+            amount = units / 10 ** AMOUNT_DECIMALS
+            reservation = {'address': address, 'user_id': user_id, 'amount': amount, 'units': units,
+                           'reserved_at': time.time(), 'checking': False}
+            with self.conn:
+                self.conn.execute("INSERT INTO payment_intents (user_id, address, amount, amount_units, reserved_at) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  (user_id, address, amount, units, reservation['reserved_at']))
+            self._add(reservation)
+            self.stats['reserved'] += 1
+            return reservation
+
+    def begin_check(self, user_id):
+        """Отметка о начале проверки оплаты: (резерв, True) или (резерв, False), если уже проверяется"""
+        with self.lock:
+            reservation = self.by_user.get(user_id)
+            if reservation is None or reservation['checking']:
+                return reservation, False
+            self._set_checking(reservation, True)
+            return reservation, True
+
+    def end_check(self, reservation):
+        """Конец проверки без оплаты; резерв, срок которого истек во время проверки, снимается"""
+        with self.lock:
+            if self.by_user.get(reservation['user_id']) is not reservation:
+                return
+            if reservation['reserved_at'] + self.reserve_time > time.time():
+                self._set_checking(reservation, False)
+                return
+            self._remove(reservation)
+            self.stats['expired'] += 1
+        self._released([reservation])
+
+    def _released(self, reservations):
+        if self.on_release is None:
+            return
+        for reservation in reservations:
+            try:
+                self.on_release(reservation)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика снятия резерва {reservation['address']}: {e}")
+
+    def _set_checking(self, reservation, checking):
+        reservation['checking'] = checking
+        with self.conn:
+            self.conn.execute("UPDATE payment_intents SET checking = ? WHERE user_id = ?",
+                              (int(checking), reservation['user_id']))
+
+    def release(self, user_id, reservation=None, paid=False):
+        """Снятие резерва пользователя (или только указанного резерва, если он еще действует)"""
+        with self.lock:
+            current = self.by_user.get(user_id)
+            if current is None or (reservation is not None and current is not reservation):
+                return None
+            self._remove(current)
+            self.stats['paid' if paid else 'cancelled'] += 1
+        self._released([current])
+        return current
+
+    def checking(self):
+        """Резервы, проверка которых шла до перезапуска"""
+        with self.lock:
+            return [reservation for reservation in self.by_user.values() if reservation['checking']]
+
+    def expire(self, now=None):
+        """Снятие истекших резервов: проходятся только шаги колеса с прошлого вызова.
+        Резерв на проверке остается до ее результата: его снимает end_check"""
+        now = time.time() if now is None else now
+        current = int(now // self.tick)
+        expired = []
+        with self.lock:
+            while self.wheel_position <= current:
+                for user_id in self.wheel.pop(self.wheel_position, ()):
+                    reservation = self.by_user.get(user_id)
+                    if (reservation is not None and not reservation['checking']
+                            and reservation['reserved_at'] + self.reserve_time <= now):
+                        self._remove(reservation)
+                        expired.append(reservation)
+                self.wheel_position += 1
+            self.stats['expired'] += len(expired)
+        self._released(expired)
+        return len(expired)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='wallet_pool', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopping.wait(self.tick):
+            try:
+                self.expire()
+            except Exception as e:
+                logger.error(f"Ошибка снятия устаревших резервов кошельков: {e}")
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        with self.lock:
+            self.conn.close()
+
+    def summary(self):
+        """(резервов, на проверке, кошельков с ожидающими оплатами, всего кошельков)"""
+        with self.lock:
+            checking = sum(1 for reservation in self.by_user.values() if reservation['checking'])
+            return len(self.by_user), checking, len(self.by_address), len(self.wallets)